@@ -0,0 +1,54 @@
+"""add holds
+
+Revision ID: 2b9e4d7f1c38
+Revises: f3b6c8d2a415
+Create Date: 2026-10-18 20:31:52.418236
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2b9e4d7f1c38'
+down_revision: Union[str, None] = 'f3b6c8d2a415'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('holds',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('book_id', sa.String(), nullable=False),
+    sa.Column('placed_at', sa.DateTime(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('ready_at', sa.DateTime(), nullable=True),
+    sa.Column('expires_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['book_id'], ['books.isbn_number'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_holds_open_user_book', 'holds', ['user_id', 'book_id'], unique=True,
+        postgresql_where=sa.text("status IN ('waiting', 'ready')"),
+    )
+    op.create_index(
+        'ix_holds_waiting_book_id', 'holds', ['book_id', 'id'], unique=False,
+        postgresql_where=sa.text("status = 'waiting'"),
+    )
+    op.create_index(
+        'ix_holds_ready_expires_at', 'holds', ['expires_at'], unique=False,
+        postgresql_where=sa.text("status = 'ready'"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_holds_ready_expires_at', table_name='holds')
+    op.drop_index('ix_holds_waiting_book_id', table_name='holds')
+    op.drop_index('ix_holds_open_user_book', table_name='holds')
+    op.drop_table('holds')
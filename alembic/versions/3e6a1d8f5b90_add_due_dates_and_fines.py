@@ -0,0 +1,49 @@
+"""add due dates and fines
+
+Revision ID: 3e6a1d8f5b90
+Revises: 7d2f9c4b6e81
+Create Date: 2026-10-18 22:36:40.218854
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3e6a1d8f5b90'
+down_revision: Union[str, None] = '7d2f9c4b6e81'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('member_book', sa.Column('due_date', sa.DateTime(), nullable=True))
+    op.add_column('member_book', sa.Column('overdue', sa.Boolean(), server_default=sa.false(), nullable=False))
+    op.add_column('member_book', sa.Column('fine_cents', sa.Integer(), server_default='0', nullable=False))
+    # Existing borrows are due after the default 14 day loan period; the
+    # first overdue sweep marks the ones past it and computes their fines.
+    op.execute("""
+        UPDATE member_book SET due_date = coalesce(borrow_date, now() AT TIME ZONE 'utc') + interval '14 days'
+    """)
+    op.alter_column('member_book', 'due_date', nullable=False)
+
+    op.drop_index('ix_member_book_active_borrow_date', table_name='member_book')
+    op.create_index(
+        'ix_member_book_active_due_date', 'member_book', ['due_date', 'id'], unique=False,
+        postgresql_where=sa.text("status = 'borrowed'"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_member_book_active_due_date', table_name='member_book')
+    op.create_index(
+        'ix_member_book_active_borrow_date', 'member_book', ['borrow_date'], unique=False,
+        postgresql_where=sa.text("status = 'borrowed'"),
+    )
+    op.drop_column('member_book', 'fine_cents')
+    op.drop_column('member_book', 'overdue')
+    op.drop_column('member_book', 'due_date')
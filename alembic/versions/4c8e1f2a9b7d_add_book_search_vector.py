@@ -0,0 +1,42 @@
+"""add book search vector
+
+Revision ID: 4c8e1f2a9b7d
+Revises: ed311dad6903
+Create Date: 2026-10-18 09:12:04.118532
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c8e1f2a9b7d'
+down_revision: Union[str, None] = 'ed311dad6903'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Generated column, so PostgreSQL keeps it current on every insert/update.
+    # Title words are weighted A and author words B; search.py relies on this.
+    op.add_column('books', sa.Column(
+        'search_vector',
+        postgresql.TSVECTOR(),
+        sa.Computed(
+            "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(author, '')), 'B')",
+            persisted=True,
+        ),
+        nullable=True,
+    ))
+    op.create_index('ix_books_search_vector', 'books', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_books_search_vector', table_name='books', postgresql_using='gin')
+    op.drop_column('books', 'search_vector')
@@ -0,0 +1,35 @@
+"""add book similarities
+
+Revision ID: 5a9c2e7d4f13
+Revises: 3e6a1d8f5b90
+Create Date: 2026-10-18 23:12:05.604117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a9c2e7d4f13'
+down_revision: Union[str, None] = '3e6a1d8f5b90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('book_similarities',
+    sa.Column('book_id', sa.String(), nullable=False),
+    sa.Column('rank', sa.Integer(), nullable=False),
+    sa.Column('similar_book_id', sa.String(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['book_id'], ['books.isbn_number'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('book_id', 'rank')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('book_similarities')
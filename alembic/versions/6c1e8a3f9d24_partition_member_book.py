@@ -0,0 +1,131 @@
+"""partition member_book by borrow date
+
+Revision ID: 6c1e8a3f9d24
+Revises: 5a9c2e7d4f13
+Create Date: 2026-10-19 00:41:17.385206
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6c1e8a3f9d24'
+down_revision: Union[str, None] = '5a9c2e7d4f13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = "id, user_id, book_id, copy_id, borrow_date, due_date, return_date, status, overdue, fine_cents"
+INDEXES = (
+    'ix_member_book_id', 'ix_member_book_book_id', 'ix_member_book_copy_id', 'ix_member_book_active_copy_id',
+    'ix_member_book_active_due_date', 'ix_member_book_active_user_book', 'ix_member_book_user_borrow_date',
+)
+
+
+def _member_book_columns():
+    return [
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('member_book_id_seq'::regclass)"), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('book_id', sa.String(), nullable=True),
+        sa.Column('copy_id', sa.Integer(), nullable=True),
+        sa.Column('borrow_date', sa.DateTime(), nullable=False),
+        sa.Column('due_date', sa.DateTime(), nullable=False),
+        sa.Column('return_date', sa.DateTime(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('overdue', sa.Boolean(), server_default=sa.false(), nullable=False),
+        sa.Column('fine_cents', sa.Integer(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['book_id'], ['books.isbn_number'], name='member_book_book_id_fkey'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], name='member_book_user_id_fkey'),
+        sa.ForeignKeyConstraint(['copy_id'], ['copies.id'], name='member_book_copy_id_fkey', ondelete='SET NULL'),
+    ]
+
+
+def _create_indexes(unique_active: bool):
+    active = sa.text("status = 'borrowed'")
+    op.create_index('ix_member_book_id', 'member_book', ['id'], unique=False)
+    op.create_index('ix_member_book_book_id', 'member_book', ['book_id'], unique=False)
+    op.create_index('ix_member_book_copy_id', 'member_book', ['copy_id'], unique=False)
+    op.create_index(
+        'ix_member_book_active_copy_id', 'member_book', ['copy_id'], unique=unique_active, postgresql_where=active,
+    )
+    op.create_index('ix_member_book_active_due_date', 'member_book', ['due_date', 'id'], postgresql_where=active)
+    op.create_index(
+        'ix_member_book_active_user_book', 'member_book', ['user_id', 'book_id'], unique=unique_active,
+        postgresql_where=active,
+    )
+    op.create_index('ix_member_book_user_borrow_date', 'member_book', ['user_id', 'borrow_date'], unique=False)
+
+
+def _replace_member_book(partitioned: bool):
+    """Rebuild member_book with the same rows, keeping its id sequence."""
+    op.execute("ALTER SEQUENCE member_book_id_seq OWNED BY NONE")
+    op.rename_table('member_book', 'member_book_old')
+    for index in INDEXES:
+        op.drop_index(index, table_name='member_book_old')
+    op.execute("ALTER TABLE member_book_old RENAME CONSTRAINT member_book_pkey TO member_book_old_pkey")
+
+    if partitioned:
+        op.create_table(
+            'member_book', *_member_book_columns(),
+            sa.PrimaryKeyConstraint('id', 'borrow_date', name='member_book_pkey'),
+            postgresql_partition_by='RANGE (borrow_date)',
+        )
+        # A partition per month from the oldest borrow to three months ahead;
+        # archive.py keeps creating them from here on
+        op.execute("""
+            DO $$
+            DECLARE
+                period date := date_trunc('month', coalesce(
+                    (SELECT min(borrow_date) FROM member_book_old), now() AT TIME ZONE 'utc'
+                ));
+                final_period date := date_trunc('month', now() AT TIME ZONE 'utc') + interval '3 months';
+            BEGIN
+                WHILE period <= final_period LOOP
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF member_book FOR VALUES FROM (%L) TO (%L)',
+                        'member_book_' || to_char(period, 'YYYY_MM'), period, period + interval '1 month'
+                    );
+                    period := period + interval '1 month';
+                END LOOP;
+            END $$
+        """)
+        op.execute("CREATE TABLE member_book_default PARTITION OF member_book DEFAULT")
+    else:
+        op.create_table(
+            'member_book', *_member_book_columns(),
+            sa.PrimaryKeyConstraint('id', name='member_book_pkey'),
+        )
+
+    op.execute(f"INSERT INTO member_book ({COLUMNS}) SELECT {COLUMNS} FROM member_book_old")
+    op.drop_table('member_book_old')
+    op.execute("ALTER SEQUENCE member_book_id_seq OWNED BY member_book.id")
+    # Indexes on the partitioned table are created on every partition, and
+    # faster to build once the rows are in
+    _create_indexes(unique_active=not partitioned)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # borrow_date becomes the partition key, which cannot be null
+    op.execute("UPDATE member_book SET borrow_date = due_date - interval '14 days' WHERE borrow_date IS NULL")
+    _replace_member_book(partitioned=True)
+
+    op.create_table('member_book_archive',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('period', sa.Date(), nullable=False),
+    sa.Column('borrows', sa.Integer(), nullable=False),
+    sa.Column('records', sa.LargeBinary(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_member_book_archive_user_period', 'member_book_archive', ['user_id', 'period'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Archived borrows are not moved back into member_book
+    op.drop_index('ix_member_book_archive_user_period', table_name='member_book_archive')
+    op.drop_table('member_book_archive')
+    _replace_member_book(partitioned=False)
@@ -0,0 +1,119 @@
+"""add copies
+
+Revision ID: 7d2f9c4b6e81
+Revises: 2b9e4d7f1c38
+Create Date: 2026-10-18 21:47:13.905126
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2f9c4b6e81'
+down_revision: Union[str, None] = '2b9e4d7f1c38'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('copies',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('book_id', sa.String(), nullable=False),
+    sa.Column('barcode', sa.String(length=64), nullable=False),
+    sa.Column('branch', sa.String(length=100), nullable=True),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.ForeignKeyConstraint(['book_id'], ['books.isbn_number'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('barcode')
+    )
+    op.create_index(op.f('ix_copies_book_id'), 'copies', ['book_id'], unique=False)
+    op.create_index(
+        'ix_copies_available_book_branch', 'copies', ['book_id', 'branch'], unique=False,
+        postgresql_where=sa.text("status = 'available'"),
+    )
+    op.create_table('book_availability',
+    sa.Column('book_id', sa.String(), nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.Column('total_copies', sa.Integer(), nullable=False),
+    sa.Column('available_copies', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['book_id'], ['books.isbn_number'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('book_id', 'shard')
+    )
+    op.add_column('member_book', sa.Column('copy_id', sa.Integer(), nullable=True))
+    op.create_foreign_key(
+        'member_book_copy_id_fkey', 'member_book', 'copies', ['copy_id'], ['id'], ondelete='SET NULL'
+    )
+    op.create_index(op.f('ix_member_book_copy_id'), 'member_book', ['copy_id'], unique=False)
+    op.add_column('holds', sa.Column('copy_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('holds_copy_id_fkey', 'holds', 'copies', ['copy_id'], ['id'], ondelete='SET NULL')
+
+    # Every existing title becomes one copy labelled "<isbn>-1". A title that
+    # is unavailable is either reserved by a ready hold or out on loan.
+    op.execute("""
+        INSERT INTO copies (book_id, barcode, branch, status)
+        SELECT isbn_number, isbn_number || '-1', NULL,
+            CASE
+                WHEN availability_status IS NOT false THEN 'available'
+                WHEN EXISTS (SELECT 1 FROM holds WHERE holds.book_id = books.isbn_number AND holds.status = 'ready')
+                    THEN 'reserved'
+                ELSE 'borrowed'
+            END
+        FROM books
+    """)
+    op.execute("""
+        INSERT INTO book_availability (book_id, shard, total_copies, available_copies)
+        SELECT book_id, 0, count(*), count(*) FILTER (WHERE status = 'available')
+        FROM copies GROUP BY book_id
+    """)
+    op.execute("UPDATE member_book SET copy_id = copies.id FROM copies WHERE copies.book_id = member_book.book_id")
+    op.execute("""
+        UPDATE holds SET copy_id = copies.id FROM copies
+        WHERE copies.book_id = holds.book_id AND holds.status = 'ready'
+    """)
+
+    # One active borrow per copy instead of per title, and one copy of a title per member
+    op.drop_index('ix_member_book_active_book_id', table_name='member_book')
+    op.create_index(
+        'ix_member_book_active_copy_id', 'member_book', ['copy_id'], unique=True,
+        postgresql_where=sa.text("status = 'borrowed'"),
+    )
+    op.drop_index('ix_member_book_active_user_book', table_name='member_book')
+    op.create_index(
+        'ix_member_book_active_user_book', 'member_book', ['user_id', 'book_id'], unique=True,
+        postgresql_where=sa.text("status = 'borrowed'"),
+    )
+    op.drop_column('books', 'availability_status')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Titles with several copies collapse into one flag: available if any copy is
+    op.add_column('books', sa.Column('availability_status', sa.Boolean(), nullable=True))
+    op.execute("""
+        UPDATE books SET availability_status = EXISTS (
+            SELECT 1 FROM copies WHERE copies.book_id = books.isbn_number AND copies.status = 'available'
+        )
+    """)
+    op.drop_index('ix_member_book_active_user_book', table_name='member_book')
+    op.create_index(
+        'ix_member_book_active_user_book', 'member_book', ['user_id', 'book_id'], unique=False,
+        postgresql_where=sa.text("status = 'borrowed'"),
+    )
+    op.drop_index('ix_member_book_active_copy_id', table_name='member_book')
+    op.create_index(
+        'ix_member_book_active_book_id', 'member_book', ['book_id'], unique=True,
+        postgresql_where=sa.text("status = 'borrowed'"),
+    )
+    op.drop_constraint('holds_copy_id_fkey', 'holds', type_='foreignkey')
+    op.drop_column('holds', 'copy_id')
+    op.drop_index(op.f('ix_member_book_copy_id'), table_name='member_book')
+    op.drop_constraint('member_book_copy_id_fkey', 'member_book', type_='foreignkey')
+    op.drop_column('member_book', 'copy_id')
+    op.drop_table('book_availability')
+    op.drop_index('ix_copies_available_book_branch', table_name='copies')
+    op.drop_index(op.f('ix_copies_book_id'), table_name='copies')
+    op.drop_table('copies')
@@ -0,0 +1,37 @@
+"""add overdue stats
+
+Revision ID: 8b4f2c6e0d57
+Revises: 6c1e8a3f9d24
+Create Date: 2026-10-18 21:14:52.306118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b4f2c6e0d57'
+down_revision: Union[str, None] = '6c1e8a3f9d24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('overdue_stats',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('overdue_books', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # Start from the borrows already marked, rather than zero until the next sweep
+    op.execute(
+        "INSERT INTO overdue_stats (id, overdue_books) "
+        "SELECT 1, count(*) FROM member_book WHERE status = 'borrowed' AND overdue"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('overdue_stats')
@@ -0,0 +1,43 @@
+"""add active borrow unique index
+
+Revision ID: 9a3d5e7c1f24
+Revises: 4c8e1f2a9b7d
+Create Date: 2026-10-18 11:40:52.604217
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a3d5e7c1f24'
+down_revision: Union[str, None] = '4c8e1f2a9b7d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # The index cannot be built over duplicate active borrows left by earlier
+    # races: keep the oldest borrow of each book and return the others.
+    op.execute("""
+        UPDATE member_book SET status = 'returned', return_date = timezone('utc', now())
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (PARTITION BY book_id ORDER BY borrow_date, id) AS position
+                FROM member_book WHERE status = 'borrowed'
+            ) AS active
+            WHERE position > 1
+        )
+    """)
+    op.create_index(
+        'ix_member_book_active_book_id', 'member_book', ['book_id'], unique=True,
+        postgresql_where=sa.text("status = 'borrowed'"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_member_book_active_book_id', table_name='member_book')
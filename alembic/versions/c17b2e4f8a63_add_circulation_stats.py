@@ -0,0 +1,77 @@
+"""add circulation stats
+
+Revision ID: c17b2e4f8a63
+Revises: 9a3d5e7c1f24
+Create Date: 2026-10-18 14:05:31.772940
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c17b2e4f8a63'
+down_revision: Union[str, None] = '9a3d5e7c1f24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('category_stats',
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.Column('total_books', sa.Integer(), nullable=False),
+    sa.Column('borrowed_books', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['category_id'], ['categories.id'], ),
+    sa.PrimaryKeyConstraint('category_id', 'shard')
+    )
+    op.create_table('book_circulation',
+    sa.Column('book_id', sa.String(), nullable=False),
+    sa.Column('borrow_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['book_id'], ['books.isbn_number'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('book_id')
+    )
+    op.create_index(op.f('ix_book_circulation_borrow_count'), 'book_circulation', ['borrow_count'], unique=False)
+    op.create_table('daily_circulation',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.Column('borrows', sa.Integer(), nullable=False),
+    sa.Column('returns', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'shard')
+    )
+    op.create_index(
+        'ix_member_book_active_borrow_date', 'member_book', ['borrow_date'], unique=False,
+        postgresql_where=sa.text("status = 'borrowed'"),
+    )
+
+    # Backfill the counters from existing data into shard 0
+    op.execute("""
+        INSERT INTO category_stats (category_id, shard, total_books, borrowed_books)
+        SELECT category_id, 0, count(*), count(*) FILTER (WHERE availability_status = false)
+        FROM books GROUP BY category_id
+    """)
+    op.execute("""
+        INSERT INTO book_circulation (book_id, borrow_count)
+        SELECT book_id, count(*) FROM member_book WHERE book_id IS NOT NULL GROUP BY book_id
+    """)
+    op.execute("""
+        INSERT INTO daily_circulation (day, shard, borrows, returns)
+        SELECT day, 0, sum(borrows), sum(returns) FROM (
+            SELECT borrow_date::date AS day, 1 AS borrows, 0 AS returns FROM member_book WHERE borrow_date IS NOT NULL
+            UNION ALL
+            SELECT return_date::date, 0, 1 FROM member_book WHERE return_date IS NOT NULL
+        ) AS events
+        GROUP BY day
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_member_book_active_borrow_date', table_name='member_book')
+    op.drop_table('daily_circulation')
+    op.drop_index(op.f('ix_book_circulation_borrow_count'), table_name='book_circulation')
+    op.drop_table('book_circulation')
+    op.drop_table('category_stats')
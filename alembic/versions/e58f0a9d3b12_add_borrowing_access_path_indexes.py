@@ -0,0 +1,41 @@
+"""add borrowing access path indexes
+
+Revision ID: e58f0a9d3b12
+Revises: c17b2e4f8a63
+Create Date: 2026-10-18 15:21:47.093318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e58f0a9d3b12'
+down_revision: Union[str, None] = 'c17b2e4f8a63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # borrow_book / return_book: a member's active borrow of one book
+    op.create_index(
+        'ix_member_book_active_user_book', 'member_book', ['user_id', 'book_id'], unique=False,
+        postgresql_where=sa.text("status = 'borrowed'"),
+    )
+    # get_borrowing_history: a member's records in date order
+    op.create_index('ix_member_book_user_borrow_date', 'member_book', ['user_id', 'borrow_date'], unique=False)
+    # foreign key lookups when a book is deleted or its history is read
+    op.create_index(op.f('ix_member_book_book_id'), 'member_book', ['book_id'], unique=False)
+    # search_books category filter and per-category recounts
+    op.create_index(op.f('ix_books_category_id'), 'books', ['category_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_books_category_id'), table_name='books')
+    op.drop_index(op.f('ix_member_book_book_id'), table_name='member_book')
+    op.drop_index('ix_member_book_user_borrow_date', table_name='member_book')
+    op.drop_index('ix_member_book_active_user_book', table_name='member_book')
@@ -0,0 +1,33 @@
+"""add resource versions
+
+Revision ID: f3b6c8d2a415
+Revises: e58f0a9d3b12
+Create Date: 2026-10-18 16:48:09.517604
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b6c8d2a415'
+down_revision: Union[str, None] = 'e58f0a9d3b12'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('resource_versions',
+    sa.Column('resource', sa.String(), nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('resource', 'shard')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('resource_versions')
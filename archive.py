@@ -0,0 +1,275 @@
+"""
+Monthly partitions of member_book and the cold borrowing history archive.
+
+member_book is range partitioned by borrow_date, one partition per month
+(member_book_YYYY_MM) plus member_book_default for anything outside them.
+Maintenance creates the partitions for the next PARTITION_PREMAKE_MONTHS
+months, so borrows never land in the default partition, then archives each
+month older than ARCHIVE_AFTER_MONTHS: its returned borrows are packed into
+member_book_archive, one zlib compressed row per member, and the month's
+partition is dropped once no active borrow is left in it. Dropping a
+partition frees its space at once, with no dead rows left for vacuum.
+
+Borrowing history reads member_book first and then the archive (see
+read_archived_history), so archiving is invisible to members.
+
+Run it daily, e.g. from cron (a Postgres advisory lock keeps runs apart):
+    python -m archive
+"""
+import argparse
+import datetime
+import json
+import logging
+import re
+import sys
+import zlib
+from itertools import groupby
+from operator import attrgetter, itemgetter
+from typing import Optional
+from decouple import config
+from sqlalchemy import delete, func, insert, or_, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from database import get_engine
+from models import MemberBook, MemberBookArchive
+
+PARTITION_PREMAKE_MONTHS = config("partition_premake_months", default=3, cast=int)
+ARCHIVE_AFTER_MONTHS = config("archive_after_months", default=12, cast=int)
+# Archived borrows are deleted after this many months; 0 keeps them forever
+ARCHIVE_RETENTION_MONTHS = config("archive_retention_months", default=0, cast=int)
+# Borrows archived per INSERT and DELETE
+ARCHIVE_BATCH_SIZE = config("archive_batch_size", default=10000, cast=int)
+
+# Key of the advisory lock held by the process running maintenance
+MAINTENANCE_LOCK_KEY = 0x61726368
+
+RECORD_FIELDS = ("id", "book_id", "copy_id", "borrow_date", "due_date", "return_date", "status", "overdue", "fine_cents")
+DATE_FIELDS = ("borrow_date", "due_date", "return_date")
+PARTITION_NAME = re.compile(r"^member_book_(\d{4})_(\d{2})$")
+
+logger = logging.getLogger("api.archive")
+
+
+def month_start(value) -> datetime.date:
+    return datetime.date(value.year, value.month, 1)
+
+
+def add_months(month: datetime.date, months: int) -> datetime.date:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: datetime.date) -> str:
+    return f"member_book_{month:%Y_%m}"
+
+
+def pack_records(rows) -> bytes:
+    """Compress borrow rows, in the order given, for member_book_archive."""
+    values = [[getattr(row, field) for field in RECORD_FIELDS] for row in rows]
+    return zlib.compress(json.dumps(values, separators=(",", ":"), default=datetime.datetime.isoformat).encode("utf-8"))
+
+
+def unpack_records(blob: bytes) -> list[dict]:
+    records = []
+    for values in json.loads(zlib.decompress(blob)):
+        record = dict(zip(RECORD_FIELDS, values))
+        for field in DATE_FIELDS:
+            if record[field] is not None:
+                record[field] = datetime.datetime.fromisoformat(record[field])
+        records.append(record)
+    return records
+
+
+def partition_months(session: Session) -> list[datetime.date]:
+    """Months that have their own member_book partition."""
+    names = session.scalars(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'member_book'::regclass"
+    ))
+    months = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append(datetime.date(int(match[1]), int(match[2]), 1))
+    return sorted(months)
+
+
+def create_partitions(session: Session, first: datetime.date, last: datetime.date) -> list[str]:
+    """Create the missing monthly partitions from `first` through `last`."""
+    existing = set(partition_months(session))
+    created = []
+    month = first
+    while month <= last:
+        if month not in existing:
+            session.execute(text(
+                f'CREATE TABLE "{partition_name(month)}" PARTITION OF member_book '
+                f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+            ))
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    session.commit()
+    return created
+
+
+def archive_month(session: Session, month: datetime.date, partitioned: bool) -> dict:
+    """
+    Move a month's returned borrows to member_book_archive in one
+    transaction, and drop the month's partition if nothing else is left in it.
+    """
+    in_month = (MemberBook.borrow_date >= month, MemberBook.borrow_date < add_months(month, 1))
+    # Active borrows (and rows without a member) stay, and so does the partition
+    keep_partition = session.scalar(select(MemberBook.id).where(
+        *in_month, or_(MemberBook.status.is_distinct_from("returned"), MemberBook.user_id.is_(None))
+    ).limit(1)) is not None
+    drop = partitioned and not keep_partition and month in partition_months(session)
+
+    rows = session.execute(
+        select(*(getattr(MemberBook, field) for field in RECORD_FIELDS), MemberBook.user_id)
+        .where(*in_month, MemberBook.status == "returned", MemberBook.user_id.is_not(None))
+        .order_by(MemberBook.user_id, MemberBook.borrow_date.desc(), MemberBook.id.desc())
+        .execution_options(yield_per=ARCHIVE_BATCH_SIZE)
+    )
+    archived = 0
+    packed, keys = [], []
+
+    def flush():
+        if packed:
+            session.execute(insert(MemberBookArchive), packed)
+        # A dropped partition takes its rows with it
+        if keys and not drop:
+            session.execute(delete(MemberBook).where(
+                *in_month, tuple_(MemberBook.id, MemberBook.borrow_date).in_(keys)
+            ))
+        packed.clear()
+        keys.clear()
+
+    for user_id, records in groupby(rows, key=attrgetter("user_id")):
+        records = list(records)
+        packed.append({"user_id": user_id, "period": month, "borrows": len(records), "records": pack_records(records)})
+        keys.extend((record.id, record.borrow_date) for record in records)
+        archived += len(records)
+        if len(keys) >= ARCHIVE_BATCH_SIZE:
+            flush()
+    flush()
+
+    if drop:
+        name = partition_name(month)
+        session.execute(text(f'ALTER TABLE member_book DETACH PARTITION "{name}"'))
+        session.execute(text(f'DROP TABLE "{name}"'))
+    session.commit()
+    return {"month": month.isoformat(), "archived": archived, "partition_dropped": drop}
+
+
+def maintain_history(session: Session, today: Optional[datetime.date] = None) -> dict:
+    """Create upcoming partitions, archive old months and expire old archives."""
+    current = month_start(today or datetime.datetime.utcnow())
+    partitioned = session.get_bind().dialect.name == "postgresql"
+    report = {"partitions_created": [], "months": [], "archive_rows_expired": 0}
+
+    if partitioned:
+        report["partitions_created"] = create_partitions(
+            session, current, add_months(current, PARTITION_PREMAKE_MONTHS)
+        )
+
+    if ARCHIVE_AFTER_MONTHS > 0:
+        cutoff = add_months(current, -ARCHIVE_AFTER_MONTHS)
+        if partitioned:
+            months = [month for month in partition_months(session) if month < cutoff]
+        else:
+            oldest = session.scalar(select(func.min(MemberBook.borrow_date)).where(MemberBook.borrow_date < cutoff))
+            months = []
+            month = month_start(oldest) if oldest is not None else cutoff
+            while month < cutoff:
+                months.append(month)
+                month = add_months(month, 1)
+        for month in months:
+            result = archive_month(session, month, partitioned)
+            if result["archived"] or result["partition_dropped"]:
+                logger.info("Archived %(archived)d borrows from %(month)s", result)
+                report["months"].append(result)
+
+    if ARCHIVE_RETENTION_MONTHS > 0:
+        expired = session.execute(delete(MemberBookArchive).where(
+            MemberBookArchive.period < add_months(current, -ARCHIVE_RETENTION_MONTHS)
+        ))
+        session.commit()
+        report["archive_rows_expired"] = expired.rowcount
+    return report
+
+
+def run_history_maintenance() -> Optional[dict]:
+    """Run maintenance on a dedicated connection; returns None if another process is already running it."""
+    with get_engine().connect() as connection:
+        postgres = connection.dialect.name == "postgresql"
+        if postgres:
+            if not connection.scalar(select(func.pg_try_advisory_lock(MAINTENANCE_LOCK_KEY))):
+                return None
+            connection.commit()
+        try:
+            with Session(bind=connection) as session:
+                return maintain_history(session)
+        finally:
+            if postgres:
+                connection.scalar(select(func.pg_advisory_unlock(MAINTENANCE_LOCK_KEY)))
+                connection.commit()
+
+
+def _utc_naive(value: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+async def read_archived_history(
+    db: AsyncSession,
+    user_id: int,
+    limit: int,
+    before: Optional[tuple] = None,
+    after: Optional[tuple] = None,
+    from_date: Optional[datetime.datetime] = None,
+    to_date: Optional[datetime.datetime] = None,
+) -> list[dict]:
+    """
+    Up to `limit` of a member's archived borrows, newest first: borrowed in
+    [from_date, to_date), with (borrow_date, id) below `before` and above `after`.
+    """
+    from_date, to_date = _utc_naive(from_date), _utc_naive(to_date)
+    query = select(MemberBookArchive.period, MemberBookArchive.records).where(MemberBookArchive.user_id == user_id)
+    newest = min((value for value in (to_date, before and before[0]) if value), default=None)
+    oldest = max((value for value in (from_date, after and after[0]) if value), default=None)
+    if newest is not None:
+        query = query.where(MemberBookArchive.period <= month_start(newest))
+    if oldest is not None:
+        query = query.where(MemberBookArchive.period >= month_start(oldest))
+    archived = (await db.execute(query.order_by(MemberBookArchive.period.desc()))).all()
+
+    records = []
+    for _, months in groupby(archived, key=itemgetter(0)):
+        # Earlier months cannot hold anything newer than what was found
+        if len(records) >= limit:
+            break
+        for _, blob in months:
+            for record in unpack_records(blob):
+                key = (record["borrow_date"], record["id"])
+                if ((from_date is None or record["borrow_date"] >= from_date)
+                        and (to_date is None or record["borrow_date"] < to_date)
+                        and (before is None or key < before)
+                        and (after is None or key > after)):
+                    records.append(record)
+    records.sort(key=itemgetter("borrow_date", "id"), reverse=True)
+    return records[:limit]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Create member_book partitions ahead of time and archive old returned borrows."
+    )
+    parser.parse_args(argv)
+    result = run_history_maintenance()
+    json.dump(result or {"skipped": "another process is running maintenance"}, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,69 @@
 from fastapi import HTTPException, Depends
 from fastapi.security.api_key import APIKeyHeader
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 import jwt
-import bcrypt
 import datetime
-from database import get_db
+from cache import CacheBackend, LRUCache
+from passwords import PasswordHasherPool, PasswordPoolSaturated
+from database import get_async_db
+from middleware.request_context import set_request_user
 from models import User
 from decouple import config
 
-SECRET_KEY = config("secret")
-ALGORITHM = config("algorithm")
+# Required, but only checked by check_auth_settings() at startup so that
+# importing this module never fails
+SECRET_KEY = config("secret", default=None)
+ALGORITHM = config("algorithm", default=None)
+PRINCIPAL_CACHE_SIZE = config("principal_cache_size", default=10000, cast=int)
+PRINCIPAL_CACHE_TTL = config("principal_cache_ttl", default=60, cast=int)
+# When enabled, role-only checks use the role claim of the signed token
+# instead of loading the user.
+TRUST_TOKEN_ROLE = config("trust_token_role", default=False, cast=bool)
+BCRYPT_ROUNDS = config("bcrypt_rounds", default=12, cast=int)
+PASSWORD_POOL_WORKERS = config("password_pool_workers", default=2, cast=int)
+PASSWORD_POOL_MAX_PENDING = config("password_pool_max_pending", default=16, cast=int)
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+password_pool = PasswordHasherPool(
+    workers=PASSWORD_POOL_WORKERS,
+    max_pending=PASSWORD_POOL_MAX_PENDING,
+    rounds=BCRYPT_ROUNDS,
+)
 
-def verify_password(password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+def check_auth_settings():
+    """Fail startup, rather than the first login, when the token settings are missing."""
+    missing = [name for name, value in (("secret", SECRET_KEY), ("algorithm", ALGORITHM)) if not value]
+    if missing:
+        raise RuntimeError(f"Missing settings in .env: {', '.join(missing)}")
+
+
+def _password_pool_busy():
+    return HTTPException(
+        status_code=503,
+        detail="Too many password operations in progress, please retry",
+        headers={"Retry-After": "1"},
+    )
+
+async def hash_password_async(password: str) -> str:
+    try:
+        return await password_pool.hash_async(password)
+    except PasswordPoolSaturated:
+        raise _password_pool_busy()
+
+async def verify_password_async(password: str, hashed_password: str) -> bool:
+    try:
+        return await password_pool.verify_async(password, hashed_password)
+    except PasswordPoolSaturated:
+        raise _password_pool_busy()
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True when the stored hash was made with a different cost than BCRYPT_ROUNDS."""
+    return password_pool.needs_rehash(hashed_password)
 
 def create_jwt_token(user_id: int, role: str):
     expiration = datetime.datetime.utcnow() + datetime.timedelta(days=7)
@@ -32,24 +77,89 @@ def create_jwt_token(user_id: int, role: str):
 #     return user
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """
-    Extract user information from the JWT token and fetch user from DB.
-    """
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("user_id")
-        role = payload.get("role")
+class Principal:
+    """The authenticated caller: a detached snapshot of the user's columns."""
 
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Invalid token: No user ID found")
+    def __init__(self, id: int, role: str, name: str = None, email: str = None, phone_number: int = None):
+        self.id = id
+        self.role = role
+        self.name = name
+        self.email = email
+        self.phone_number = phone_number
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(id=user.id, role=user.role, name=user.name, email=user.email, phone_number=user.phone_number)
 
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
 
+principal_cache: CacheBackend = LRUCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
+
+def set_principal_cache(cache: CacheBackend):
+    """Replace the principal cache, e.g. with a backend shared between workers."""
+    global principal_cache
+    principal_cache = cache
+
+
+def decode_token(token: str = Depends(oauth2_scheme)) -> dict:
+    """Verify the JWT and return its claims."""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+
+    if not payload.get("user_id"):
+        raise HTTPException(status_code=401, detail="Invalid token: No user ID found")
+    set_request_user(payload["user_id"])
+    return payload
+
+
+async def get_current_user(payload: dict = Depends(decode_token), db: AsyncSession = Depends(get_async_db)):
+    """
+    Extract user information from the JWT token and fetch user from the
+    principal cache, falling back to the DB.
+    """
+    user_id = payload["user_id"]
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        user = await db.get(User, user_id)
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+        principal = Principal.from_user(user)
+        principal_cache.set(user_id, principal)
+        # Give the connection back before the handler runs; read handlers
+        # query through a session of their own
+        await db.rollback()
+    return principal
+
+
+async def get_current_principal(payload: dict = Depends(decode_token), db: AsyncSession = Depends(get_async_db)):
+    """
+    Caller for role-only checks: built from the token claims alone when
+    TRUST_TOKEN_ROLE is enabled, otherwise the same as get_current_user.
+    """
+    if TRUST_TOKEN_ROLE and payload.get("role"):
+        return Principal(id=payload["user_id"], role=payload["role"])
+    return await get_current_user(payload, db)
+
+
+# Drop cached principals once a change to their user row is committed.
+
+@event.listens_for(Session, "after_flush")
+def _collect_modified_users(session, flush_context):
+    for obj in session.dirty | session.deleted:
+        if isinstance(obj, User):
+            session.info.setdefault("modified_user_ids", set()).add(obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_modified_users(session):
+    for user_id in session.info.pop("modified_user_ids", ()):
+        principal_cache.delete(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_modified_users(session):
+    session.info.pop("modified_user_ids", None)
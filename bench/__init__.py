@@ -0,0 +1,20 @@
+"""
+Benchmarks: a seeded data generator (bench.generate), load scenarios against
+the API (bench.harness), micro-benchmarks (bench.micro) and a comparison of
+two result files (bench.compare).
+"""
+import os
+import tempfile
+
+# Settings for in-process runs, unless set in the environment. Application
+# modules read their settings on import, so these are applied on importing bench.
+DEFAULTS = {
+    "secret": "bench-secret",
+    "algorithm": "HS256",
+    "rate_limit_enabled": "False",
+    "overdue_sweep_interval": "0",
+    "access_log_path": os.path.join(tempfile.gettempdir(), "library-bench", "access.log"),
+}
+
+for name, value in DEFAULTS.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,695 @@
+"""
+Correctness checks against seeded data, for behaviour the load numbers
+cannot show. Each check drives the API in process and reports what it
+found as JSON; the run exits 1 if any check fails:
+
+- plans: the queries behind the hot routes (book list, search, history,
+  overdues, availability and borrowing) use their indexes; EXPLAIN must show
+  no sequential scan and each expected index
+- cursors: tampered pagination cursors, including ones with timezone-aware
+  datetimes, are refused with 400, not a server error
+- category_search: a search by category alone lists that category's books,
+  most borrowed first
+- overdue_stats: the dashboard's overdue count agrees with GET /overdues,
+  before and after a sweep marks a newly overdue borrow
+- hold_expiry: the sweep expires a ready hold past its pickup window and
+  passes the copy to the next member waiting, then back to the shelf
+- concurrent_borrow: of many members borrowing a single-copy title at once,
+  exactly one succeeds, and the copy and the counters agree afterwards
+- duplicate_borrow: of many concurrent borrows of one title by one member,
+  exactly one succeeds, though copies are left on the shelf
+- return_fines: returning a book late, alone or in a batch, records its
+  final fine without waiting for a sweep, and takes it off the overdue count
+- history_statements: each page of a member's borrowing history takes the
+  same number of queries, for short and long histories, before and after
+  old months are archived, and paging still returns every borrow once
+- pool_saturation: ten times as many concurrent reads as the connection pool
+  holds, each authenticating an uncached member, all finish long before
+  db_pool_timeout
+- shedding: after a burst of slow connection checkouts expensive requests
+  are shed, and stop being shed once the burst has decayed
+- rate_limit_buckets: a request refused by the user bucket takes no tokens
+  from the IP bucket
+
+By default the checks seed a temporary SQLite file at the tiny scale. With
+database_url set they seed that database instead, deleting its rows first,
+so point it at a scratch database (on Postgres, migrated to head):
+    python -m bench.checks
+    database_url=postgresql://bench@localhost/scratch python -m bench.checks cursors
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import datetime
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import traceback
+from collections import Counter
+from sqlalchemy import event, func, select, text, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from bench.generate import SCALES, isbn_for
+from database import get_engine
+from models import Book, BookCirculation, CategoryStats, Copy, Hold, MemberBook
+
+
+class CheckFailed(Exception):
+    """A check found the API misbehaving."""
+
+
+def expect(condition, message: str):
+    if not condition:
+        raise CheckFailed(message)
+
+
+def _busiest_member() -> int:
+    """The member with the most borrows, for checks that need long histories."""
+    with Session(get_engine()) as session:
+        return session.execute(
+            select(MemberBook.user_id).group_by(MemberBook.user_id).order_by(func.count().desc()).limit(1)
+        ).scalar_one()
+
+
+def _single_copy_titles(count: int, skip: int = 0) -> list[str]:
+    """ISBNs of titles with one copy, on the shelf."""
+    with Session(get_engine()) as session:
+        return list(session.scalars(
+            select(Book.isbn_number)
+            .where(Book.total_copies == 1, Book.available_copies == 1)
+            .order_by(Book.isbn_number)
+            .offset(skip)
+            .limit(count)
+        ))
+
+
+def _raw_cursor(value) -> str:
+    """A cursor carrying any JSON `value`, as a client could forge one."""
+    return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+@contextlib.contextmanager
+def _statements():
+    """Collect (statement, parameters) for every cursor execution on the primary meanwhile."""
+    executed = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        executed.append((statement, parameters[0] if executemany else parameters))
+
+    engine = get_engine()
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield executed
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+# Checks: each takes the ASGI client and a bench.harness Context, and returns what it observed
+
+# Indexes each hot route's queries must use, as groups of which one must
+# appear in the plans. "pk:<table>" is the table's primary key index.
+PLAN_EXPECTATIONS = {
+    "book list": [{"ix_books_isbn_number", "pk:books"}, {"pk:book_availability"}],
+    "search": {
+        "postgresql": [{"ix_books_search_vector"}, {"pk:book_availability"}],
+        # The in-memory backend ranks, then loads the page by primary key
+        "sqlite": [{"pk:books"}, {"pk:book_availability"}],
+    },
+    "history": [{"ix_member_book_user_borrow_date"}, {"ix_member_book_archive_user_period"}],
+    "overdues": [{"ix_member_book_active_due_date"}],
+    "availability": [{"ix_books_isbn_number", "pk:books"}, {"pk:book_availability"}],
+    "borrow": [{"ix_member_book_active_user_book"}, {"ix_copies_available_book_branch", "ix_copies_book_id"}],
+}
+
+
+def _index_names(connection, name: str) -> set[str]:
+    """Names `name` can appear under in a plan: on Postgres, also its partitions' indexes."""
+    dialect = connection.dialect.name
+    if name.startswith("pk:"):
+        table = name[3:]
+        name = f"{table}_pkey" if dialect == "postgresql" else f"sqlite_autoindex_{table}_1"
+    names = {name}
+    if dialect == "postgresql":
+        names.update(connection.scalars(text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "WHERE parent.relname = :name"
+        ), {"name": name}))
+    return names
+
+
+def _explain(connection, statement: str, parameters) -> list[str]:
+    if connection.dialect.name == "postgresql":
+        return list(connection.exec_driver_sql("EXPLAIN " + statement, parameters).scalars())
+    return [row[-1] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+
+
+def _full_scans(dialect: str, plan: list[str]) -> list[str]:
+    if dialect == "postgresql":
+        return [line.strip() for line in plan if "Seq Scan" in line]
+    # SQLite walks a whole table for "SCAN t", but "SCAN t USING INDEX i" follows an index in order
+    return [line for line in plan if line.startswith("SCAN ") and " USING " not in line and "CONSTANT ROW" not in line]
+
+
+async def plans(client, ctx) -> dict:
+    from pagination import encode_cursor
+    from response_cache import body_cache
+    member, librarian = _busiest_member(), ctx.headers(1)
+    isbn, = _single_copy_titles(1, skip=10)
+    routes = {
+        "book list": ("GET", "/", {"params": {"limit": 50, "cursor": encode_cursor(isbn_for(ctx.books // 2))}}),
+        "search": ("GET", "/books/search", {"params": {"q": "river"}}),
+        "history": ("GET", "/borrow-history", {"params": {"limit": 50}}),
+        "overdues": ("GET", "/overdues", {"params": {"limit": 100}, "headers": librarian}),
+        "availability": ("GET", f"/books/{isbn}", {}),
+        "borrow": ("POST", "/borrow", {"json": {"book_id": isbn}}),
+    }
+
+    found = {}
+    with get_engine().connect() as connection:
+        dialect = connection.dialect.name
+        if dialect == "postgresql":
+            # Tiny tables are cheaper to scan; only scan where no index serves
+            connection.execute(text("SET enable_seqscan = off"))
+        for route, (method, url, kwargs) in routes.items():
+            kwargs.setdefault("headers", ctx.headers(member))
+            if method == "GET":
+                # Once unrecorded, so one-off work such as building an in-memory index is left out
+                await client.request(method, url, **kwargs)
+            body_cache.clear()
+            with _statements() as executed:
+                response = await client.request(method, url, **kwargs)
+            expect(response.status_code == 200, f"{route}: {method} {url} returned {response.status_code}")
+
+            plan = [line for statement, parameters in executed for line in _explain(connection, statement, parameters)]
+            scans = _full_scans(dialect, plan)
+            expect(not scans, f"{route}: full table scans {scans} in plans:\n" + "\n".join(plan))
+            expectations = PLAN_EXPECTATIONS[route]
+            for group in expectations.get(dialect, []) if isinstance(expectations, dict) else expectations:
+                names = set().union(*(_index_names(connection, name) for name in group))
+                expect(any(name in line for line in plan for name in names),
+                       f"{route}: none of {sorted(group)} in plans:\n" + "\n".join(plan))
+            found[route] = len(executed)
+        connection.rollback()
+
+    await client.post(f"/return/{isbn}", headers=ctx.headers(member))
+    return {"dialect": dialect, "statements": found}
+
+
+
+async def cursors(client, ctx) -> dict:
+    member, librarian = ctx.headers(_busiest_member()), ctx.headers(1)
+    timestamp = "2024-01-01T00:00:00"
+    tampered = {
+        "/": [
+            "not a cursor!", _raw_cursor({"isbn": "978"}), _raw_cursor([]), _raw_cursor([978]),
+            _raw_cursor([["978"]]), _raw_cursor(["978", "979"]), _raw_cursor(None),
+        ],
+        "/borrow-history": [
+            _raw_cursor([timestamp]), _raw_cursor(["yesterday", 1]), _raw_cursor([timestamp, "1"]),
+            _raw_cursor([timestamp, 1.5]), _raw_cursor([timestamp, True]), _raw_cursor([20240101, 1]),
+            _raw_cursor({"0": timestamp, "1": 1}), _raw_cursor([timestamp + "+00:00", 5]),
+        ],
+        "/overdues": [
+            _raw_cursor([timestamp, None]), _raw_cursor([None, 1]), _raw_cursor([timestamp, 1, 2]),
+            _raw_cursor([timestamp, {"id": 1}]), _raw_cursor([timestamp + "+02:00", 1]),
+        ],
+    }
+    statuses = {}
+    for path, cursors_ in tampered.items():
+        headers = librarian if path == "/overdues" else member
+        for cursor in cursors_:
+            response = await client.get(path, params={"cursor": cursor, "limit": 2}, headers=headers)
+            statuses[f"{path} {cursor}"] = response.status_code
+            expect(response.status_code == 400, f"GET {path} with cursor {cursor!r} returned {response.status_code}")
+
+    # Genuine cursors still page
+    for path in tampered:
+        headers = librarian if path == "/overdues" else member
+        first = (await client.get(path, params={"limit": 2}, headers=headers)).json()
+        expect(first.get("next_cursor"), f"GET {path} returned no next_cursor to follow")
+        response = await client.get(path, params={"cursor": first["next_cursor"], "limit": 2}, headers=headers)
+        expect(response.status_code == 200, f"GET {path} with its own next_cursor returned {response.status_code}")
+    return {"tampered": len(statuses)}
+
+
+async def category_search(client, ctx) -> dict:
+    with Session(get_engine()) as session:
+        category_id, size = session.execute(
+            select(Book.category_id, func.count()).group_by(Book.category_id).order_by(func.count().desc()).limit(1)
+        ).one()
+        borrows = dict(session.execute(
+            select(Book.isbn_number, func.coalesce(BookCirculation.borrow_count, 0))
+            .outerjoin(BookCirculation, BookCirculation.book_id == Book.isbn_number)
+            .where(Book.category_id == category_id)
+        ).all())
+
+    user = ctx.headers(2)
+    pages = []
+    for offset in (0, 20):
+        response = await client.get("/books/search", params={"category_id": category_id, "offset": offset},
+                                    headers=user)
+        expect(response.status_code == 200, f"category-only search returned {response.status_code}")
+        pages += response.json()["books"]
+    expect(len(pages) == min(40, size), f"category-only search returned {len(pages)} of {size} books")
+    expect(all(book["category_id"] == category_id for book in pages), "category-only search left its category")
+    expect(len({book["isbn_number"] for book in pages}) == len(pages), "pages of a category search overlap")
+    counts = [borrows[book["isbn_number"]] for book in pages]
+    expect(counts == sorted(counts, reverse=True), "category-only search is not ordered by borrows")
+
+    # Terms still narrow a category, and no terms nor category is still refused
+    response = await client.get("/books/search", params={"category_id": category_id, "q": "the"}, headers=user)
+    expect(response.status_code == 200 and all(book["category_id"] == category_id for book in response.json()["books"]),
+           "search with terms and a category left its category")
+    response = await client.get("/books/search", headers=user)
+    expect(response.status_code == 400, f"search with nothing to match returned {response.status_code}")
+    return {"category_id": category_id, "books_in_category": size}
+
+
+async def _listed_overdues(client, headers) -> int:
+    listed, cursor = 0, None
+    while True:
+        page = (await client.get("/overdues", params={"limit": 1000, "cursor": cursor}, headers=headers)).json()
+        listed += len(page["overdues"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return listed
+
+
+async def _overdue_counts(client, librarian: dict) -> tuple[int, int, int]:
+    """The overdue count from GET /stats/overdue and GET /stats, and how many GET /overdues lists."""
+    count = await client.get("/stats/overdue", headers=librarian)
+    expect(count.status_code == 200, f"GET /stats/overdue returned {count.status_code}")
+    summary = (await client.get("/stats", headers=librarian)).json()
+    return count.json()["overdue_books"], summary["overdue_books"], await _listed_overdues(client, librarian)
+
+
+async def overdue_stats(client, ctx) -> dict:
+    from overdues import run_overdue_sweep
+    librarian = ctx.headers(1)
+
+    async def counts() -> tuple[int, int, int]:
+        return await _overdue_counts(client, librarian)
+
+    before = await counts()
+    expect(len(set(before)) == 1, f"overdue count, summary and listing disagree: {before}")
+
+    # A borrow past due that no sweep has seen yet is not counted until one does
+    now = datetime.datetime.utcnow()
+    with Session(get_engine()) as session:
+        borrow = MemberBook(user_id=2, book_id=isbn_for(0), borrow_date=now - datetime.timedelta(days=20),
+                            due_date=now - datetime.timedelta(days=6), status="borrowed")
+        session.add(borrow)
+        session.commit()
+        key = (borrow.id, borrow.borrow_date)
+    try:
+        unswept = await counts()
+        expect(unswept == before, f"a borrow the sweep has not marked changed the counts: {before} -> {unswept}")
+        await run_in_threadpool(run_overdue_sweep)
+        swept = await counts()
+        expect(swept == tuple(count + 1 for count in before),
+               f"counts did not all grow by the newly marked borrow: {before} -> {swept}")
+    finally:
+        with Session(get_engine()) as session:
+            session.delete(session.get(MemberBook, key))
+            session.commit()
+        await run_in_threadpool(run_overdue_sweep)
+    return {"overdue_books": before[0]}
+
+
+async def hold_expiry(client, ctx) -> dict:
+    from overdues import run_overdue_sweep
+    isbn, = _single_copy_titles(1)
+    borrower, first, second = 3, 4, 5
+
+    async def book() -> dict:
+        return (await client.get(f"/books/{isbn}", headers=ctx.headers(borrower))).json()
+
+    async def hold_of(user_id: int) -> dict:
+        holds = (await client.get("/holds", headers=ctx.headers(user_id))).json()
+        return next((hold for hold in holds if hold["book_id"] == isbn), None)
+
+    def copy_status() -> str:
+        with Session(get_engine()) as session:
+            return session.scalar(select(Copy.status).where(Copy.book_id == isbn))
+
+    def lapse(user_id: int):
+        # Move the ready hold's pickup window into the past
+        with Session(get_engine()) as session:
+            session.execute(
+                update(Hold).where(Hold.user_id == user_id, Hold.book_id == isbn, Hold.status == "ready")
+                .values(expires_at=datetime.datetime.utcnow() - datetime.timedelta(minutes=1))
+            )
+            session.commit()
+
+    response = await client.post("/borrow", json={"book_id": isbn}, headers=ctx.headers(borrower))
+    expect(response.status_code == 200, f"borrowing the only copy returned {response.status_code}")
+    for user_id in (first, second):
+        response = await client.post("/holds", json={"book_id": isbn}, headers=ctx.headers(user_id))
+        expect(response.status_code == 200, f"placing a hold returned {response.status_code}")
+    await client.post(f"/return/{isbn}", headers=ctx.headers(borrower))
+    expect((await hold_of(first) or {}).get("status") == "ready", "the returned copy did not ready the first hold")
+
+    # The first hold lapses: the copy stays reserved, now for the second member
+    lapse(first)
+    result = await run_in_threadpool(run_overdue_sweep)
+    expect(result["holds_expired"] == 1, f"the sweep expired {result['holds_expired']} holds, not 1")
+    expect(await hold_of(first) is None, "the lapsed hold is still open")
+    expect((await hold_of(second) or {}).get("status") == "ready", "the copy did not pass to the next hold")
+    expect(copy_status() == "reserved", f"the copy is {copy_status()}, not reserved for the next hold")
+    expect((await book())["available_copies"] == 0, "the reserved copy is counted as available")
+
+    # The second lapses with nobody left waiting: the copy goes back on the shelf
+    lapse(second)
+    result = await run_in_threadpool(run_overdue_sweep)
+    expect(result["holds_expired"] == 1, f"the sweep expired {result['holds_expired']} holds, not 1")
+    expect(await hold_of(second) is None, "the lapsed hold is still open")
+    expect(copy_status() == "available", f"the copy is {copy_status()}, not back on the shelf")
+    expect((await book())["available_copies"] == 1, "the shelved copy is not counted as available")
+    return {"isbn": isbn}
+
+
+async def duplicate_borrow(client, ctx, attempts: int = 8) -> dict:
+    # A title with copies to spare, so only the one-borrow-per-member rule can refuse
+    with Session(get_engine()) as session:
+        isbn = session.scalar(
+            select(Book.isbn_number)
+            .where(Book.total_copies >= 3, Book.available_copies == Book.total_copies)
+            .order_by(Book.isbn_number.desc())
+            .limit(1)
+        )
+    member = 7
+    responses = await asyncio.gather(*(
+        client.post("/borrow", json={"book_id": isbn}, headers=ctx.headers(member)) for _ in range(attempts)
+    ))
+    statuses = Counter(response.status_code for response in responses)
+    active = [user_id for user_id, _ in _circulation_state(isbn)["active_borrows"] if user_id == member]
+    if active:
+        await client.post(f"/return/{isbn}", headers=ctx.headers(member))
+    expect(statuses == {200: 1, 400: attempts - 1},
+           f"{attempts} concurrent borrows of {isbn} by one member ended {dict(statuses)}")
+    expect(len(active) == 1, f"member {member} has {len(active)} active borrows of {isbn}")
+    return {"isbn": isbn, "statuses": {str(code): n for code, n in statuses.items()}}
+
+
+async def return_fines(client, ctx) -> dict:
+    from overdues import fine_for, run_overdue_sweep
+    librarian = ctx.headers(1)
+    # After hold_expiry's and concurrent_borrow's single-copy titles
+    single, batched = _single_copy_titles(2, skip=4)
+    member = 6
+    for isbn in (single, batched):
+        response = await client.post("/borrow", json={"book_id": isbn}, headers=ctx.headers(member))
+        expect(response.status_code == 200, f"borrowing {isbn} returned {response.status_code}")
+
+    # Fall due three and a half days ago, with no sweep since
+    with Session(get_engine()) as session:
+        session.execute(
+            update(MemberBook)
+            .where(MemberBook.user_id == member, MemberBook.book_id.in_([single, batched]),
+                   MemberBook.status == "borrowed")
+            .values(due_date=datetime.datetime.utcnow() - datetime.timedelta(days=3, hours=12))
+        )
+        session.commit()
+    await run_in_threadpool(run_overdue_sweep)
+    before = await _overdue_counts(client, librarian)
+    response = await client.post(f"/return/{single}", headers=ctx.headers(member))
+    expect(response.status_code == 200, f"returning {single} returned {response.status_code}")
+    response = await client.post("/return/batch", json={"book_ids": [batched]}, headers=ctx.headers(member))
+    expect(response.status_code == 200, f"the batch return returned {response.status_code}")
+    after = await _overdue_counts(client, librarian)
+    expect(after == tuple(count - 2 for count in before),
+           f"returning two overdue borrows did not take both off every count: {before} -> {after}")
+
+    fines = {}
+    with Session(get_engine()) as session:
+        for isbn, due_date, return_date, overdue, fine_cents in session.execute(
+            select(MemberBook.book_id, MemberBook.due_date, MemberBook.return_date,
+                   MemberBook.overdue, MemberBook.fine_cents)
+            .where(MemberBook.user_id == member, MemberBook.book_id.in_([single, batched]))
+        ):
+            expected = fine_for(due_date, return_date)
+            expect(overdue and fine_cents == expected,
+                   f"returning {isbn} late left overdue={overdue}, fine {fine_cents}, not {expected}")
+            fines[isbn] = fine_cents
+    return {"fines_cents": fines}
+
+
+def _circulation_state(isbn: str) -> dict:
+    """What the database says about a title's copies, borrows and counters."""
+    with Session(get_engine()) as session:
+        category_id = session.scalar(select(Book.category_id).where(Book.isbn_number == isbn))
+        return {
+            "copies": dict(session.execute(select(Copy.id, Copy.status).where(Copy.book_id == isbn)).all()),
+            "active_borrows": session.execute(
+                select(MemberBook.user_id, MemberBook.copy_id)
+                .where(MemberBook.book_id == isbn, MemberBook.status == "borrowed")
+            ).all(),
+            "available_copies": session.scalar(select(Book.available_copies).where(Book.isbn_number == isbn)),
+            "category_borrowed": session.scalar(
+                select(func.sum(CategoryStats.borrowed_books)).where(CategoryStats.category_id == category_id)
+            ),
+            "borrow_count": session.scalar(
+                select(BookCirculation.borrow_count).where(BookCirculation.book_id == isbn)
+            ) or 0,
+        }
+
+
+async def concurrent_borrow(client, ctx, borrowers: int = 32, titles: int = 3) -> dict:
+    members = range(10, 10 + borrowers)
+    outcomes = Counter()
+    # The first single-copy title is hold_expiry's
+    for isbn in _single_copy_titles(titles, skip=1):
+        before = _circulation_state(isbn)
+        responses = await asyncio.gather(*(
+            client.post("/borrow", json={"book_id": isbn}, headers=ctx.headers(user_id)) for user_id in members
+        ))
+        statuses = Counter(response.status_code for response in responses)
+        outcomes.update(statuses)
+        expect(statuses == {200: 1, 400: borrowers - 1},
+               f"{borrowers} concurrent borrows of {isbn}'s one copy ended {dict(statuses)}")
+        winner = next(user_id for user_id, response in zip(members, responses) if response.status_code == 200)
+
+        copy_id, = before["copies"]
+        after = _circulation_state(isbn)
+        expect(after["copies"] == {copy_id: "borrowed"}, f"copies of {isbn} are {after['copies']} after the borrow")
+        expect(after["active_borrows"] == [(winner, copy_id)],
+               f"active borrows of {isbn} are {after['active_borrows']}, not one by member {winner}")
+        expect(after["available_copies"] == 0, f"{isbn} counts {after['available_copies']} copies available")
+        expect(after["category_borrowed"] == before["category_borrowed"] + 1, "the category's borrowed count is off")
+        expect(after["borrow_count"] == before["borrow_count"] + 1, f"{isbn}'s circulation count is off")
+        book = (await client.get(f"/books/{isbn}", headers=ctx.headers(winner))).json()
+        expect(book["available_copies"] == 0, f"GET /books/{isbn} still shows a copy available")
+
+        response = await client.post(f"/return/{isbn}", headers=ctx.headers(winner))
+        expect(response.status_code == 200, f"returning {isbn} returned {response.status_code}")
+        returned = _circulation_state(isbn)
+        expect(returned["copies"] == before["copies"] and returned["available_copies"] == 1
+               and returned["category_borrowed"] == before["category_borrowed"],
+               f"{isbn} did not go back to how it was after the return: {returned}")
+    return {"borrowers": borrowers, "titles": titles, "statuses": {str(code): n for code, n in outcomes.items()}}
+
+
+def _history_lengths() -> tuple[int, int, int]:
+    """A member with a long history, one with a short one, and the long one's length."""
+    with Session(get_engine()) as session:
+        counts = session.execute(
+            select(MemberBook.user_id, func.count()).group_by(MemberBook.user_id).order_by(func.count().desc())
+        ).all()
+    short = next(user_id for user_id, count in reversed(counts) if count >= 3)
+    return counts[0][0], short, counts[0][1]
+
+
+async def history_statements(client, ctx, limit: int = 20) -> dict:
+    from archive import run_history_maintenance
+    long_member, short_member, long_length = _history_lengths()
+    # Queries a page may take: member_book, then the archive unless only
+    # active borrows are asked for, then titles for archived rows if embedded
+    variants = {
+        "all": ({}, {2}),
+        "returned": ({"status": "returned"}, {2}),
+        "borrowed": ({"status": "borrowed"}, {1}),
+        "include_book": ({"include_book": "true"}, {2, 3}),
+    }
+
+    async def walk(member: int, params: dict) -> tuple[list[int], list[tuple]]:
+        """Queries per page and the rows of every page."""
+        headers = ctx.headers(member)
+        counts, rows, cursor = [], [], None
+        while True:
+            with _statements() as executed:
+                response = await client.get("/borrow-history", params={**params, "limit": limit, "cursor": cursor},
+                                            headers=headers)
+            expect(response.status_code == 200, f"GET /borrow-history {params} returned {response.status_code}")
+            page = response.json()
+            counts.append(len(executed))
+            rows += [(row["borrow_date"], row["book_id"]) for row in page["borrowing_history"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return counts, rows
+
+    async def measure(stage: str) -> dict:
+        found = {}
+        for member, history in ((long_member, "long"), (short_member, "short")):
+            # Unrecorded first, so loading the member's principal is left out
+            await client.get("/borrow-history", params={"limit": 1}, headers=ctx.headers(member))
+            for variant, (params, allowed) in variants.items():
+                counts, rows = await walk(member, params)
+                expect(set(counts) <= allowed,
+                       f"{stage}, {history} history, {variant}: pages took {counts} queries, not {sorted(allowed)}")
+                expect(len(set(rows)) == len(rows), f"{stage}, {history} history, {variant}: pages overlap")
+                if variant == "all" and history == "long":
+                    expect(len(rows) == long_length,
+                           f"{stage}: paging returned {len(rows)} of the member's {long_length} borrows")
+                found[f"{history} {variant}"] = {"pages": len(counts), "queries": sorted(set(counts))}
+        return found
+
+    before = await measure("before archiving")
+    archived = await run_in_threadpool(run_history_maintenance)
+    months = len(archived["months"])
+    expect(months > 0, "history maintenance archived nothing to page through")
+    after = await measure("after archiving")
+    return {"archived_months": months, "before": before, "after": after}
+
+
+async def pool_saturation(client, ctx, factor: int = 10) -> dict:
+    import auth
+    from database import POOL_OPTIONS
+    capacity = POOL_OPTIONS["pool_size"] + POOL_OPTIONS["max_overflow"]
+    requests = factor * capacity
+    # Uncached callers, so authentication queries too, as a read handler does after it
+    auth.principal_cache.clear()
+    started = time.monotonic()
+    responses = await asyncio.gather(*(
+        client.get(f"/books/{isbn_for(n % 50)}", headers=ctx.headers(2 + n % (ctx.users - 2)))
+        for n in range(requests)
+    ))
+    seconds = time.monotonic() - started
+    statuses = Counter(response.status_code for response in responses)
+    expect(statuses == {200: requests}, f"{requests} concurrent reads ended {dict(statuses)}")
+    # Stalled checkouts only give up after db_pool_timeout
+    expect(seconds < POOL_OPTIONS["pool_timeout"] / 2,
+           f"{requests} concurrent reads on a pool of {capacity} took {seconds:.1f}s")
+    return {"pool_capacity": capacity, "requests": requests, "seconds_for_all": round(seconds, 3)}
+
+
+async def shedding(client, ctx) -> dict:
+    import database
+    from middleware.rate_limit import SHED_POOL_WAIT_MS
+    user = ctx.headers(2)
+
+    async def status() -> int:
+        # Search costs more than 1, so it is shed under load; refused requests check nothing out
+        return (await client.get("/books/search", params={"q": "river"}, headers=user)).status_code
+
+    # Checkouts that waited a second each, as during a burst that exhausted the pool
+    for _ in range(20):
+        database._record_pool_wait(1.0)
+    burst = database.recent_pool_wait()
+    expect(await status() == 503, f"search was not shed after a burst with {burst:.2f}s average checkout wait")
+
+    # Nothing checks out while requests are shed; the average must still decay
+    half_lives = math.log2(burst * 1000 / SHED_POOL_WAIT_MS)
+    started = time.monotonic()
+    deadline = started + (half_lives + 1) * database.POOL_WAIT_HALF_LIFE
+    while await status() == 503:
+        expect(time.monotonic() < deadline, f"search was still shed {time.monotonic() - started:.1f}s after the burst")
+        await asyncio.sleep(0.1)
+    return {"burst_wait_s": round(burst, 3), "shed_for_s": round(time.monotonic() - started, 2)}
+
+
+async def rate_limit_buckets(client, ctx) -> dict:
+    from middleware.rate_limit import InMemoryRateLimitBackend, Limit
+    backend = InMemoryRateLimitBackend(max_buckets=10)
+    # Barely refilling, so the check sees what each take spent
+    ip, user = Limit("ip", 1e-6, 10), Limit("user", 1e-6, 4)
+
+    expect(not await backend.take([ip, user], 3), "the first request was refused with both buckets full")
+    wait = await backend.take([ip, user], 3)
+    expect(wait > 0, "a request the user bucket cannot cover was admitted")
+    # The refused request took nothing from the IP bucket, so 7 tokens are left in it
+    expect(not await backend.take([ip], 7), "a refused request still spent the IP bucket's tokens")
+    expect(await backend.take([ip], 1) > 0, "the IP bucket held more than its burst allows")
+    return {"retry_after_s": round(wait)}
+
+
+CHECKS = {check.__name__: check for check in (
+    plans, cursors, category_search, overdue_stats, hold_expiry, concurrent_borrow, duplicate_borrow,
+    return_fines, history_statements, pool_saturation, shedding, rate_limit_buckets,
+)}
+
+
+def _prepare(scale: str, seed: int):
+    """Seed the database, creating the tables first on SQLite, and sweep it for overdues."""
+    from sqlalchemy import inspect
+    from bench.generate import create_schema, generate, reset
+    from overdues import run_overdue_sweep
+
+    engine = get_engine()
+    if engine.dialect.name == "sqlite" and not inspect(engine).has_table("member_book"):
+        create_schema(engine)
+    with Session(engine) as session:
+        reset(session)
+        seeded = generate(session, **SCALES[scale], seed=seed)
+    seeded["overdue_sweep"] = run_overdue_sweep()
+    return seeded
+
+
+async def run(names: list[str], scale: str, seed: int) -> dict:
+    from bench.harness import Context, _client
+    from suggest import SUGGEST_INDEX_ENABLED, get_suggest_index
+
+    sizes = SCALES[scale]
+    ctx = Context(sizes["books"], sizes["users"], 1.1)
+    results = {}
+    async with _client(None) as client:
+        # Let the typeahead index finish loading, so its queries stay out of the checks'
+        while SUGGEST_INDEX_ENABLED and get_suggest_index() is None:
+            await asyncio.sleep(0.05)
+        for name in names:
+            started = time.perf_counter()
+            try:
+                found = await CHECKS[name](client, ctx)
+                results[name] = {"ok": True, **found}
+            except Exception as error:
+                detail = str(error) if isinstance(error, CheckFailed) else traceback.format_exc()
+                results[name] = {"ok": False, "error": detail}
+            results[name]["seconds"] = round(time.perf_counter() - started, 3)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run correctness checks against seeded data.")
+    parser.add_argument("checks", nargs="*", metavar="check", help=f"any of: {', '.join(CHECKS)} (default all)")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="tiny", help="scale to seed at")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(unknown)}")
+
+    # The rate limiter is on, as in production, with buckets no check can empty
+    os.environ.update(rate_limit_enabled="True", rate_limit_ip_rate="1e9", rate_limit_ip_burst="1e9",
+                      rate_limit_user_rate="1e9", rate_limit_user_burst="1e9")
+    directory = None
+    if not os.environ.get("database_url"):
+        directory = tempfile.TemporaryDirectory()
+        os.environ["database_url"] = f"sqlite:///{directory.name}/checks.db"
+    try:
+        seeded = _prepare(args.scale, args.seed)
+        results = asyncio.run(run(args.checks or list(CHECKS), args.scale, args.seed))
+    finally:
+        if directory is not None:
+            directory.cleanup()
+    json.dump({"seeded": seeded, "checks": results}, sys.stdout, indent=2)
+    print()
+    return 0 if all(result["ok"] for result in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
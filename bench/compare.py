@@ -0,0 +1,71 @@
+"""
+Compare two bench.harness result files route by route:
+    python -m bench.compare before.json after.json --threshold 10
+
+Prints throughput and latency percentiles side by side with the change in
+percent. With --threshold, exits 1 if any route's p99 got slower, or its
+throughput lower, by more than that percentage.
+"""
+import argparse
+import json
+import sys
+
+METRICS = ("requests_per_second", "p50", "p90", "p99")
+
+
+def _route_metrics(report: dict) -> dict:
+    routes = {}
+    for scenario, result in report.get("scenarios", {}).items():
+        for label, route in result["routes"].items():
+            if route.get("requests"):
+                routes[(scenario, label)] = {
+                    "requests_per_second": route["requests_per_second"],
+                    **{name: route["latency_ms"][name] for name in METRICS[1:]},
+                }
+    for name, job in report.get("jobs", {}).items():
+        routes[("jobs", name)] = {"seconds": job["seconds"]}
+    return routes
+
+
+def _change(before: float, after: float) -> float:
+    return (after - before) / before * 100 if before else 0.0
+
+
+def compare(before: dict, after: dict, threshold: float = None) -> tuple[list[str], list[str]]:
+    """Lines of the comparison, and the regressions beyond `threshold` percent."""
+    old, new = _route_metrics(before), _route_metrics(after)
+    lines = [f"{before.get('commit', '?')} -> {after.get('commit', '?')}"]
+    regressions = []
+    for key in sorted(old.keys() & new.keys()):
+        cells = []
+        for metric, value in old[key].items():
+            change = _change(value, new[key][metric])
+            cells.append(f"{metric} {value:g} -> {new[key][metric]:g} ({change:+.1f}%)")
+            # Fewer requests a second is worse; for latencies and job times, more is
+            worse = -change if metric == "requests_per_second" else change
+            if threshold is not None and metric in ("requests_per_second", "p99", "seconds") and worse > threshold:
+                regressions.append(f"{key[0]} {key[1]}: {metric} {change:+.1f}%")
+        lines.append(f"{key[0]:<20} {key[1]:<28} " + "  ".join(cells))
+    for key in sorted(old.keys() ^ new.keys()):
+        lines.append(f"{key[0]:<20} {key[1]:<28} only in {'before' if key in old else 'after'}")
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, help="fail on regressions larger than this many percent")
+    args = parser.parse_args(argv)
+
+    with open(args.before) as before, open(args.after) as after:
+        lines, regressions = compare(json.load(before), json.load(after), args.threshold)
+    print("\n".join(lines))
+    if regressions:
+        print("\nRegressions:\n" + "\n".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+"""
+Seeded synthetic library data for benchmarks.
+
+Generates categories, books with copies at several branches, members, and a
+borrowing history in which both title popularity and member activity follow
+Zipf distributions (book and member numbers are popularity ranks, so the
+harness can pick popular titles and active members without asking the
+database), then fills the counters the API keeps (copy availability,
+category and circulation stats) to match. The same seed and scale always
+produce the same data.
+
+The target database comes from the usual .env settings, or database_url,
+e.g. a SQLite file as a stand-in for Postgres:
+    database_url=sqlite:///bench.db python -m bench.generate --scale small --reset --create-schema
+
+On Postgres, run the migrations first and pass --reset to empty the tables.
+"""
+import argparse
+import datetime
+import json
+import sys
+import time
+from collections import defaultdict
+import bcrypt
+import numpy as np
+from sqlalchemy import delete, insert, text, update
+from sqlalchemy.orm import Session
+from archive import PARTITION_PREMAKE_MONTHS, add_months, create_partitions, month_start
+from auth import BCRYPT_ROUNDS
+from database import get_engine
+from inventory import default_barcode
+from overdues import fine_for
+from models import (
+    Base, Book, BookAvailability, BookCirculation, Category, CategoryStats, Copy, DailyCirculation, MemberBook, User,
+)
+
+SCALES = {
+    "tiny": {"categories": 10, "books": 500, "users": 200, "borrows": 5000},
+    "small": {"categories": 20, "books": 5000, "users": 2000, "borrows": 50000},
+    "medium": {"categories": 50, "books": 100000, "users": 50000, "borrows": 2000000},
+    "large": {"categories": 100, "books": 1000000, "users": 1000000, "borrows": 10000000},
+    "huge": {"categories": 100, "books": 1000000, "users": 1000000, "borrows": 50000000},
+}
+BRANCHES = ["Central", "North", "South", "East", "West"]
+GENRES = [
+    "Fiction", "Mystery", "Science Fiction", "Fantasy", "History", "Biography", "Science", "Poetry", "Travel",
+    "Cooking", "Philosophy", "Children", "Romance", "Horror", "Art", "Music", "Business", "Health",
+]
+ADJECTIVES = [
+    "Silent", "Hidden", "Last", "Golden", "Broken", "Distant", "Secret", "Forgotten", "Burning", "Quiet",
+    "Endless", "Crimson", "Northern", "Hollow", "Wild", "Bright", "Lost", "Paper", "Iron", "Winter",
+]
+NOUNS = [
+    "River", "Garden", "Empire", "Letter", "Mountain", "Kingdom", "Harbor", "Library", "Voyage", "Mirror",
+    "Orchard", "Storm", "Lantern", "Island", "Station", "Forest", "Bridge", "Clock", "Tide", "Map",
+]
+FIRST_NAMES = [
+    "Ada", "Ben", "Chloe", "Dev", "Elena", "Femi", "Grace", "Hiro", "Ines", "Jonas", "Kavya", "Liam", "Mei",
+    "Nadia", "Omar", "Priya", "Quinn", "Rosa", "Sami", "Tara", "Umar", "Vera", "Wen", "Yusuf", "Zoe",
+]
+LAST_NAMES = [
+    "Abbott", "Baker", "Chen", "Diaz", "Evans", "Fischer", "Garcia", "Haddad", "Ito", "Jensen", "Khan",
+    "Larsen", "Moreau", "Nakamura", "Okafor", "Patel", "Rossi", "Silva", "Tanaka", "Varga", "Weber", "Yilmaz",
+]
+# Shared by every generated member, so login benchmarks know it
+PASSWORD = "benchmark"
+LOAN_DAYS = 14
+CHUNK_SIZE = 20000
+
+
+def zipf_choice(rng: np.random.Generator, n: int, size: int, exponent: float) -> np.ndarray:
+    """`size` draws from 0..n-1 where item k has probability proportional to 1 / (k + 1) ** exponent."""
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    cumulative = np.cumsum(weights)
+    return np.searchsorted(cumulative, rng.random(size) * cumulative[-1]).clip(max=n - 1)
+
+
+def isbn_for(number: int) -> str:
+    return f"978{number:010d}"
+
+
+def create_schema(engine):
+    """Create the tables directly, for SQLite stand-ins that cannot run the Postgres migrations."""
+    Base.metadata.create_all(engine)
+
+
+def reset(session: Session):
+    """Delete every row the generator writes, and anything that refers to them."""
+    if session.get_bind().dialect.name == "postgresql":
+        tables = ", ".join(table.name for table in Base.metadata.sorted_tables)
+        session.execute(text(f"TRUNCATE {tables} CASCADE"))
+    else:
+        for table in reversed(Base.metadata.sorted_tables):
+            session.execute(delete(table))
+    session.commit()
+
+
+def _insert_chunks(session: Session, model, rows: list[dict]):
+    for start in range(0, len(rows), CHUNK_SIZE):
+        session.execute(insert(model), rows[start:start + CHUNK_SIZE])
+    session.commit()
+
+
+def _set_sequence(session: Session, table: str, column: str = "id"):
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), (SELECT coalesce(max({column}), 1) FROM {table}))"
+        ))
+
+
+def generate(session: Session, categories: int, books: int, users: int, borrows: int, seed: int = 42,
+             months: int = 24, exponent: float = 1.1, today: datetime.datetime = None) -> dict:
+    rng = np.random.default_rng(seed)
+    today = today or datetime.datetime.utcnow().replace(microsecond=0)
+    timings = {}
+    started = time.perf_counter()
+
+    # Categories, books and copies; popular titles get more copies
+    _insert_chunks(session, Category, [
+        {"id": number, "name": f"{GENRES[(number - 1) % len(GENRES)]} {(number - 1) // len(GENRES) + 1}"}
+        for number in range(1, categories + 1)
+    ])
+    book_categories = rng.integers(1, categories + 1, books)
+    words = rng.integers(0, len(ADJECTIVES), (books, 2))
+    authors = rng.integers(0, len(FIRST_NAMES) * len(LAST_NAMES), books)
+    isbns = [isbn_for(number) for number in range(books)]
+    _insert_chunks(session, Book, [
+        {
+            "isbn_number": isbns[number],
+            "title": f"The {ADJECTIVES[words[number, 0]]} {NOUNS[words[number, 1]]} {number}",
+            "author": f"{FIRST_NAMES[authors[number] % len(FIRST_NAMES)]} {LAST_NAMES[authors[number] // len(FIRST_NAMES)]}",
+            "category_id": int(book_categories[number]),
+        }
+        for number in range(books)
+    ])
+    ranks = np.arange(books)
+    copy_counts = 1 + (ranks < books // 100) * 3 + (ranks < books // 10) + rng.integers(0, 2, books)
+    branches = rng.integers(0, len(BRANCHES), int(copy_counts.sum()))
+    copies, copies_of = [], defaultdict(list)
+    for number in range(books):
+        for index in range(int(copy_counts[number])):
+            copy_id = len(copies) + 1
+            copies.append({
+                "id": copy_id, "book_id": isbns[number], "barcode": default_barcode(isbns[number], index + 1),
+                "branch": BRANCHES[branches[copy_id - 1]], "status": "available",
+            })
+            copies_of[number].append(copy_id)
+    _insert_chunks(session, Copy, copies)
+    _set_sequence(session, "copies")
+    timings["catalog_seconds"] = time.perf_counter() - started
+
+    # Members share one password hash, made here rather than in the API's
+    # hashing pool; bcrypt for each would dominate the run
+    password = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(BCRYPT_ROUNDS)).decode("utf-8")
+    started = time.perf_counter()
+    _insert_chunks(session, User, [
+        {
+            "id": number, "name": f"Member {number}", "email": f"member{number}@bench.example",
+            "password": password, "phone_number": None,
+            "role": "librarian" if number % 100 == 1 else "user",
+        }
+        for number in range(1, users + 1)
+    ])
+    _set_sequence(session, "users")
+    _set_sequence(session, "categories")
+    timings["users_seconds"] = time.perf_counter() - started
+
+    # Borrowing history, oldest first so ids follow borrow dates
+    started = time.perf_counter()
+    borrowed_books = zipf_choice(rng, books, borrows, exponent)
+    borrowers = zipf_choice(rng, users, borrows, exponent * 0.8) + 1
+    span = months * 30 * 86400
+    borrow_dates = np.sort(rng.integers(0, span, borrows))[::-1]  # seconds before today
+    loan_days = rng.integers(1, 31, borrows)
+
+    if session.get_bind().dialect.name == "postgresql":
+        current = month_start(today)
+        create_partitions(session, add_months(current, -months - 1), add_months(current, PARTITION_PREMAKE_MONTHS))
+
+    # Borrows from the last 30 days without a return yet stay active if a copy is free
+    free_copies = {number: list(ids) for number, ids in copies_of.items()}
+    active_pairs = set()
+    lent_copies = []
+    member_rows = []
+    circulation = np.zeros(books, dtype=np.int64)
+    daily = defaultdict(lambda: [0, 0])
+    for index in range(borrows):
+        number = int(borrowed_books[index])
+        user_id = int(borrowers[index])
+        borrow_date = today - datetime.timedelta(seconds=int(borrow_dates[index]))
+        due_date = borrow_date + datetime.timedelta(days=LOAN_DAYS)
+        return_date = borrow_date + datetime.timedelta(days=int(loan_days[index]))
+        row = {
+            "id": index + 1, "user_id": user_id, "book_id": isbns[number], "copy_id": None,
+            "borrow_date": borrow_date, "due_date": due_date, "return_date": return_date, "status": "returned",
+            "overdue": return_date > due_date, "fine_cents": fine_for(due_date, return_date),
+        }
+        if return_date > today and free_copies[number] and (user_id, number) not in active_pairs:
+            copy_id = free_copies[number].pop()
+            lent_copies.append(copy_id)
+            active_pairs.add((user_id, number))
+            row.update(copy_id=copy_id, return_date=None, status="borrowed", overdue=False)
+        elif return_date > today:
+            row.update(return_date=today, overdue=today > due_date, fine_cents=fine_for(due_date, today))
+        circulation[number] += 1
+        daily[borrow_date.date()][0] += 1
+        if row["return_date"] is not None:
+            daily[row["return_date"].date()][1] += 1
+        member_rows.append(row)
+        if len(member_rows) >= CHUNK_SIZE:
+            _insert_chunks(session, MemberBook, member_rows)
+            member_rows = []
+    _insert_chunks(session, MemberBook, member_rows)
+    _set_sequence(session, "member_book")
+    for start in range(0, len(lent_copies), CHUNK_SIZE):
+        session.execute(
+            update(Copy).where(Copy.id.in_(lent_copies[start:start + CHUNK_SIZE])).values(status="borrowed")
+        )
+    session.commit()
+    timings["history_seconds"] = time.perf_counter() - started
+
+    # Counters, all in shard 0
+    started = time.perf_counter()
+    available = {number: len(ids) for number, ids in free_copies.items()}
+    _insert_chunks(session, BookAvailability, [
+        {"book_id": isbns[number], "shard": 0, "total_copies": int(copy_counts[number]),
+         "available_copies": available[number]}
+        for number in range(books)
+    ])
+    category_totals = defaultdict(lambda: [0, 0])
+    for number in range(books):
+        totals = category_totals[int(book_categories[number])]
+        totals[0] += int(copy_counts[number])
+        totals[1] += int(copy_counts[number]) - available[number]
+    _insert_chunks(session, CategoryStats, [
+        {"category_id": category_id, "shard": 0, "total_books": total, "borrowed_books": borrowed}
+        for category_id, (total, borrowed) in category_totals.items()
+    ])
+    _insert_chunks(session, BookCirculation, [
+        {"book_id": isbns[number], "borrow_count": int(circulation[number])}
+        for number in np.flatnonzero(circulation)
+    ])
+    _insert_chunks(session, DailyCirculation, [
+        {"day": day, "shard": 0, "borrows": counts[0], "returns": counts[1]} for day, counts in daily.items()
+    ])
+    timings["counters_seconds"] = time.perf_counter() - started
+
+    return {
+        "seed": seed,
+        "categories": categories,
+        "books": books,
+        "copies": len(copies),
+        "users": users,
+        "borrows": borrows,
+        "active_borrows": len(active_pairs),
+        **{name: round(seconds, 3) for name, seconds in timings.items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill the database with seeded synthetic library data.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--categories", type=int)
+    parser.add_argument("--books", type=int)
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--borrows", type=int)
+    parser.add_argument("--months", type=int, default=24, help="months of borrowing history")
+    parser.add_argument("--zipf", type=float, default=1.1, help="popularity skew of titles; members get 0.8 of it")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="delete existing rows first")
+    parser.add_argument("--create-schema", action="store_true", help="create the tables (for SQLite stand-ins)")
+    args = parser.parse_args(argv)
+
+    sizes = dict(SCALES[args.scale])
+    for name in sizes:
+        if getattr(args, name) is not None:
+            sizes[name] = getattr(args, name)
+
+    engine = get_engine()
+    if args.create_schema:
+        create_schema(engine)
+    with Session(engine) as session:
+        if args.reset:
+            reset(session)
+        report = generate(session, **sizes, seed=args.seed, months=args.months, exponent=args.zipf)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
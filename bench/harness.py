@@ -0,0 +1,657 @@
+"""
+Scripted load scenarios against the API, with throughput and latency
+percentiles per route written as JSON, for comparison between commits with
+bench.compare.
+
+Runs against main:app in process through an ASGI client, or against a live
+server with --url (which must share the secret setting, since tokens are
+minted locally). The database must hold data from bench.generate at the
+same --scale. Background jobs (overdue sweep, recommendations build, history
+archive, and the dashboard as ad-hoc GROUP BY queries) can be timed too:
+    python -m bench.harness browse search borrow_return --requests 2000 --concurrency 32 > after.json
+    python -m bench.harness --rate-limit flood
+    python -m bench.harness --jobs overdue_sweep recommendations
+
+Scenarios can also run at the same time, e.g. catalog latency during a
+login burst, and an access log can be replayed at its recorded pace:
+    python -m bench.harness --mix browse:32 login_burst:8 --mix browse:32 hot_borrow:32
+    python -m bench.harness --rate-limit --replay access.log --speed 4
+
+Replayed members send X-Forwarded-For addresses of their own, so a live
+server needs rate_limit_trust_forwarded to tell them apart.
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import math
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from itertools import accumulate
+from typing import Optional
+from bench.generate import ADJECTIVES, NOUNS, PASSWORD, SCALES, isbn_for
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile of sorted `samples`."""
+    if not samples:
+        return 0.0
+    return samples[max(0, math.ceil(pct / 100 * len(samples)) - 1)]
+
+
+class Recorder:
+    """Latencies, statuses and items processed, per route label."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.items = Counter()
+
+    def record(self, label: str, seconds: float, status, items: int = 1):
+        self.latencies[label].append(seconds)
+        self.statuses[label][str(status)] += 1
+        self.items[label] += items
+
+    def error(self, label: str, error: Exception):
+        self.statuses[label][type(error).__name__] += 1
+
+    async def request(self, client, label: str, method: str, url: str, items: int = 1, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except Exception as error:
+            self.error(label, error)
+            return None
+        self.record(label, time.perf_counter() - started, response.status_code, items)
+        return response
+
+    def report(self, seconds: float) -> dict:
+        routes = {}
+        for label, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            routes[label] = {
+                "requests": len(latencies),
+                "requests_per_second": round(len(latencies) / seconds, 2),
+                "items_per_second": round(self.items[label] / seconds, 2),
+                "statuses": dict(self.statuses[label]),
+                "latency_ms": {
+                    **{f"p{pct}": round(percentile(latencies, pct) * 1000, 3) for pct in PERCENTILES},
+                    "mean": round(sum(latencies) / len(latencies) * 1000, 3),
+                    "max": round(latencies[-1] * 1000, 3),
+                },
+            }
+        for label in self.statuses.keys() - self.latencies.keys():
+            routes[label] = {"requests": 0, "statuses": dict(self.statuses[label])}
+        return routes
+
+
+class Context:
+    """What scenarios know about the generated data, and tokens for its members."""
+
+    def __init__(self, books: int, users: int, zipf: float):
+        from auth import create_jwt_token
+        self.books = books
+        self.users = users
+        self.create_token = create_jwt_token
+        self.tokens = {}
+        # Titles and members with low numbers are the popular and active ones,
+        # as in bench.generate
+        self.book_weights = list(accumulate(1 / (n + 1) ** zipf for n in range(min(books, 100000))))
+        self.user_weights = list(accumulate(1 / (n + 1) ** (zipf * 0.8) for n in range(min(users, 100000))))
+
+    def isbn(self, rng: random.Random) -> str:
+        return isbn_for(rng.choices(range(len(self.book_weights)), cum_weights=self.book_weights)[0])
+
+    def user(self, rng: random.Random) -> int:
+        return rng.choices(range(len(self.user_weights)), cum_weights=self.user_weights)[0] + 1
+
+    def headers(self, user_id: int) -> dict:
+        token = self.tokens.get(user_id)
+        if token is None:
+            role = "librarian" if user_id % 100 == 1 else "user"
+            token = self.tokens[user_id] = self.create_token(user_id, role)
+        return {"Authorization": f"Bearer {token}"}
+
+
+def _search_term(rng: random.Random) -> str:
+    word = rng.choice(ADJECTIVES + NOUNS).lower()
+    return word[:rng.randint(3, len(word))]
+
+
+# Scenarios: one iteration each, recording every request it makes
+
+async def browse(client, ctx: Context, recorder: Recorder, rng: random.Random):
+    user = ctx.headers(ctx.user(rng))
+    roll = rng.random()
+    if roll < 0.6:
+        await recorder.request(client, "GET /books/{isbn}", "GET", f"/books/{ctx.isbn(rng)}", headers=user)
+    elif roll < 0.9:
+        from pagination import encode_cursor
+        after = isbn_for(rng.randrange(ctx.books))
+        await recorder.request(client, "GET /", "GET", "/", params={"limit": 50, "cursor": encode_cursor(after)},
+                               headers=user)
+    else:
+        await recorder.request(client, "GET /categories", "GET", "/categories", headers=user)
+
+
+async def search(client, ctx, recorder, rng):
+    await recorder.request(client, "GET /books/search", "GET", "/books/search",
+                           params={"q": _search_term(rng)}, headers=ctx.headers(ctx.user(rng)))
+
+
+async def suggest(client, ctx, recorder, rng):
+    """Typing a word into the search box: one request per keystroke."""
+    user = ctx.headers(ctx.user(rng))
+    word = rng.choice(ADJECTIVES + NOUNS)
+    for length in range(1, len(word) + 1):
+        await recorder.request(client, "GET /books/suggest", "GET", "/books/suggest",
+                               params={"prefix": word[:length]}, headers=user)
+
+
+async def login_burst(client, ctx, recorder, rng):
+    user_id = rng.randint(1, ctx.users)
+    await recorder.request(client, "POST /login", "POST", "/login",
+                           params={"email": f"member{user_id}@bench.example", "password": PASSWORD})
+
+
+async def borrow_return(client, ctx, recorder, rng):
+    user = ctx.headers(ctx.user(rng))
+    isbn = ctx.isbn(rng)
+    response = await recorder.request(client, "POST /borrow", "POST", "/borrow", json={"book_id": isbn}, headers=user)
+    if response is not None and response.status_code == 200:
+        await recorder.request(client, "POST /return/{book_id}", "POST", f"/return/{isbn}", headers=user)
+
+
+async def batch_borrow_return(client, ctx, recorder, rng, size: int = 5):
+    user = ctx.headers(ctx.user(rng))
+    isbns = list({ctx.isbn(rng) for _ in range(size)})
+    response = await recorder.request(client, "POST /borrow/batch", "POST", "/borrow/batch", items=len(isbns),
+                                      json={"book_ids": isbns}, headers=user)
+    if response is not None and response.status_code == 200:
+        borrowed = [result["book_id"] for result in response.json()["results"] if result["ok"]]
+        if borrowed:
+            await recorder.request(client, "POST /return/batch", "POST", "/return/batch", items=len(borrowed),
+                                   json={"book_ids": borrowed}, headers=user)
+
+
+async def history(client, ctx, recorder, rng):
+    await recorder.request(client, "GET /borrow-history", "GET", "/borrow-history", params={"limit": 50},
+                           headers=ctx.headers(ctx.user(rng)))
+
+
+async def similar(client, ctx, recorder, rng):
+    await recorder.request(client, "GET /books/{isbn}/similar", "GET", f"/books/{ctx.isbn(rng)}/similar",
+                           headers=ctx.headers(ctx.user(rng)))
+
+
+async def overdues(client, ctx, recorder, rng):
+    # Member 1 is a librarian
+    await recorder.request(client, "GET /overdues", "GET", "/overdues", params={"limit": 100}, headers=ctx.headers(1))
+
+
+async def flood(client, ctx, recorder, rng):
+    """One client hammering search while others look books up; run with --rate-limit."""
+    if rng.random() < 0.8:
+        await recorder.request(client, "flood GET /books/search", "GET", "/books/search",
+                               params={"q": _search_term(rng)}, headers=ctx.headers(2))
+    else:
+        await recorder.request(client, "GET /books/{isbn}", "GET", f"/books/{ctx.isbn(rng)}",
+                               headers=ctx.headers(ctx.user(rng)))
+
+
+async def catalog_pages(client, ctx, recorder, rng, pages: int = 20):
+    """Walk the catalog a keyset page at a time from a random point."""
+    from pagination import encode_cursor
+    user = ctx.headers(ctx.user(rng))
+    params = {"limit": 100, "cursor": encode_cursor(isbn_for(rng.randrange(ctx.books)))}
+    for _ in range(pages):
+        response = await recorder.request(client, "GET / (cursor)", "GET", "/", items=params["limit"],
+                                          params=params, headers=user)
+        if response is None or response.status_code != 200 or not response.json()["next_cursor"]:
+            break
+        params["cursor"] = response.json()["next_cursor"]
+
+
+async def export(client, ctx, recorder, rng):
+    """
+    The whole catalog as NDJSON: time to first byte, and to the last row.
+    Only against --url is the first byte early: the in-process transport
+    hands over a body once it is complete.
+    """
+    user = ctx.headers(ctx.user(rng))
+    started = time.perf_counter()
+    rows = 0
+    try:
+        async with client.stream("GET", "/", params={"format": "ndjson"}, headers=user) as response:
+            async for chunk in response.aiter_bytes():
+                if not rows:
+                    recorder.record("GET /?format=ndjson first byte", time.perf_counter() - started,
+                                    response.status_code)
+                rows += chunk.count(b"\n")
+    except Exception as error:
+        recorder.error("GET /?format=ndjson", error)
+        return
+    recorder.record("GET /?format=ndjson", time.perf_counter() - started, response.status_code, items=rows)
+
+
+async def history_pages(client, ctx, recorder, rng, pages: int = 20):
+    """Page back through an active member's history, into archived months where there are any."""
+    user = ctx.headers(ctx.user(rng))
+    params = {"limit": 50}
+    for page in range(pages):
+        label = "GET /borrow-history (cursor)" if page else "GET /borrow-history"
+        response = await recorder.request(client, label, "GET", "/borrow-history", params=params, headers=user)
+        if response is None or response.status_code != 200 or not response.json()["next_cursor"]:
+            break
+        params["cursor"] = response.json()["next_cursor"]
+
+
+# The most borrowed titles, which concurrent borrowers and holds compete for
+HOT_TITLES = 8
+
+
+async def hot_borrow(client, ctx, recorder, rng):
+    """Members racing for a few popular titles; 400s are borrows that found no copy."""
+    user = ctx.headers(ctx.user(rng))
+    isbn = isbn_for(rng.randrange(HOT_TITLES))
+    response = await recorder.request(client, "hot POST /borrow", "POST", "/borrow", json={"book_id": isbn},
+                                      headers=user)
+    if response is not None and response.status_code == 200:
+        await recorder.request(client, "hot POST /return/{book_id}", "POST", f"/return/{isbn}", headers=user)
+
+
+async def holds(client, ctx, recorder, rng, wait: float = 5):
+    """
+    One member borrows a popular title while another queues for it and long
+    polls; the wait should end as soon as the first returns it. "hold ready
+    after return" is the time from the return's response to the wait's. Mix
+    with hot_borrow for return latency while members poll.
+    """
+    lender = ctx.user(rng)
+    waiter = ctx.user(rng)
+    if lender == waiter:
+        return
+    isbn = isbn_for(rng.randrange(HOT_TITLES))
+    borrowed = await recorder.request(client, "hot POST /borrow", "POST", "/borrow", json={"book_id": isbn},
+                                      headers=ctx.headers(lender))
+    if borrowed is None or borrowed.status_code != 200:
+        return
+    placed = await recorder.request(client, "POST /holds", "POST", "/holds", json={"book_id": isbn},
+                                    headers=ctx.headers(waiter))
+    if placed is None or placed.status_code != 200:
+        # Copies are still on the shelf, so there is nothing to queue for
+        await recorder.request(client, "hot POST /return/{book_id}", "POST", f"/return/{isbn}",
+                               headers=ctx.headers(lender))
+        return
+
+    waiting = asyncio.ensure_future(recorder.request(
+        client, "GET /holds/wait", "GET", "/holds/wait", params={"timeout": wait}, headers=ctx.headers(waiter),
+    ))
+    await asyncio.sleep(rng.uniform(0, wait / 10))
+    await recorder.request(client, "hot POST /return/{book_id}", "POST", f"/return/{isbn}",
+                           headers=ctx.headers(lender))
+    returned = time.perf_counter()
+    ready = await waiting
+    if ready is not None and ready.status_code == 200 and ready.json():
+        recorder.record("hold ready after return", max(0.0, time.perf_counter() - returned), 200)
+        claimed = await recorder.request(client, "hot POST /borrow", "POST", "/borrow", json={"book_id": isbn},
+                                         headers=ctx.headers(waiter))
+        if claimed is not None and claimed.status_code == 200:
+            await recorder.request(client, "hot POST /return/{book_id}", "POST", f"/return/{isbn}",
+                                   headers=ctx.headers(waiter))
+    else:
+        await recorder.request(client, "DELETE /holds/{hold_id}", "DELETE", f"/holds/{placed.json()['id']}",
+                               headers=ctx.headers(waiter))
+
+
+# Rows per bulk_import request
+IMPORT_ROWS = 1000
+
+
+async def bulk_import(client, ctx, recorder, rng):
+    """A librarian importing new titles as CSV; items per second is rows per second."""
+    lines = ["isbn_number,title,author,category_id,copies"]
+    for _ in range(IMPORT_ROWS):
+        # 979 ISBNs, which bench.generate never uses
+        lines.append(f"979{rng.randrange(10 ** 10):010d},The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)},"
+                     f"Bench Author,{rng.randint(1, 10)},{rng.randint(1, 3)}")
+    await recorder.request(client, "POST /books/import", "POST", "/books/import", items=IMPORT_ROWS,
+                           params={"format": "csv"}, content="\n".join(lines).encode("utf-8"),
+                           headers=ctx.headers(1))
+
+
+async def stats(client, ctx, recorder, rng):
+    """The librarian dashboard, read from the circulation counters."""
+    path = rng.choice(("", "/categories", "/top-books", "/overdue", "/daily"))
+    await recorder.request(client, f"GET /stats{path}", "GET", f"/stats{path}", headers=ctx.headers(1))
+
+
+SCENARIOS = {
+    scenario.__name__: scenario
+    for scenario in (
+        browse, search, suggest, login_burst, borrow_return, batch_borrow_return, history, similar, overdues, flood,
+        catalog_pages, export, history_pages, hot_borrow, holds, bulk_import, stats,
+    )
+}
+
+
+async def _run_workers(client, ctx: Context, scenario, recorder: Recorder, concurrency: int, seed: int, more):
+    """Run `scenario` in `concurrency` workers for as long as more() allows another iteration."""
+    async def worker(number: int):
+        rng = random.Random(seed * 1000 + number)
+        while more():
+            await scenario(client, ctx, recorder, rng)
+
+    await asyncio.gather(*(worker(number) for number in range(concurrency)))
+
+
+async def run_scenario(client, ctx: Context, scenario, iterations: int, concurrency: int, seed: int,
+                       warmup: int = 0) -> dict:
+    """Run `iterations` of `scenario` across `concurrency` workers."""
+    for n in range(warmup):
+        await scenario(client, ctx, Recorder(), random.Random(seed - n - 1))
+
+    recorder = Recorder()
+    remaining = iterations
+
+    def more() -> bool:
+        nonlocal remaining
+        remaining -= 1
+        return remaining >= 0
+
+    started = time.perf_counter()
+    await _run_workers(client, ctx, scenario, recorder, concurrency, seed, more)
+    seconds = time.perf_counter() - started
+    return {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "seconds": round(seconds, 3),
+        "iterations_per_second": round(iterations / seconds, 2),
+        "routes": recorder.report(seconds),
+    }
+
+
+async def run_mix(client, ctx: Context, mix: list[tuple[str, int]], iterations: int, seed: int,
+                  warmup: int = 0) -> dict:
+    """
+    Run scenarios at the same time: `iterations` of the first, while the
+    others keep their workers busy until it finishes. Routes are reported
+    per scenario, e.g. catalog latency during a login burst:
+        [("browse", 32), ("login_burst", 8)]
+    """
+    for name, _ in mix:
+        for n in range(warmup):
+            await SCENARIOS[name](client, ctx, Recorder(), random.Random(seed - n - 1))
+
+    recorders = [Recorder() for _ in mix]
+    counts = [0] * len(mix)
+    finished = False
+
+    def allowance(part: int):
+        def more() -> bool:
+            done = finished if part else counts[0] >= iterations
+            if not done:
+                counts[part] += 1
+            return not done
+        return more
+
+    started = time.perf_counter()
+    background = [
+        asyncio.ensure_future(_run_workers(
+            client, ctx, SCENARIOS[name], recorders[part], concurrency, seed + part, allowance(part),
+        ))
+        for part, (name, concurrency) in enumerate(mix) if part
+    ]
+    name, concurrency = mix[0]
+    await _run_workers(client, ctx, SCENARIOS[name], recorders[0], concurrency, seed, allowance(0))
+    seconds = time.perf_counter() - started
+    finished = True
+    await asyncio.gather(*background)
+
+    routes = {}
+    for (name, _), recorder in zip(mix, recorders):
+        routes.update({f"{name} {label}": route for label, route in recorder.report(seconds).items()})
+    return {
+        "mix": dict(mix),
+        "iterations": dict(zip((name for name, _ in mix), counts)),
+        "seconds": round(seconds, 3),
+        "iterations_per_second": round(iterations / seconds, 2),
+        "routes": routes,
+    }
+
+
+def _replay_request(record: dict, ctx: Context, rng: random.Random) -> Optional[tuple[str, str, dict]]:
+    """A request like the logged one, with path parameters and bodies made up from the generated data."""
+    method, route = record["method"], record.get("route")
+    if not route:
+        return None
+    isbn = ctx.isbn(rng)
+    path = (route.replace("{isbn}", isbn).replace("{isbn_number}", isbn).replace("{book_id}", isbn)
+            .replace("{user_id}", str(record.get("user_id") or ctx.user(rng))))
+    if "{" in path:
+        return None
+    kwargs = {}
+    if path == "/books/search":
+        kwargs["params"] = {"q": _search_term(rng)}
+    elif path == "/books/suggest":
+        kwargs["params"] = {"prefix": _search_term(rng)}
+    elif method == "POST" and path == "/login":
+        kwargs["params"] = {"email": f"member{ctx.user(rng)}@bench.example", "password": PASSWORD}
+    elif method == "POST" and path in ("/borrow", "/holds"):
+        kwargs["json"] = {"book_id": isbn}
+    elif method == "POST" and path in ("/borrow/batch", "/return/batch"):
+        kwargs["json"] = {"book_ids": [isbn]}
+    elif method != "GET" and not path.startswith("/return/"):
+        return None
+    return method, path, kwargs
+
+
+async def run_replay(client, ctx: Context, path: str, speed: float, seed: int) -> dict:
+    """
+    Replay an access log (see middleware/logging.py) at its recorded pace,
+    times `speed`, each member from an address of their own and sending
+    If-None-Match for bodies it has seen. With --rate-limit this shows what
+    real traffic gets refused or shed, and how often caches answer 304.
+    """
+    rng = random.Random(seed)
+    with open(path, encoding="utf-8") as log:
+        records = [json.loads(line) for line in log if line.strip()]
+    records.sort(key=lambda record: record["ts"])
+    recorder = Recorder()
+    etags = {}
+    skipped = 0
+
+    async def send(record: dict, method: str, url: str, kwargs: dict):
+        user_id = record.get("user_id") or ctx.user(rng)
+        address = f"10.{user_id >> 16 & 255}.{user_id >> 8 & 255}.{user_id & 255}"
+        headers = {**ctx.headers(user_id), "X-Forwarded-For": address}
+        key = (user_id, url, str(kwargs.get("params")))
+        if method == "GET" and key in etags:
+            headers["If-None-Match"] = etags[key]
+        response = await recorder.request(client, f"{method} {record['route']}", method, url, headers=headers,
+                                          **kwargs)
+        if response is not None and "etag" in response.headers:
+            etags[key] = response.headers["etag"]
+
+    tasks = []
+    first = datetime.datetime.fromisoformat(records[0]["ts"]) if records else None
+    started = time.perf_counter()
+    for record in records:
+        request = _replay_request(record, ctx, rng)
+        if request is None:
+            skipped += 1
+            continue
+        delay = (datetime.datetime.fromisoformat(record["ts"]) - first).total_seconds() / speed
+        delay -= time.perf_counter() - started
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send(record, *request)))
+    await asyncio.gather(*tasks)
+    seconds = time.perf_counter() - started
+    return {
+        "log": path,
+        "speed": speed,
+        "requests": len(tasks),
+        "skipped": skipped,
+        "seconds": round(seconds, 3),
+        "iterations_per_second": round(len(tasks) / seconds, 2) if seconds else 0.0,
+        "routes": recorder.report(seconds),
+    }
+
+
+@contextlib.asynccontextmanager
+async def _client(url: str):
+    import httpx
+    if url:
+        async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+            yield client
+        return
+    from main import app
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            yield client
+
+
+def run_job(name: str) -> dict:
+    """Time one run of a background job against the database."""
+    from sqlalchemy.orm import Session
+    from database import get_engine
+    started = time.perf_counter()
+    if name == "overdue_sweep":
+        from overdues import run_overdue_sweep
+        result = run_overdue_sweep()
+    elif name == "recommendations":
+        from recommendations import build_recommendations
+        with tempfile.TemporaryDirectory() as directory, Session(get_engine()) as session:
+            result = build_recommendations(session, f"{directory}/state.npz", full=True)
+    elif name == "adhoc_stats":
+        with Session(get_engine()) as session:
+            result = adhoc_stats(session)
+    else:
+        from archive import run_history_maintenance
+        result = run_history_maintenance()
+    return {"seconds": round(time.perf_counter() - started, 3), "result": result}
+
+
+def adhoc_stats(session) -> dict:
+    """
+    The dashboard computed with GROUP BY over copies and member_book, as it
+    would be without the counters in stats.py, to set against the stats scenario.
+    """
+    from sqlalchemy import func, select
+    from models import Book, Copy, MemberBook
+    timings = {}
+    since = datetime.datetime.utcnow() - datetime.timedelta(days=30)
+    queries = {
+        "categories": select(Book.category_id, func.count(), func.count().filter(Copy.status == "borrowed"))
+        .join(Copy, Copy.book_id == Book.isbn_number).group_by(Book.category_id),
+        "top_books": select(MemberBook.book_id, func.count().label("borrows"))
+        .group_by(MemberBook.book_id).order_by(func.count().desc()).limit(10),
+        "daily": select(func.date(MemberBook.borrow_date), func.count())
+        .where(MemberBook.borrow_date >= since).group_by(func.date(MemberBook.borrow_date)),
+    }
+    for name, query in queries.items():
+        started = time.perf_counter()
+        session.execute(query).all()
+        timings[f"{name}_seconds"] = round(time.perf_counter() - started, 3)
+    return timings
+
+
+JOBS = ("overdue_sweep", "recommendations", "archive", "adhoc_stats")
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args) -> dict:
+    sizes = dict(SCALES[args.scale])
+    ctx = Context(args.books or sizes["books"], args.users or sizes["users"], args.zipf)
+    report = {
+        "commit": _commit(),
+        "target": args.url or "in-process",
+        "started_at": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+        "scale": args.scale,
+        "scenarios": {},
+        "jobs": {},
+    }
+    if args.scenarios or args.mix or args.replay:
+        async with _client(args.url) as client:
+            for name in args.scenarios:
+                report["scenarios"][name] = await run_scenario(
+                    client, ctx, SCENARIOS[name], args.requests, args.concurrency, args.seed, args.warmup,
+                )
+            for mix in args.mix or ():
+                report["scenarios"]["+".join(name for name, _ in mix)] = await run_mix(
+                    client, ctx, mix, args.requests, args.seed, args.warmup,
+                )
+            if args.replay:
+                report["scenarios"]["replay"] = await run_replay(client, ctx, args.replay, args.speed, args.seed)
+    for name in args.jobs or ():
+        # Off the event loop: the overdue sweep runs its own to release holds
+        report["jobs"][name] = await asyncio.to_thread(run_job, name)
+    if not args.url:
+        # ru_maxrss is in kilobytes on Linux; in process this includes the API
+        report["peak_memory_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return report
+
+
+def _mix_part(value: str) -> tuple[str, int]:
+    name, _, concurrency = value.partition(":")
+    if name not in SCENARIOS:
+        raise argparse.ArgumentTypeError(f"unknown scenario: {name}")
+    try:
+        return name, int(concurrency or 16)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a concurrency: {concurrency}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run load scenarios against the API and report latencies as JSON.")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario", help=f"any of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--jobs", nargs="*", choices=JOBS, help="background jobs to time once each")
+    parser.add_argument("--mix", nargs="+", action="append", type=_mix_part, metavar="scenario:concurrency",
+                        help="run scenarios at once, --requests iterations of the first; repeat for more mixes")
+    parser.add_argument("--replay", metavar="access.log", help="replay an access log at its recorded pace")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay this many times faster")
+    parser.add_argument("--url", help="base URL of a live server; default runs main:app in process")
+    parser.add_argument("--requests", type=int, default=1000, help="iterations per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=20, help="unrecorded iterations first")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small", help="scale the data was generated at")
+    parser.add_argument("--books", type=int)
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--rate-limit", action="store_true", help="keep the rate limiter on (in process)")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    os.environ["rate_limit_enabled"] = str(args.rate_limit)
+    if args.replay:
+        # Replayed members each come from their own X-Forwarded-For address
+        os.environ.setdefault("rate_limit_trust_forwarded", "True")
+    report = asyncio.run(run(args))
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
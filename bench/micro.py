@@ -0,0 +1,260 @@
+"""
+Micro-benchmarks of single code paths, without a database, as JSON:
+
+- serialization: a page of books encoded the old way (jsonable_encoder and
+  json.dumps) against the response model path (pydantic and orjson)
+- rate_limiter, access_log, metrics: per-request overhead of each middleware
+  around a no-op app (the access log with its writer thread running)
+- startup: seconds to import main:app in a fresh interpreter
+- recommendations: co-occurrence build and neighbour scoring on synthetic
+  Zipf borrows, with peak memory
+- suggest: typeahead index build time, memory footprint and lookup latency
+  percentiles over synthetic titles (1M by default)
+
+    python -m bench.micro serialization rate_limiter --rows 10000
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARKS = ("serialization", "rate_limiter", "access_log", "metrics", "startup", "recommendations", "suggest")
+
+
+def _timed(function, repeat: int) -> dict:
+    """Best and median seconds of `repeat` calls."""
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - started)
+    return {"best_ms": round(min(seconds) * 1000, 3), "median_ms": round(statistics.median(seconds) * 1000, 3)}
+
+
+def serialization(rows: int, repeat: int) -> dict:
+    import orjson
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+    from schemas import BookResponse
+
+    books = [
+        {"isbn_number": f"978{n:010d}", "title": f"Title {n}", "author": f"Author {n % 997}",
+         "category_id": n % 40, "total_copies": 3, "available_copies": n % 4}
+        for n in range(rows)
+    ]
+    adapter = TypeAdapter(list[BookResponse])
+
+    def encoder():
+        json.dumps(jsonable_encoder([BookResponse(**book) for book in books])).encode("utf-8")
+
+    def response_model():
+        adapter.dump_json(adapter.validate_python(books))
+
+    def model_orjson():
+        orjson.dumps(adapter.dump_python(adapter.validate_python(books), mode="json"))
+
+    return {
+        "rows": rows,
+        "jsonable_encoder_json": _timed(encoder, repeat),
+        "pydantic_dump_json": _timed(response_model, repeat),
+        "pydantic_orjson": _timed(model_orjson, repeat),
+    }
+
+
+def _middleware_overhead(wrap, requests: int) -> dict:
+    """Per-request time of a no-op ASGI app with and without `wrap` around it."""
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    async def drive(handler) -> float:
+        started = time.perf_counter()
+        for n in range(requests):
+            scope = {
+                "type": "http", "method": "GET", "path": f"/books/978{n % 1000:010d}", "headers": [],
+                "client": (f"10.0.{n % 250}.{n % 7}", 50000),
+            }
+            await handler(scope, receive, send)
+        return time.perf_counter() - started
+
+    async def compare():
+        bare = await drive(app)
+        wrapped = await drive(wrap(app))
+        return bare, wrapped
+
+    bare, wrapped = asyncio.run(compare())
+    return {
+        "requests": requests,
+        "bare_us_per_request": round(bare / requests * 1e6, 3),
+        "wrapped_us_per_request": round(wrapped / requests * 1e6, 3),
+        "overhead_us_per_request": round((wrapped - bare) / requests * 1e6, 3),
+    }
+
+
+def rate_limiter(requests: int) -> dict:
+    # Enabled whatever the environment says, with buckets big enough that nothing is refused
+    os.environ.update(rate_limit_enabled="True", rate_limit_ip_rate="1e9", rate_limit_ip_burst="1e9")
+    from middleware.rate_limit import RateLimitMiddleware
+    return _middleware_overhead(RateLimitMiddleware, requests)
+
+
+def access_log(requests: int) -> dict:
+    """AccessLogMiddleware with its writer thread running, and how many records it had to drop."""
+    from middleware.logging import AccessLogMiddleware, access_queue_handler, start_access_log, stop_access_log
+    start_access_log()
+    try:
+        result = _middleware_overhead(AccessLogMiddleware, requests)
+    finally:
+        stop_access_log()
+    return {**result, "dropped": access_queue_handler.dropped}
+
+
+def metrics(requests: int) -> dict:
+    from middleware.metrics import MetricsMiddleware
+    return _middleware_overhead(MetricsMiddleware, requests)
+
+
+def startup(repeat: int) -> dict:
+    """Import time of main:app; the lifespan (engines, pool warm-up) is not run."""
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import bench, main"], check=True)
+        seconds.append(time.perf_counter() - started)
+    return {"best_s": round(min(seconds), 3), "median_s": round(statistics.median(seconds), 3)}
+
+
+def recommendations(borrows: int, titles: int, members: int, seed: int) -> dict:
+    import numpy as np
+    from bench.generate import zipf_choice
+    from recommendations import BorrowMatrix
+
+    rng = np.random.default_rng(seed)
+    users = zipf_choice(rng, members, borrows, 0.9).astype(np.int32)
+    columns = zipf_choice(rng, titles, borrows, 1.1).astype(np.int32)
+    matrix = BorrowMatrix.empty()
+    for column in range(titles):
+        matrix.column(f"978{column:010d}")
+
+    started = time.perf_counter()
+    matrix.add_borrows(users, columns)
+    built = time.perf_counter()
+    neighbours = sum(len(found) for _, found, _ in matrix.neighbours(np.arange(titles), 20, 2))
+    scored = time.perf_counter()
+    # A tenth more borrows on top, as an incremental run would add
+    extra = max(1, borrows // 10)
+    changed = matrix.add_borrows(
+        zipf_choice(rng, members, extra, 0.9).astype(np.int32), zipf_choice(rng, titles, extra, 1.1).astype(np.int32),
+    )
+    incremental = time.perf_counter()
+
+    return {
+        "borrows": borrows,
+        "titles": titles,
+        "members": members,
+        "pairs": int(matrix.cooccurrence.nnz),
+        "neighbours": neighbours,
+        "build_s": round(built - started, 3),
+        "score_s": round(scored - built, 3),
+        "incremental_s": round(incremental - scored, 3),
+        "incremental_titles_changed": len(changed),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_memory_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def suggest(titles: int, lookups: int, seed: int) -> dict:
+    import random
+    from bench.generate import ADJECTIVES, FIRST_NAMES, LAST_NAMES, NOUNS
+    from suggest import SuggestIndex
+
+    rng = random.Random(seed)
+    words = ADJECTIVES + NOUNS
+    # Made-up words too, so prefixes beyond the first few letters narrow down
+    words += ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 9))) for _ in range(20000)]
+
+    def rows():
+        for n in range(titles):
+            title = " ".join(rng.choice(words) for _ in range(rng.randint(1, 5))).title()
+            author = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            # Zipf-like borrow counts, popular titles first as in bench.generate
+            yield f"978{n:010d}", title, author, int(10000 / (n + 1) ** 0.8)
+
+    index = SuggestIndex(rows())
+    latencies = []
+    for _ in range(lookups):
+        word = rng.choice(words)
+        prefix = word[:rng.randint(1, len(word))]
+        started = time.perf_counter()
+        index.suggest(prefix, 10)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    stats = index.stats()
+    return {
+        "titles": titles,
+        "keys": stats["keys"],
+        "hot_prefixes": stats["hot_prefixes"],
+        "build_s": round(index.build_seconds, 3),
+        "index_memory_mb": round(stats["memory_bytes"] / 2 ** 20, 1),
+        "lookups": lookups,
+        "lookup_us": {
+            f"p{pct}": round(latencies[min(len(latencies) - 1, len(latencies) * pct // 100)] * 1e6, 1)
+            for pct in (50, 90, 99)
+        },
+        # ru_maxrss is in kilobytes on Linux
+        "peak_memory_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run micro-benchmarks and report them as JSON.")
+    parser.add_argument("benchmarks", nargs="*", metavar="benchmark",
+                        help=f"any of: {', '.join(BENCHMARKS)} (default all)")
+    parser.add_argument("--rows", type=int, default=10000, help="books per serialized page")
+    parser.add_argument("--requests", type=int, default=100000, help="requests through each middleware")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--borrows", type=int, default=1000000, help="synthetic borrows for recommendations")
+    parser.add_argument("--titles", type=int, default=50000)
+    parser.add_argument("--members", type=int, default=100000)
+    parser.add_argument("--suggest-titles", type=int, default=1000000, help="synthetic titles for suggest")
+    parser.add_argument("--lookups", type=int, default=100000, help="suggest lookups timed")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    report = {}
+    for name in args.benchmarks or BENCHMARKS:
+        if name == "serialization":
+            report[name] = serialization(args.rows, args.repeat)
+        elif name == "rate_limiter":
+            report[name] = rate_limiter(args.requests)
+        elif name == "access_log":
+            report[name] = access_log(args.requests)
+        elif name == "metrics":
+            report[name] = metrics(args.requests)
+        elif name == "startup":
+            report[name] = startup(args.repeat)
+        elif name == "recommendations":
+            report[name] = recommendations(args.borrows, args.titles, args.members, args.seed)
+        else:
+            report[name] = suggest(args.suggest_titles, args.lookups, args.seed)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
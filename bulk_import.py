@@ -0,0 +1,276 @@
+"""
+Bulk catalog import from CSV or JSON Lines.
+
+Rows carry isbn_number, title, author, either category_id or a category
+name, and optionally the number of copies of a new title (default 1);
+unknown category names are created. Rows are validated with
+BookCreate and written in chunks with INSERT ... ON CONFLICT, one
+transaction per chunk.
+
+Command line usage:
+    python -m bulk_import books.csv --format csv --on-conflict update
+"""
+import argparse
+import csv
+import json
+import sys
+from typing import Iterable, Iterator, Literal
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from database import dialect_insert, get_engine
+from models import Book, Category, Copy
+from inventory import AvailabilityDeltas, copy_counts, default_barcode
+from schemas import BookCreate
+from search import queue_book_index
+from stats import CategoryDeltas
+from response_cache import BOOKS, CATEGORIES, version_bump_statement
+
+DEFAULT_BATCH_SIZE = 2000
+# asyncpg allows at most 32767 bound parameters per statement; a batch's
+# book INSERT binds 4 per row, and copies are inserted MAX_COPY_CHUNK at a
+# time (3 parameters each, and at most one 4 parameter availability row)
+MAX_BIND_PARAMETERS = 32767
+MAX_BATCH_SIZE = 8000
+MAX_COPY_CHUNK = MAX_BIND_PARAMETERS // 4
+# Only the first errors are kept in the report; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+ImportFormat = Literal["csv", "jsonl"]
+ConflictPolicy = Literal["skip", "update"]
+
+
+def iter_records(lines: Iterable[str], format: ImportFormat) -> Iterator[dict]:
+    """Parse an iterable of text lines into row dicts, without reading ahead."""
+    if format == "csv":
+        yield from csv.DictReader(lines)
+    else:
+        for line in lines:
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield record if isinstance(record, dict) else {"_invalid": line.strip()[:100]}
+
+
+class LineBatchParser:
+    """Parses successive batches of single-line records, remembering the CSV header."""
+
+    def __init__(self, format: ImportFormat):
+        self.format = format
+        self.header = None
+
+    def parse(self, lines: list[str]) -> list[dict]:
+        if self.format == "csv" and self.header is None:
+            if not lines:
+                return []
+            self.header = next(csv.reader(lines[:1]))
+            lines = lines[1:]
+        if self.format == "csv":
+            return list(csv.DictReader(lines, fieldnames=self.header))
+        return list(iter_records(lines, self.format))
+
+
+class BookImporter:
+    """Validates and writes batches of book rows, accumulating a report across batches."""
+
+    def __init__(self, session: Session, on_conflict: ConflictPolicy = "skip"):
+        self.on_conflict = on_conflict
+        self.dialect = session.get_bind().dialect.name
+        self.categories = {name: id for id, name in session.execute(select(Category.id, Category.name))}
+        self.category_ids = set(self.categories.values())
+        self.rows = 0
+        self.written = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors = []
+
+    def _error(self, row: int, record: dict, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "isbn_number": record.get("isbn_number"), "error": message})
+
+    def _resolve_categories(self, session: Session, records: list[dict]):
+        """Create every category named in the batch that does not exist yet, in one statement."""
+        names = {
+            record["category"].strip() for record in records
+            if not record.get("category_id") and isinstance(record.get("category"), str) and record["category"].strip()
+        }
+        missing = names - self.categories.keys()
+        if not missing:
+            return
+        session.execute(self._insert(Category).values([{"name": name} for name in missing]).on_conflict_do_nothing())
+        session.execute(version_bump_statement(self.dialect, CATEGORIES))
+        for id, name in session.execute(select(Category.id, Category.name).where(Category.name.in_(missing))):
+            self.categories[name] = id
+            self.category_ids.add(id)
+
+    def _insert(self, model):
+        return dialect_insert(self.dialect, model.__table__)
+
+    def _validate(self, row: int, record: dict):
+        if "_invalid" in record:
+            self._error(row, {}, f"Not a JSON object: {record['_invalid']}")
+            return None
+        fields = {key: record.get(key) for key in ("isbn_number", "title", "author", "category_id")}
+        if record.get("copies") not in (None, ""):
+            fields["copies"] = record["copies"]
+        if not fields["category_id"] and record.get("category"):
+            if not isinstance(record["category"], str):
+                self._error(row, record, "category: must be a category name")
+                return None
+            fields["category_id"] = self.categories.get(record["category"].strip())
+        try:
+            book = BookCreate(**fields)
+        except ValidationError as exc:
+            self._error(row, record, "; ".join(
+                f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in exc.errors()
+            ))
+            return None
+        if book.category_id not in self.category_ids:
+            self._error(row, record, "Category not found")
+            return None
+        return book
+
+    def _add_copies(self, session: Session, copies: list[dict]) -> dict[str, int]:
+        """
+        Shelve the copies of newly imported titles (nobody can hold a title
+        yet) and return how many were added per title. Copies whose barcode
+        is already taken are left out.
+        """
+        added = {}
+        for start in range(0, len(copies), MAX_COPY_CHUNK):
+            availability_deltas = AvailabilityDeltas()
+            for copy_id, book_id in session.execute(
+                self._insert(Copy).values(copies[start:start + MAX_COPY_CHUNK])
+                .on_conflict_do_nothing().returning(Copy.id, Copy.book_id)
+            ):
+                availability_deltas.add(book_id, copy_id, total=1, available=1)
+                added[book_id] = added.get(book_id, 0) + 1
+            stmt = availability_deltas.statement(self.dialect)
+            if stmt is not None:
+                session.execute(stmt)
+        return added
+
+    def import_batch(self, session: Session, records: list[dict]):
+        """Validate `records` and write the valid ones in a single transaction."""
+        first_row = self.rows + 1
+        self.rows += len(records)
+        self._resolve_categories(session, records)
+
+        # Later rows win over earlier rows with the same ISBN in one batch
+        books = {}
+        for row, record in enumerate(records, start=first_row):
+            book = self._validate(row, record)
+            if book is None:
+                continue
+            if book.isbn_number in books:
+                self._error(books[book.isbn_number][0], record, "Duplicate ISBN in input, superseded by a later row")
+            books[book.isbn_number] = (row, book)
+
+        if books:
+            # Current category of rows an update may move, and their copy counts
+            existing = {}
+            copies = {}
+            if self.on_conflict == "update":
+                existing = dict(session.execute(
+                    select(Book.isbn_number, Book.category_id).where(Book.isbn_number.in_(list(books)))
+                ).all())
+                if existing:
+                    copies = {
+                        isbn_number: (total, borrowed)
+                        for isbn_number, total, borrowed in session.execute(copy_counts(list(existing)))
+                    }
+
+            stmt = self._insert(Book).values([
+                book.dict(exclude={"copies"}) for _, book in books.values()
+            ])
+            if self.on_conflict == "update":
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[Book.isbn_number],
+                    set_={column: stmt.excluded[column] for column in ("title", "author", "category_id")},
+                )
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=[Book.isbn_number])
+            written = set(session.scalars(stmt.returning(Book.isbn_number)))
+            self.written += len(written)
+            self.skipped += len(books) - len(written)
+
+            category_deltas = CategoryDeltas()
+            new_copies = []
+            for isbn_number in written:
+                book = books[isbn_number][1]
+                queue_book_index(session, book.isbn_number, book.title, book.author, book.category_id)
+                if isbn_number not in existing:
+                    new_copies += [
+                        {"book_id": isbn_number, "barcode": default_barcode(isbn_number, number), "status": "available"}
+                        for number in range(1, book.copies + 1)
+                    ]
+                elif existing[isbn_number] != book.category_id:
+                    total, borrowed = copies.get(isbn_number, (0, 0))
+                    category_deltas.add(existing[isbn_number], isbn_number, total=-total, borrowed=-borrowed)
+                    category_deltas.add(book.category_id, isbn_number, total=total, borrowed=borrowed)
+            for isbn_number, count in self._add_copies(session, new_copies).items():
+                category_deltas.add(books[isbn_number][1].category_id, isbn_number, total=count)
+            category_deltas.apply(session)
+            if written:
+                session.execute(version_bump_statement(self.dialect, BOOKS))
+        session.commit()
+
+    def report(self) -> dict:
+        return {
+            "rows": self.rows,
+            "written": self.written,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
+
+
+def batched(records: Iterable[dict], batch_size: int) -> Iterator[list[dict]]:
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_books(session: Session, lines: Iterable[str], format: ImportFormat,
+                 on_conflict: ConflictPolicy = "skip", batch_size: int = DEFAULT_BATCH_SIZE) -> dict:
+    """Stream `lines` into the books table and return the import report."""
+    importer = BookImporter(session, on_conflict=on_conflict)
+    for batch in batched(iter_records(lines, format), batch_size):
+        importer.import_batch(session, batch)
+    return importer.report()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import books from CSV or JSON Lines.")
+    parser.add_argument("path", help="input file, or - for stdin")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="defaults to the file extension")
+    parser.add_argument("--on-conflict", choices=["skip", "update"], default="skip",
+                        help="what to do with ISBNs that already exist")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help=f"at most {MAX_BATCH_SIZE}")
+    args = parser.parse_args(argv)
+    if not 1 <= args.batch_size <= MAX_BATCH_SIZE:
+        parser.error(f"--batch-size must be between 1 and {MAX_BATCH_SIZE}")
+
+    format = args.format or ("csv" if args.path.endswith(".csv") else "jsonl")
+
+    with Session(get_engine()) as session:
+        if args.path == "-":
+            report = import_books(session, sys.stdin, format, args.on_conflict, args.batch_size)
+        else:
+            with open(args.path, newline="", encoding="utf-8") as lines:
+                report = import_books(session, lines, format, args.on_conflict, args.batch_size)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
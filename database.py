@@ -1,33 +1,549 @@
-from sqlalchemy import create_engine, URL
+import asyncio
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+import jwt
+from fastapi import Request
+from sqlalchemy import create_engine, make_url, text, URL
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import OperationalError
-from decouple import config
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from decouple import Csv, config
+from cache import CacheBackend, LRUCache
+from metrics import Gauge, pool_checkout_timeouts, pool_checkout_wait, registry
 
-# Load info from .env
-host = config('host')
-database = config('database')
-user = config('user')
-password = config('password')
+# "sync" runs handlers' queries on psycopg2 sessions in the threadpool,
+# "async" uses asyncpg sessions on the event loop
+DB_MODE = config('db_mode', default='sync')
 
-# Create a connection url using SQL Alchemy's URL class
-url = URL.create(
-    database=database,
-    username=user,
-    password=password,
-    host=host,
-    drivername="postgresql+psycopg2"
-)
+# Connection pool settings, shared by both engines
+POOL_OPTIONS = {
+    "pool_size": config('db_pool_size', default=5, cast=int),
+    "max_overflow": config('db_max_overflow', default=10, cast=int),
+    "pool_timeout": config('db_pool_timeout', default=30, cast=int),
+    "pool_recycle": config('db_pool_recycle', default=1800, cast=int),
+    "pool_pre_ping": config('db_pool_pre_ping', default=True, cast=bool),
+}
+# Connections each pool opens at startup, up to db_pool_size
+DB_POOL_WARMUP = config('db_pool_warmup', default=1, cast=int)
 
-# create a engine with above created url
-engine = create_engine(url, echo=False)
+# Read replicas sharing the primary's database name and credentials. Read-only
+# handlers use them unless the caller wrote within db_read_your_writes_seconds.
+REPLICA_HOSTS = config('db_replica_hosts', default='', cast=Csv())
+REPLICA_SELECTION = config('db_replica_selection', default='round_robin')  # or "least_connections"
+REPLICA_RETRY_SECONDS = config('db_replica_retry_seconds', default=30, cast=float)
+READ_YOUR_WRITES_SECONDS = config('db_read_your_writes_seconds', default=10, cast=float)
+READ_YOUR_WRITES_CACHE_SIZE = config('db_read_your_writes_cache_size', default=100000, cast=int)
 
-try:
-    engine.connect().close()
+logger = logging.getLogger("api.database")
+
+
+def database_url() -> URL:
+    """
+    The primary's URL, built from the host, database, user and password
+    settings in .env, or given whole as database_url (e.g. a SQLite file for
+    local benchmarks).
+    """
+    url = config('database_url', default='')
+    if url:
+        return make_url(url)
+    return URL.create(
+        database=config('database'),
+        username=config('user'),
+        password=config('password'),
+        host=config('host'),
+        drivername="postgresql+psycopg2"
+    )
+
+
+# Smoothed checkout wait across all pools, read by load shedding. It also
+# halves every db_pool_wait_half_life seconds, so once checkouts stop (as
+# they do while everything is shed) an old burst stops counting.
+POOL_WAIT_SMOOTHING = 0.1
+POOL_WAIT_HALF_LIFE = config('db_pool_wait_half_life', default=2, cast=float)
+_pool_wait_average = 0.0
+_pool_wait_updated = time.monotonic()
+
+
+def _decayed_pool_wait(now: float) -> float:
+    return _pool_wait_average * 0.5 ** ((now - _pool_wait_updated) / POOL_WAIT_HALF_LIFE)
+
+
+def _record_pool_wait(seconds: float):
+    global _pool_wait_average, _pool_wait_updated
+    now = time.monotonic()
+    average = _decayed_pool_wait(now)
+    _pool_wait_average = average + POOL_WAIT_SMOOTHING * (seconds - average)
+    _pool_wait_updated = now
+
+
+def recent_pool_wait() -> float:
+    """Exponentially weighted average of how long recent checkouts waited for a connection, in seconds."""
+    return _decayed_pool_wait(time.monotonic())
+
+
+def timed_pool(pool_class, name: str):
+    """Subclass of `pool_class` recording how long each checkout waits for a connection."""
+
+    class TimedPool(pool_class):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            except PoolTimeoutError:
+                pool_checkout_timeouts.inc((name,))
+                raise
+            finally:
+                waited = time.perf_counter() - started
+                pool_checkout_wait.observe((name,), waited)
+                _record_pool_wait(waited)
+
+    TimedPool.__name__ = f"Timed{pool_class.__name__}"
+    return TimedPool
+
+
+class Replica:
+    """A read replica with its own pools, taken out of rotation for a while after a failed connect."""
+
+    def __init__(self, name: str, url: URL, host: str):
+        self.name = name
+        self.host = host
+        replica_url = url.set(host=host)
+        self.engine = create_engine(
+            replica_url, echo=False, poolclass=timed_pool(QueuePool, name), **POOL_OPTIONS,
+        )
+        self.async_engine = None
+        if DB_MODE == "async":
+            self.async_engine = create_async_engine(
+                replica_url.set(drivername="postgresql+asyncpg"), echo=False,
+                poolclass=timed_pool(AsyncAdaptedQueuePool, f"{name}_async"), **POOL_OPTIONS,
+            )
+        self.down_until = 0.0
+
+    def is_up(self, now: float) -> bool:
+        return self.down_until <= now
+
+    def mark_down(self):
+        self.down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+
+    def connections(self) -> int:
+        return (self.async_engine or self.engine).pool.checkedout()
+
+
+class ReplicaSet:
+    """
+    Picks replicas for read-only sessions, by round robin or fewest checked
+    out connections. A replica that fails to connect is skipped for
+    db_replica_retry_seconds, then tried again by the next read.
+    """
+
+    def __init__(self, replicas: list[Replica], selection: str):
+        self.replicas = replicas
+        self.selection = selection
+        self._turn = itertools.count()
+
+    def candidates(self) -> list[Replica]:
+        """Replicas currently in rotation, in the order to try them."""
+        now = time.monotonic()
+        up = [replica for replica in self.replicas if replica.is_up(now)]
+        if not up:
+            return []
+        if self.selection == "least_connections":
+            return sorted(up, key=Replica.connections)
+        start = next(self._turn) % len(up)
+        return up[start:] + up[:start]
+
+    async def connect_threaded(self):
+        """
+        Sync connection to the first reachable replica, opened in the
+        threadpool once one of its connection slots is free, and the slots
+        to release after closing it; or (None, None) to use the primary.
+        """
+        for replica in self.candidates():
+            slots = connection_slots(replica.engine)
+            await slots.acquire()
+            try:
+                return await run_in_threadpool(replica.engine.connect), slots
+            except OperationalError:
+                slots.release()
+                replica.mark_down()
+            except BaseException:
+                slots.release()
+                raise
+        return None, None
+
+    async def connect_async(self):
+        """Async connection to the first reachable replica, or None to use the primary."""
+        for replica in self.candidates():
+            try:
+                return await replica.async_engine.connect()
+            except OperationalError:
+                replica.mark_down()
+        return None
+
+
+# Engines are created by init_engines(), from the app's lifespan or on first
+# use, so importing this module neither reads credentials nor connects.
+engine = None
+async_engine = None
+AsyncSessionLocal = None
+replica_set = ReplicaSet([], REPLICA_SELECTION)
+
+
+def init_engines():
+    """Create the primary and replica engines, once. Opens no connections."""
+    global engine, async_engine, AsyncSessionLocal, replica_set
+    if engine is not None:
+        return
+    url = database_url()
+    if DB_MODE == "async":
+        async_engine = create_async_engine(
+            url.set(drivername="postgresql+asyncpg"), echo=False,
+            poolclass=timed_pool(AsyncAdaptedQueuePool, "primary_async"), **POOL_OPTIONS,
+        )
+        AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+    replica_set = ReplicaSet(
+        [Replica(f"replica_{index}", url, host) for index, host in enumerate(REPLICA_HOSTS)], REPLICA_SELECTION,
+    )
+    engine = create_engine(url, echo=False, poolclass=timed_pool(QueuePool, "primary"), **POOL_OPTIONS)
+
+
+# Per sync engine, how many sessions may hold one of its connections at once
+_connection_slots: dict = {}
+
+
+def connection_slots(pool_engine) -> asyncio.Semaphore:
+    """
+    Slots for pool_size + max_overflow sessions on `pool_engine`. In sync
+    mode a request takes one before its session first checks out a
+    connection, so requests beyond the pool's capacity wait on the event
+    loop. Waiting in the threadpool instead, blocked in checkout, ties up
+    the threads that sessions already holding a connection need to finish,
+    and nothing moves until db_pool_timeout.
+    """
+    slots = _connection_slots.get(pool_engine)
+    if slots is None:
+        slots = _connection_slots[pool_engine] = asyncio.Semaphore(
+            POOL_OPTIONS["pool_size"] + POOL_OPTIONS["max_overflow"]
+        )
+    return slots
+
+
+def get_engine():
+    """The primary's sync engine, created on first use; for scripts and background jobs."""
+    init_engines()
+    return engine
+
+
+def _fill_pool(pool_engine, connections: int):
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(pool_engine.connect())
+    finally:
+        for connection in opened:
+            connection.close()
+
+
+async def _fill_async_pool(pool_engine, connections: int):
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(await pool_engine.connect())
+    finally:
+        for connection in opened:
+            await connection.close()
+
+
+async def _warm_up(pool_engine, sync: bool, connections: int):
+    if sync:
+        await run_in_threadpool(_fill_pool, pool_engine, connections)
+    else:
+        await _fill_async_pool(pool_engine, connections)
+
+
+async def start_database():
+    """
+    Create the engines and open db_pool_warmup connections in each pool the
+    handlers use, so the first requests do not pay for connecting. An
+    unreachable primary is logged rather than raised: the worker stays
+    alive and /health/ready reports it until the database is back.
+    """
+    init_engines()
+    connections = min(DB_POOL_WARMUP, POOL_OPTIONS["pool_size"])
+    if connections <= 0:
+        return
+    sync = AsyncSessionLocal is None
+    try:
+        await _warm_up(engine if sync else async_engine, sync, connections)
+    except OperationalError as exc:
+        logger.warning("Primary database unreachable at startup: %s", exc.orig)
+    for replica in replica_set.replicas:
+        try:
+            await _warm_up(replica.engine if sync else replica.async_engine, sync, connections)
+        except OperationalError:
+            logger.warning("Read replica %s unreachable at startup", replica.host)
+            replica.mark_down()
+
+
+async def stop_database():
+    """Close every pooled connection."""
+    if async_engine is not None:
+        await async_engine.dispose()
+    if engine is not None:
+        engine.dispose()
+    for replica in replica_set.replicas:
+        if replica.async_engine is not None:
+            await replica.async_engine.dispose()
+        replica.engine.dispose()
+    # Semaphores belong to the event loop that waited on them
+    _connection_slots.clear()
+
+
+async def ping_primary():
+    """Run a trivial query on the primary; raises if it cannot be reached."""
+    async with _async_session() as session:
+        await session.execute(text("SELECT 1"))
+
+# Users who wrote recently; their reads go to the primary so they see their own changes
+recent_writers: CacheBackend = LRUCache(maxsize=READ_YOUR_WRITES_CACHE_SIZE, ttl=READ_YOUR_WRITES_SECONDS)
+
+
+def set_recent_writers_cache(cache: CacheBackend):
+    """Replace the read-your-writes cache, e.g. with one shared between workers."""
+    global recent_writers
+    recent_writers = cache
+
+
+def mark_recent_write(user_id: int):
+    """Send `user_id`'s reads to the primary for the next db_read_your_writes_seconds."""
+    if replica_set.replicas:
+        recent_writers.set(user_id, True)
+
+
+def _pool_status():
+    pools = {"primary": engine.pool} if engine is not None else {}
+    if async_engine is not None:
+        pools["primary_async"] = async_engine.pool
+    for replica in replica_set.replicas:
+        pools[replica.name] = replica.engine.pool
+        if replica.async_engine is not None:
+            pools[f"{replica.name}_async"] = replica.async_engine.pool
+    for name, pool in pools.items():
+        if isinstance(pool, QueuePool):
+            yield (name, "size"), pool.size()
+            yield (name, "checked_out"), pool.checkedout()
+            yield (name, "overflow"), max(pool.overflow(), 0)
+
+
+def _replica_status():
+    now = time.monotonic()
+    for replica in replica_set.replicas:
+        yield (replica.name, replica.host), 1 if replica.is_up(now) else 0
+
+
+registry.register(Gauge(
+    "db_pool_connections", "Connections per pool: configured size, checked out, and overflow in use.",
+    ("pool", "state"), _pool_status,
+))
+registry.register(Gauge(
+    "db_replica_up", "1 while a read replica is in rotation, 0 while it is skipped after a failed connect.",
+    ("replica", "host"), _replica_status,
+))
+
+
+class ThreadedSession:
+    """
+    AsyncSession-compatible facade over a sync Session that runs every
+    database call in the threadpool, so handlers are written once for both
+    DB modes. Given `slots` (see connection_slots), it holds one from its
+    first call until it commits, rolls back or closes, which is when the
+    Session gives its connection back.
+    """
+
+    def __init__(self, sync_session: Session, slots: Optional[asyncio.Semaphore] = None):
+        self.sync_session = sync_session
+        self.slots = slots
+        self._holding_slot = False
+
+    async def _run(self, fn, *args, **kwargs):
+        if self.slots is not None and not self._holding_slot:
+            await self.slots.acquire()
+            self._holding_slot = True
+        return await run_in_threadpool(fn, *args, **kwargs)
+
+    def _release_slot(self):
+        if self._holding_slot:
+            self._holding_slot = False
+            self.slots.release()
+
+    def get_bind(self, *args, **kwargs):
+        return self.sync_session.get_bind(*args, **kwargs)
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, *args, **kwargs):
+        return await self._run(self.sync_session.execute, statement, *args, **kwargs)
+
+    async def scalar(self, statement, *args, **kwargs):
+        return await self._run(self.sync_session.scalar, statement, *args, **kwargs)
+
+    async def scalars(self, statement, *args, **kwargs):
+        return await self._run(self.sync_session.scalars, statement, *args, **kwargs)
+
+    async def get(self, entity, ident, **kwargs):
+        return await self._run(self.sync_session.get, entity, ident, **kwargs)
+
+    async def delete(self, instance):
+        await self._run(self.sync_session.delete, instance)
+
+    async def flush(self):
+        await self._run(self.sync_session.flush)
+
+    async def commit(self):
+        await self._run(self.sync_session.commit)
+        self._release_slot()
+
+    async def rollback(self):
+        await self._run(self.sync_session.rollback)
+        self._release_slot()
+
+    async def refresh(self, instance, *args, **kwargs):
+        await self._run(self.sync_session.refresh, instance, *args, **kwargs)
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return await self._run(fn, self.sync_session, *args, **kwargs)
+
+    async def close(self):
+        try:
+            await run_in_threadpool(self.sync_session.close)
+        finally:
+            self._release_slot()
+
+
+def dialect_insert(dialect_name: str, table):
+    """INSERT construct with ON CONFLICT support for the given dialect."""
+    dialect = postgresql if dialect_name == "postgresql" else sqlite
+    return dialect.insert(table)
+
+
+def increment_statement(dialect_name: str, model, keys: dict, **deltas):
+    """Upsert that adds `deltas` to the counters of the row identified by `keys`."""
+    table = model.__table__
+    stmt = dialect_insert(dialect_name, table).values(**keys, **deltas)
+    return stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={name: table.c[name] + stmt.excluded[name] for name in deltas},
+    )
 
-except OperationalError:
-    print("No valid credentials, please ensure the presence of .env file")
 
 # Create a session
 def get_db():
     with Session(engine) as session:
         yield session
+
+
+@asynccontextmanager
+async def _async_session(bind=None):
+    """An AsyncSession in async mode, a ThreadedSession otherwise; on the primary unless `bind` is given."""
+    init_engines()
+    if AsyncSessionLocal is not None:
+        session = AsyncSessionLocal() if bind is None else AsyncSession(bind, expire_on_commit=False)
+        async with session:
+            yield session
+    else:
+        # A replica connection is already checked out, with one of its slots
+        slots = connection_slots(engine) if bind is None else None
+        session = ThreadedSession(Session(engine if bind is None else bind, expire_on_commit=False), slots)
+        try:
+            yield session
+        finally:
+            await session.close()
+
+
+async def get_async_db():
+    """Session for async handlers: an AsyncSession in async mode, a ThreadedSession otherwise."""
+    async with _async_session() as session:
+        yield session
+
+
+def _caller_id(request: Request) -> Optional[int]:
+    """
+    User id claimed by the request's bearer token. The signature is not
+    checked: this only picks where reads go, and auth verifies the token.
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return jwt.decode(token, options={"verify_signature": False}).get("user_id")
+    except jwt.PyJWTError:
+        return None
+
+
+async def get_read_db(request: Request):
+    """
+    Session for read-only handlers: on a healthy replica, or on the primary
+    when there are none or the caller wrote within db_read_your_writes_seconds.
+    """
+    init_engines()
+    connection = slots = None
+    if replica_set.replicas:
+        user_id = _caller_id(request)
+        if user_id is None or recent_writers.get(user_id) is None:
+            if AsyncSessionLocal is not None:
+                connection = await replica_set.connect_async()
+            else:
+                connection, slots = await replica_set.connect_threaded()
+    if connection is None:
+        async with _async_session() as session:
+            yield session
+        return
+
+    try:
+        async with _async_session(connection) as session:
+            yield session
+    finally:
+        if AsyncSessionLocal is not None:
+            await connection.close()
+        else:
+            try:
+                await run_in_threadpool(connection.close)
+            finally:
+                slots.release()
+
+
+def _iter_row_batches(statement, batch_size, bind):
+    with Session(bind) as session:
+        result = session.execute(statement.execution_options(yield_per=batch_size))
+        yield from result.partitions()
+
+
+async def stream_row_batches(statement, batch_size: int, read_only: bool = False):
+    """
+    Yield lists of rows for `statement` from a server-side cursor. Uses its
+    own session, so it can outlive the request scope (e.g. in a streamed body).
+    With `read_only`, reads from the first replica in rotation if there is one.
+    """
+    init_engines()
+    replicas = replica_set.candidates() if read_only else []
+    if AsyncSessionLocal is not None:
+        bind = replicas[0].async_engine if replicas else async_engine
+        async with AsyncSession(bind, expire_on_commit=False) as session:
+            result = await session.stream(statement.execution_options(yield_per=batch_size))
+            async for rows in result.partitions():
+                yield rows
+    else:
+        bind = replicas[0].engine if replicas else engine
+        async with connection_slots(bind):
+            async for rows in iterate_in_threadpool(_iter_row_batches(statement, batch_size, bind)):
+                yield rows
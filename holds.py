@@ -0,0 +1,226 @@
+"""
+Holds: a FIFO queue of members waiting for a title.
+
+Holds can only be placed on titles with no copy on the shelf. When a copy
+comes back, return_book hands it to the oldest waiting hold in the same
+transaction: the hold becomes "ready" and the copy is reserved for that
+member until they borrow it or the pickup window passes. Members learn
+about ready holds from a long-poll endpoint woken by a notifier after
+commit, instead of polling GET /books/{isbn}.
+"""
+import asyncio
+import datetime
+import threading
+from typing import Iterable, Optional
+from decouple import config
+from sqlalchemy import case, event, func, select, update
+from sqlalchemy.orm import Session, aliased
+from models import Book, Copy, Hold
+from inventory import shelve_copy
+from response_cache import BOOKS, version_bump_statement
+
+HOLD_PICKUP_DAYS = config("hold_pickup_days", default=3, cast=int)
+HOLD_WAIT_MAX_SECONDS = config("hold_wait_max_seconds", default=30, cast=float)
+HOLD_RECHECK_SECONDS = config("hold_recheck_seconds", default=5, cast=float)
+
+OPEN_STATUSES = ("waiting", "ready")
+
+
+class HoldNotifier:
+    """Wakes members waiting for their holds; implement it to notify across workers."""
+
+    async def wait(self, user_id: int, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for a notification; return whether one arrived."""
+        raise NotImplementedError
+
+    def notify(self, user_ids: Iterable[int]):
+        raise NotImplementedError
+
+
+class InProcessHoldNotifier(HoldNotifier):
+    """
+    Notifies waiters in this worker only. Waiters also re-check the database
+    periodically, which covers holds made ready by other workers.
+    """
+
+    def __init__(self):
+        self._waiters: dict[int, set[asyncio.Future]] = {}
+        self._lock = threading.Lock()
+
+    async def wait(self, user_id, timeout):
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            self._waiters.setdefault(user_id, set()).add(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(user_id)
+                if waiters is not None:
+                    waiters.discard(future)
+                    if not waiters:
+                        del self._waiters[user_id]
+
+    def notify(self, user_ids):
+        # Called from whichever thread committed, so resolve futures on their own loop
+        with self._lock:
+            futures = [future for user_id in user_ids for future in self._waiters.get(user_id, ())]
+        for future in futures:
+            future.get_loop().call_soon_threadsafe(_resolve, future)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+hold_notifier: HoldNotifier = InProcessHoldNotifier()
+
+
+def set_hold_notifier(notifier: HoldNotifier):
+    """Replace the notifier, e.g. with one backed by Postgres LISTEN/NOTIFY."""
+    global hold_notifier
+    hold_notifier = notifier
+
+
+def _queue_notification(session: Session, user_id: int):
+    session.info.setdefault("ready_hold_users", set()).add(user_id)
+
+
+def allocate_copy_sync(session: Session, book_id: str, copy_id: int) -> Optional[int]:
+    """
+    Give a copy of `book_id` that just became free to the oldest waiting
+    hold, or put it back on the shelf if nobody is waiting. Returns the id
+    of the member it was reserved for. Must run in the transaction that
+    freed the copy.
+    """
+    # Share-lock the title; place_hold locks it exclusively, so a hold placed
+    # while a copy is being returned is either seen here or sees the copy
+    # available. Concurrent returns of the same title do not block each other.
+    session.execute(select(Book.isbn_number).where(Book.isbn_number == book_id).with_for_update(read=True))
+    next_hold = session.scalar(
+        select(Hold.id)
+        .where(Hold.book_id == book_id, Hold.status == "waiting")
+        .order_by(Hold.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    if next_hold is None:
+        shelve_copy(session, book_id, copy_id)
+        return None
+
+    now = datetime.datetime.utcnow()
+    session.execute(update(Copy).where(Copy.id == copy_id).values(status="reserved"))
+    user_id = session.scalar(
+        update(Hold)
+        .where(Hold.id == next_hold)
+        .values(status="ready", copy_id=copy_id, ready_at=now, expires_at=now + datetime.timedelta(days=HOLD_PICKUP_DAYS))
+        .returning(Hold.user_id)
+    )
+    _queue_notification(session, user_id)
+    return user_id
+
+
+async def allocate_copy(db, book_id: str, copy_id: int) -> Optional[int]:
+    """allocate_copy_sync for handlers, in one trip to the session."""
+    return await db.run_sync(allocate_copy_sync, book_id, copy_id)
+
+
+async def claim_ready_hold(db, user_id: int, book_id: str) -> Optional[int]:
+    """
+    Mark the member's ready hold on `book_id` fulfilled and return the id of
+    the copy it reserved, or None if they have no ready hold.
+    """
+    return await db.scalar(
+        update(Hold)
+        .where(
+            Hold.user_id == user_id,
+            Hold.book_id == book_id,
+            Hold.status == "ready",
+            Hold.expires_at > datetime.datetime.utcnow(),
+        )
+        .values(status="fulfilled")
+        .returning(Hold.copy_id)
+    )
+
+
+async def claim_ready_holds(db, user_id: int, book_ids: list[str]) -> dict[str, int]:
+    """claim_ready_hold for several titles in one statement; returns ISBN to reserved copy id."""
+    rows = (await db.execute(
+        update(Hold)
+        .where(
+            Hold.user_id == user_id,
+            Hold.book_id.in_(book_ids),
+            Hold.status == "ready",
+            Hold.expires_at > datetime.datetime.utcnow(),
+        )
+        .values(status="fulfilled")
+        .returning(Hold.book_id, Hold.copy_id)
+    )).all()
+    return {book_id: copy_id for book_id, copy_id in rows if copy_id is not None}
+
+
+def queue_position():
+    """
+    Column with a hold's 1-based place in its title's queue, null unless
+    waiting. Counts along ix_holds_waiting_book_id, so deep queues stay cheap.
+    """
+    ahead = aliased(Hold)
+    count_ahead = (
+        select(func.count()).select_from(ahead)
+        .where(ahead.book_id == Hold.book_id, ahead.status == "waiting", ahead.id < Hold.id)
+        .scalar_subquery()
+    )
+    return case((Hold.status == "waiting", count_ahead + 1), else_=None).label("position")
+
+
+def release_expired_holds(session: Session, limit: int = 500) -> int:
+    """
+    Expire ready holds past their pickup window and pass each copy on, in
+    one transaction; returns how many expired.
+    """
+    expired = session.execute(
+        update(Hold)
+        .where(Hold.id.in_(
+            select(Hold.id)
+            .where(Hold.status == "ready", Hold.expires_at <= datetime.datetime.utcnow())
+            .limit(limit)
+            .scalar_subquery()
+        ))
+        .values(status="expired")
+        .returning(Hold.book_id, Hold.copy_id)
+    ).all()
+    for book_id, copy_id in expired:
+        allocate_copy_sync(session, book_id, copy_id)
+    if expired:
+        # Copies that went back on the shelf change availability
+        session.execute(version_bump_statement(session.get_bind().dialect.name, BOOKS))
+    session.commit()
+    return len(expired)
+
+
+def release_all_expired_holds(session: Session, batch_size: int = 500) -> int:
+    """release_expired_holds in batches until none are left, as the overdue sweep does."""
+    released = 0
+    while True:
+        batch = release_expired_holds(session, batch_size)
+        released += batch
+        if batch < batch_size:
+            return released
+
+
+# Wake waiting members once the transaction that readied their hold commits.
+
+@event.listens_for(Session, "after_commit")
+def _notify_ready_holds(session):
+    user_ids = session.info.pop("ready_hold_users", None)
+    if user_ids:
+        hold_notifier.notify(user_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_ready_holds(session):
+    session.info.pop("ready_hold_users", None)
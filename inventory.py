@@ -0,0 +1,152 @@
+"""
+Physical copies of each title and the availability counters kept from them.
+
+Borrowing claims one copy row with UPDATE ... FOR UPDATE SKIP LOCKED, so
+concurrent borrowers of a popular title each lock a different copy instead
+of queueing on the title's row. The title's total and available copy counts
+live in book_availability, sharded by copy id and summed on read (see the
+Book.total_copies and Book.available_copies column properties), and are
+updated in the same transaction as the copy.
+"""
+from typing import Iterable, Optional
+from decouple import config
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+from database import dialect_insert, increment_statement
+from models import BookAvailability, Copy
+from stats import adjust_category
+
+AVAILABILITY_SHARDS = config("availability_shards", default=8, cast=int)
+
+
+def availability_shard(copy_id: int) -> int:
+    return copy_id % AVAILABILITY_SHARDS
+
+
+def default_barcode(isbn_number: str, number: int) -> str:
+    """Barcode for the `number`th copy of a title added without one; legacy copies are "<isbn>-1"."""
+    return f"{isbn_number}-{number}"
+
+
+async def adjust_availability(db, book_id: str, copy_id: int, total: int = 0, available: int = 0):
+    await db.execute(increment_statement(
+        db.get_bind().dialect.name, BookAvailability,
+        {"book_id": book_id, "shard": availability_shard(copy_id)},
+        total_copies=total, available_copies=available,
+    ))
+
+
+class AvailabilityDeltas:
+    """Accumulates copy count changes so a batch write applies them in one statement."""
+
+    def __init__(self):
+        self.deltas: dict[tuple[str, int], list[int]] = {}
+
+    def add(self, book_id: str, copy_id: int, total: int = 0, available: int = 0):
+        delta = self.deltas.setdefault((book_id, availability_shard(copy_id)), [0, 0])
+        delta[0] += total
+        delta[1] += available
+
+    def statement(self, dialect_name: str):
+        """Upsert adding every accumulated delta, or None if there is nothing to apply."""
+        rows = [
+            {"book_id": book_id, "shard": shard, "total_copies": total, "available_copies": available}
+            for (book_id, shard), (total, available) in sorted(self.deltas.items())
+            if total or available
+        ]
+        self.deltas.clear()
+        if not rows:
+            return None
+        table = BookAvailability.__table__
+        stmt = dialect_insert(dialect_name, table).values(rows)
+        return stmt.on_conflict_do_update(
+            index_elements=["book_id", "shard"],
+            set_={name: table.c[name] + stmt.excluded[name] for name in ("total_copies", "available_copies")},
+        )
+
+
+def _claim_statement(book_id: str, branch: Optional[str] = None, barcode: Optional[str] = None):
+    candidate = select(Copy.id).where(Copy.book_id == book_id, Copy.status == "available")
+    if branch is not None:
+        candidate = candidate.where(Copy.branch == branch)
+    if barcode is not None:
+        candidate = candidate.where(Copy.barcode == barcode)
+    candidate = candidate.limit(1).with_for_update(skip_locked=True).scalar_subquery()
+    return (
+        update(Copy)
+        .where(Copy.id == candidate, Copy.status == "available")
+        .values(status="borrowed")
+        .returning(Copy.id)
+    )
+
+
+async def claim_copy(db, book_id: str, branch: Optional[str] = None, barcode: Optional[str] = None) -> Optional[int]:
+    """
+    Mark one available copy of `book_id` borrowed and return its id, or None
+    if none is on the shelf. Copies locked by concurrent borrowers are
+    skipped rather than waited for.
+    """
+    copy_id = await db.scalar(_claim_statement(book_id, branch, barcode))
+    if copy_id is not None:
+        await adjust_availability(db, book_id, copy_id, available=-1)
+    return copy_id
+
+
+async def claim_copies(db, book_ids: list[str], branch: Optional[str] = None) -> dict[str, int]:
+    """claim_copy for several titles, updating their counters in one statement. Returns ISBN to copy id."""
+    claimed = {}
+    deltas = AvailabilityDeltas()
+    for book_id in book_ids:
+        copy_id = await db.scalar(_claim_statement(book_id, branch))
+        if copy_id is not None:
+            claimed[book_id] = copy_id
+            deltas.add(book_id, copy_id, available=-1)
+    stmt = deltas.statement(db.get_bind().dialect.name)
+    if stmt is not None:
+        await db.execute(stmt)
+    return claimed
+
+
+async def lend_reserved_copies(db, copy_ids: list[int]):
+    """Mark copies held for a member borrowed; reserved copies are not counted as available."""
+    await db.execute(update(Copy).where(Copy.id.in_(copy_ids)).values(status="borrowed"))
+
+
+def shelve_copy(session: Session, book_id: str, copy_id: int):
+    """Put a copy that was borrowed, reserved or being processed back on the shelf."""
+    session.execute(update(Copy).where(Copy.id == copy_id).values(status="available"))
+    session.execute(increment_statement(
+        session.get_bind().dialect.name, BookAvailability,
+        {"book_id": book_id, "shard": availability_shard(copy_id)}, available_copies=1,
+    ))
+
+
+async def add_copies(db, book_id: str, category_id, copies: Iterable[dict], available: bool) -> list[int]:
+    """
+    Insert copies (dicts with barcode and branch) of a title and count them.
+    With `available` false they are left "processing" for the caller to
+    shelve or reserve. Returns the new copy ids.
+    """
+    status = "available" if available else "processing"
+    rows = [dict(copy, book_id=book_id, status=status) for copy in copies]
+    if not rows:
+        return []
+    dialect_name = db.get_bind().dialect.name
+    copy_ids = list((await db.scalars(
+        dialect_insert(dialect_name, Copy.__table__).values(rows).returning(Copy.id)
+    )).all())
+    deltas = AvailabilityDeltas()
+    for copy_id in copy_ids:
+        deltas.add(book_id, copy_id, total=1, available=1 if available else 0)
+    await db.execute(deltas.statement(dialect_name))
+    await adjust_category(db, category_id, book_id, total=len(copy_ids))
+    return copy_ids
+
+
+def copy_counts(isbn_numbers: list[str]):
+    """Statement giving (book_id, copies, borrowed copies) for each listed title that has copies."""
+    return (
+        select(Copy.book_id, func.count(), func.count().filter(Copy.status == "borrowed"))
+        .where(Copy.book_id.in_(isbn_numbers))
+        .group_by(Copy.book_id)
+    )
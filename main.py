@@ -1,13 +1,45 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from routes import book, user, borrowing
-import logging
+from fastapi.responses import ORJSONResponse
+from routes import book, copy, recommendation, user, borrowing, hold, overdue, stats, metrics, health
+from middleware.logging import AccessLogMiddleware, start_access_log, stop_access_log
+from middleware.metrics import MetricsMiddleware
+from middleware.rate_limit import RateLimitMiddleware, check_rate_limit_settings
+from overdues import start_overdue_sweeper, stop_overdue_sweeper
+from suggest import start_suggest_index, stop_suggest_index
+from database import start_database, stop_database
+from auth import check_auth_settings, password_pool
 
 
-app = FastAPI(title="Library Management System")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    check_auth_settings()
+    check_rate_limit_settings()
+    start_access_log()
+    await start_database()
+    start_overdue_sweeper()
+    start_suggest_index()
+    yield
+    await stop_suggest_index()
+    await stop_overdue_sweeper()
+    await stop_database()
+    password_pool.shutdown()
+    stop_access_log()
+
+
+# Responses are rendered with orjson rather than the standard json module
+app = FastAPI(title="Library Management System", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.include_router(book.router)
+app.include_router(copy.router)
+app.include_router(recommendation.router)
 app.include_router(user.router)
 app.include_router(borrowing.router)
+app.include_router(hold.router)
+app.include_router(overdue.router)
+app.include_router(stats.router)
+app.include_router(metrics.router)
+app.include_router(health.router)
 
 
 @app.get("/home/")
@@ -15,9 +47,8 @@ def root():
     return {"message": "Welcome to the Library Management System API"}
 
 
-# Logging API requests
-@app.middleware("http")
-async def log_requests(request, call_next):
-    response = await call_next(request)
-    logging.info(f"Request: {request.method} {request.url}")
-    return response
+# Rate limiting, request metrics, then logging API requests (the last middleware
+# added runs first, so refused requests are still counted and logged)
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(AccessLogMiddleware)
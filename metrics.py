@@ -0,0 +1,152 @@
+"""
+In-process metrics rendered in the Prometheus text format at /metrics.
+
+Updating a metric costs one lock and a dict lookup, so instrumentation can
+stay on in production. Each worker process keeps its own values; scrape the
+workers individually (or run one worker per container) to aggregate them.
+"""
+import bisect
+import threading
+from typing import Callable, Iterable
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict = {}
+        self._lock = threading.Lock()
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            samples = list(self._values.items())
+        for labels, value in sorted(samples):
+            lines.extend(self._render_sample(labels, value))
+        return lines
+
+    def _render_sample(self, labels, value) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Histogram(Metric):
+    """Cumulative histogram over fixed bucket upper bounds."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, labels: tuple, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # one count per bucket plus +Inf, then sum
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def _render_sample(self, labels, state) -> list[str]:
+        names = self.labelnames + ("le",)
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_format_labels(names, labels + (_format_value(bound),))} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(state[-1])}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge(Metric):
+    """Gauge whose samples are read at scrape time from a callable."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...],
+                 collect: Callable[[], Iterable[tuple[tuple, float]]]):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def render(self) -> list[str]:
+        with self._lock:
+            self._values = dict(self.collect())
+        return super().render()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route template and status code.",
+    ("method", "route", "status"),
+))
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to handle an HTTP request, by route template.",
+    ("method", "route"),
+))
+http_request_db_time = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent in database statements per HTTP request, by route template.",
+    ("method", "route"),
+))
+db_statements = registry.register(Counter(
+    "db_statements_total", "Database statements executed while handling HTTP requests, by route template.",
+    ("method", "route"),
+))
+pool_checkout_wait = registry.register(Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a connection from the pool.",
+    ("pool",), buckets=POOL_WAIT_BUCKETS,
+))
+pool_checkout_timeouts = registry.register(Counter(
+    "db_pool_checkout_timeouts_total", "Checkouts that gave up after db_pool_timeout.", ("pool",),
+))
+requests_rejected = registry.register(Counter(
+    "http_requests_rejected_total", "Requests refused by rate limiting or load shedding, by reason.", ("reason",),
+))
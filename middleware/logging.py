@@ -1,9 +1,222 @@
+"""
+Structured access logging that stays off the request path.
+
+Handlers only build a small dict and put it on a bounded in-memory queue.
+A background listener thread drains the queue in batches, serializes each
+record to one JSON line and writes the batch to a size-rotated file with a
+single flush. When the writer falls behind, records are dropped and counted
+rather than blocking requests.
+
+High-volume routes can be sampled with access_log_sample_rates, a comma
+separated list of "METHOD /route/template=rate" entries. Server errors and
+requests slower than access_log_slow_ms are always logged.
+"""
+import datetime
+import json
 import logging
+import os
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+from decouple import config
+from middleware.request_context import RequestStats, begin_request, end_request
+
+
+def _parse_sample_rates(value: str) -> dict[str, float]:
+    rates = {}
+    for entry in value.split(","):
+        if entry.strip():
+            route, _, rate = entry.rpartition("=")
+            rates[route.strip()] = float(rate)
+    return rates
+
+
+ACCESS_LOG_PATH = config("access_log_path", default="logs/access.log")
+ACCESS_LOG_MAX_BYTES = config("access_log_max_bytes", default=10 * 1024 * 1024, cast=int)
+ACCESS_LOG_BACKUP_COUNT = config("access_log_backup_count", default=5, cast=int)
+ACCESS_LOG_QUEUE_SIZE = config("access_log_queue_size", default=10000, cast=int)
+ACCESS_LOG_BATCH_SIZE = config("access_log_batch_size", default=256, cast=int)
+ACCESS_LOG_SLOW_MS = config("access_log_slow_ms", default=500, cast=float)
+ACCESS_LOG_SAMPLE_RATES = config("access_log_sample_rates", default="", cast=_parse_sample_rates)
+
+logger = logging.getLogger("api")
 
-logging.basicConfig(filename="logs/api.log", level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 def log_request(endpoint: str, method: str, user: str):
-    logging.info(f"Endpoint: {endpoint} | Method: {method} | User: {user}")
+    logger.info(f"Endpoint: {endpoint} | Method: {method} | User: {user}")
 
 def log_error(error_message: str):
-    logging.error(f"Error: {error_message}")
+    logger.error(f"Error: {error_message}")
+
+
+class JSONLinesFormatter(logging.Formatter):
+    """Formats access records, whose fields are in record.access, as one JSON object."""
+
+    def format(self, record):
+        timestamp = datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+        return json.dumps({"ts": timestamp.isoformat(timespec="milliseconds"), **record.access},
+                          separators=(",", ":"))
+
+
+class BatchRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler that writes a batch of records with one flush."""
+
+    def emit_batch(self, records):
+        self.acquire()
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            for record in records:
+                try:
+                    if self.shouldRollover(record):
+                        self.stream.flush()
+                        self.doRollover()
+                    self.stream.write(self.format(record) + self.terminator)
+                except Exception:
+                    self.handleError(record)
+            self.stream.flush()
+        finally:
+            self.release()
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Enqueues records without blocking, counting the ones a full queue rejects."""
+
+    def __init__(self, queue_):
+        super().__init__(queue_)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread.
+        return record
+
+
+class BatchingQueueListener(QueueListener):
+    """QueueListener that hands its handlers everything queued, up to batch_size records at a time."""
+
+    def __init__(self, queue_, handler: BatchRotatingFileHandler, batch_size: int):
+        super().__init__(queue_, handler)
+        self.batch_size = batch_size
+
+    def enqueue_sentinel(self):
+        # Wait for room rather than fail when stopping with the queue full;
+        # the listener thread is still draining it.
+        self.queue.put(self._sentinel)
+
+    def _monitor(self):
+        stopping = False
+        while not stopping:
+            record = self.dequeue(True)
+            if record is self._sentinel:
+                break
+            batch = [record]
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.dequeue(False)
+                except queue.Empty:
+                    break
+                if record is self._sentinel:
+                    stopping = True
+                    break
+                batch.append(record)
+            for handler in self.handlers:
+                handler.emit_batch(batch)
+
+
+access_logger = logging.getLogger("api.access")
+access_logger.setLevel(logging.INFO)
+access_logger.propagate = False
+access_queue_handler = DroppingQueueHandler(queue.Queue(ACCESS_LOG_QUEUE_SIZE))
+access_logger.addHandler(access_queue_handler)
+_listener: Optional[BatchingQueueListener] = None
+
+
+def start_access_log():
+    """Open the access log file and start the background writer."""
+    global _listener
+    if _listener is not None:
+        return
+    directory = os.path.dirname(ACCESS_LOG_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    handler = BatchRotatingFileHandler(
+        ACCESS_LOG_PATH, maxBytes=ACCESS_LOG_MAX_BYTES, backupCount=ACCESS_LOG_BACKUP_COUNT,
+        encoding="utf-8", delay=True,
+    )
+    handler.setFormatter(JSONLinesFormatter())
+    _listener = BatchingQueueListener(access_queue_handler.queue, handler, ACCESS_LOG_BATCH_SIZE)
+    _listener.start()
+
+
+def stop_access_log():
+    """Write out queued records and stop the background writer."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+
+def _sample_rate(method: str, route: Optional[str]) -> float:
+    if not ACCESS_LOG_SAMPLE_RATES:
+        return 1.0
+    return ACCESS_LOG_SAMPLE_RATES.get(f"{method} {route}", 1.0)
+
+
+def log_access(scope, status: int, wall_time: float, stats: RequestStats):
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    wall_ms = wall_time * 1000
+    rate = 1.0
+    if status < 500 and wall_ms < ACCESS_LOG_SLOW_MS:
+        rate = _sample_rate(scope["method"], template)
+        if rate < 1.0 and random.random() >= rate:
+            return
+    access_logger.info("access", extra={"access": {
+        "method": scope["method"],
+        "route": template,
+        "status": status,
+        "user_id": stats.user_id,
+        "wall_ms": round(wall_ms, 3),
+        "db_ms": round(stats.db_time * 1000, 3),
+        "db_statements": stats.db_statements,
+        "sample_rate": rate,
+    }})
+
+
+class AccessLogMiddleware:
+    """ASGI middleware recording one access log entry per HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats, token = begin_request()
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            end_request(token)
+            log_access(scope, status, time.perf_counter() - started, stats)
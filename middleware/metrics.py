@@ -0,0 +1,56 @@
+"""
+Per-request instrumentation: route latency and DB time histograms, and a
+Server-Timing header so browsers and clients can see where time went.
+"""
+import time
+from decouple import config
+from starlette.datastructures import MutableHeaders
+from metrics import db_statements, http_request_db_time, http_request_duration, http_requests
+from middleware.request_context import begin_request, end_request
+
+SERVER_TIMING = config("server_timing", default=True, cast=bool)
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def server_timing(stats, elapsed: float) -> str:
+    return (f'db;dur={stats.db_time * 1000:.1f};desc="{stats.db_statements} statements", '
+            f'app;dur={elapsed * 1000:.1f}')
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request metrics by route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats, token = begin_request()
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING:
+                    MutableHeaders(scope=message).append(
+                        "Server-Timing", server_timing(stats, time.perf_counter() - started)
+                    )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            end_request(token)
+            elapsed = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", UNMATCHED_ROUTE)
+            labels = (scope["method"], route)
+            http_requests.inc(labels + (str(status),))
+            http_request_duration.observe(labels, elapsed)
+            http_request_db_time.observe(labels, stats.db_time)
+            db_statements.inc(labels, stats.db_statements)
@@ -0,0 +1,242 @@
+"""
+Token-bucket rate limiting and adaptive load shedding, ahead of routing.
+
+Every request takes tokens from a bucket for its client IP and, when it
+carries a valid token, one for its user. Routes cost different amounts
+(rate_limit_costs, "METHOD /route/template=cost" entries; other routes cost
+1), so a flood of searches or logins runs dry long before cheap lookups do.
+Refused requests get 429 with Retry-After.
+
+When the worker is overloaded, judged by requests in flight and by how long
+recent requests waited for a database connection, requests costing more
+than 1 are refused with 503 first; past twice the in-flight limit, all but
+health and metrics requests are.
+"""
+import json
+import time
+from collections import OrderedDict
+from typing import Hashable, NamedTuple, Optional, Sequence
+import jwt
+from decouple import config
+from starlette.routing import compile_path
+from auth import ALGORITHM, SECRET_KEY
+from database import recent_pool_wait
+from metrics import requests_rejected
+
+
+def _parse_costs(value: str) -> dict[str, float]:
+    costs = {}
+    for entry in value.split(","):
+        if entry.strip():
+            route, _, cost = entry.rpartition("=")
+            costs[route.strip()] = float(cost)
+    return costs
+
+
+RATE_LIMIT_ENABLED = config("rate_limit_enabled", default=True, cast=bool)
+RATE_LIMIT_USER_RATE = config("rate_limit_user_rate", default=10, cast=float)
+RATE_LIMIT_USER_BURST = config("rate_limit_user_burst", default=40, cast=float)
+RATE_LIMIT_IP_RATE = config("rate_limit_ip_rate", default=20, cast=float)
+RATE_LIMIT_IP_BURST = config("rate_limit_ip_burst", default=80, cast=float)
+RATE_LIMIT_COSTS = config(
+    "rate_limit_costs",
+    default="GET /books/search=5,POST /login=10,POST /register=10,POST /books/import=20,GET /books/{isbn}=0.2",
+    cast=_parse_costs,
+)
+# Use the first X-Forwarded-For address as the client IP, behind a trusted proxy
+RATE_LIMIT_TRUST_FORWARDED = config("rate_limit_trust_forwarded", default=False, cast=bool)
+RATE_LIMIT_MAX_BUCKETS = config("rate_limit_max_buckets", default=100000, cast=int)
+SHED_MAX_IN_FLIGHT = config("shed_max_in_flight", default=200, cast=int)
+SHED_POOL_WAIT_MS = config("shed_pool_wait_ms", default=250, cast=float)
+
+EXEMPT_PREFIXES = ("/health/", "/metrics")
+
+
+class Limit(NamedTuple):
+    """A token bucket: refilled at `rate` tokens a second, up to `burst`."""
+    key: Hashable
+    rate: float
+    burst: float
+
+
+class RateLimitBackend:
+    """Token bucket storage; implement it (e.g. on Redis) to share limits across workers."""
+
+    async def take(self, limits: Sequence[Limit], cost: float) -> float:
+        """
+        Take `cost` tokens from every bucket in `limits`, or from none of
+        them. Returns 0 if they were taken, otherwise the seconds until every
+        bucket will hold enough.
+        """
+        raise NotImplementedError
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """
+    Buckets for this worker only, bounded by count; the least recently used
+    are forgotten first (and so start over full). Only used from the event
+    loop, so it needs no lock.
+    """
+
+    def __init__(self, max_buckets: int):
+        self.max_buckets = max_buckets
+        self._buckets: OrderedDict = OrderedDict()
+
+    def _refill(self, limit: Limit, now: float) -> list:
+        bucket = self._buckets.get(limit.key)
+        if bucket is None:
+            bucket = self._buckets[limit.key] = [limit.burst, now]
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            bucket[0] = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+            self._buckets.move_to_end(limit.key)
+        bucket[1] = now
+        return bucket
+
+    async def take(self, limits, cost):
+        now = time.monotonic()
+        buckets = [self._refill(limit, now) for limit in limits]
+        wait = max(
+            ((cost - bucket[0]) / limit.rate for limit, bucket in zip(limits, buckets) if bucket[0] < cost),
+            default=0.0,
+        )
+        if not wait:
+            for bucket in buckets:
+                bucket[0] -= cost
+        return wait
+
+
+rate_limit_backend: RateLimitBackend = InMemoryRateLimitBackend(RATE_LIMIT_MAX_BUCKETS)
+
+
+def set_rate_limit_backend(backend: RateLimitBackend):
+    """Replace the bucket storage, e.g. with one shared between workers."""
+    global rate_limit_backend
+    rate_limit_backend = backend
+
+
+class RouteCosts:
+    """Looks up a request's cost from "METHOD /route/template" entries without running the router."""
+
+    def __init__(self, costs: dict[str, float], default: float = 1.0):
+        self.default = default
+        self.exact: dict[tuple[str, str], float] = {}
+        self.patterns = []
+        for route, cost in costs.items():
+            method, _, path = route.partition(" ")
+            if "{" in path:
+                self.patterns.append((method, compile_path(path)[0], cost))
+            else:
+                self.exact[(method, path)] = cost
+
+    def cost(self, method: str, path: str) -> float:
+        # Literal paths win over templates, so /books/search is not /books/{isbn}
+        cost = self.exact.get((method, path))
+        if cost is not None:
+            return cost
+        for route_method, regex, cost in self.patterns:
+            if route_method == method and regex.match(path):
+                return cost
+        return self.default
+
+
+route_costs = RouteCosts(RATE_LIMIT_COSTS)
+
+
+def check_rate_limit_settings():
+    """Fail startup when a route costs more than a bucket can ever hold, so it could never be served."""
+    largest = min(RATE_LIMIT_IP_BURST, RATE_LIMIT_USER_BURST)
+    too_costly = [f"{route}={cost:g}" for route, cost in RATE_LIMIT_COSTS.items() if cost > largest]
+    if RATE_LIMIT_ENABLED and too_costly:
+        raise RuntimeError(
+            f"rate_limit_costs entries exceed the smaller rate limit burst ({largest:g}): {', '.join(too_costly)}"
+        )
+
+
+def _client_ip(scope) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _user_id(scope) -> Optional[int]:
+    """User id of a valid bearer token; invalid tokens are left for auth to reject."""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return None
+            try:
+                return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("user_id")
+            except jwt.PyJWTError:
+                return None
+    return None
+
+
+async def _refuse(send, status: int, detail: str, retry_after: float):
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("ascii")),
+            (b"retry-after", str(max(1, int(retry_after + 0.999))).encode("ascii")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class RateLimitMiddleware:
+    """ASGI middleware applying per-IP and per-user token buckets and load shedding."""
+
+    def __init__(self, app):
+        self.app = app
+        self.in_flight = 0
+
+    def _overload(self) -> int:
+        """0 when healthy, 1 to shed expensive requests, 2 to shed everything."""
+        if self.in_flight > 2 * SHED_MAX_IN_FLIGHT:
+            return 2
+        if self.in_flight > SHED_MAX_IN_FLIGHT or recent_pool_wait() * 1000 > SHED_POOL_WAIT_MS:
+            return 1
+        return 0
+
+    async def _admit(self, scope, send) -> bool:
+        cost = route_costs.cost(scope["method"], scope["path"])
+
+        overload = self._overload()
+        if overload == 2 or (overload == 1 and cost > 1):
+            requests_rejected.inc(("overload",))
+            await _refuse(send, 503, "Server is overloaded, please retry", 1)
+            return False
+
+        # Both buckets are checked before either is debited, so a request
+        # refused by one does not still spend the other's tokens
+        limits = [Limit(("ip", _client_ip(scope)), RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST)]
+        user_id = _user_id(scope)
+        if user_id is not None:
+            limits.append(Limit(("user", user_id), RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST))
+        wait = await rate_limit_backend.take(limits, cost)
+        if wait:
+            requests_rejected.inc(("rate_limit",))
+            await _refuse(send, 429, "Too many requests", wait)
+            return False
+        return True
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not RATE_LIMIT_ENABLED or scope["path"].startswith(EXEMPT_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        if not await self._admit(scope, send):
+            return
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
@@ -0,0 +1,62 @@
+import contextvars
+import time
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class RequestStats:
+    """Per-request measurements filled in while the request is handled."""
+
+    __slots__ = ("user_id", "db_statements", "db_time")
+
+    def __init__(self):
+        self.user_id: Optional[int] = None
+        self.db_statements = 0
+        self.db_time = 0.0
+
+
+# Set by the outermost request middleware for the duration of each request. The
+# object is mutated in place so that threadpool and greenlet contexts, which
+# receive a copy of the context, still report into the same instance.
+current_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "current_request_stats", default=None
+)
+
+
+def begin_request():
+    """
+    Return the current request's stats, creating them if no outer middleware
+    has yet, plus a token for end_request.
+    """
+    stats = current_request_stats.get()
+    if stats is not None:
+        return stats, None
+    stats = RequestStats()
+    return stats, current_request_stats.set(stats)
+
+
+def end_request(token):
+    if token is not None:
+        current_request_stats.reset(token)
+
+
+def set_request_user(user_id: int):
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.user_id = user_id
+
+
+# Time every statement on every engine, sync or async.
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    context._request_stats_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _stop_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.db_statements += 1
+        stats.db_time += time.perf_counter() - context._request_stats_started
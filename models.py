@@ -1,5 +1,6 @@
-from sqlalchemy import Integer, String, ForeignKey, Boolean, DateTime, BigInteger
-from sqlalchemy.orm import relationship, DeclarativeBase, mapped_column
+from sqlalchemy import Integer, String, ForeignKey, Boolean, Date, DateTime, BigInteger, Float, Index, LargeBinary, PrimaryKeyConstraint, Sequence, func, select, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import relationship, DeclarativeBase, column_property, mapped_column
 import datetime
 
 
@@ -8,17 +9,92 @@ class Base(DeclarativeBase):
     pass
 
 
+# sqlite_columns on a primary key: the columns of the key on SQLite, for
+# tables whose key includes a partition key only Postgres needs
+PrimaryKeyConstraint.argument_for("sqlite", "columns", None)
+
+
+@compiles(PrimaryKeyConstraint, "sqlite")
+def _compile_sqlite_primary_key(constraint, compiler, **kw):
+    columns = constraint.dialect_options["sqlite"]["columns"]
+    if columns is None:
+        return compiler.visit_primary_key_constraint(constraint, **kw)
+    return f"PRIMARY KEY ({', '.join(compiler.preparer.quote(column) for column in columns)})"
+
+
 class MemberBook(Base):
+    """
+    Borrow records, range partitioned by borrow_date into monthly partitions
+    managed by archive.py, which also moves old returned borrows to
+    MemberBookArchive. The partition key must be part of the primary key, so
+    ids come from member_book_id_seq on Postgres rather than autoincrement.
+    SQLite tables are not partitioned: there the key is id alone, which
+    SQLite assigns as the rowid.
+    """
     __tablename__ = 'member_book'
-    id = mapped_column(Integer, primary_key=True, index=True)
+    id = mapped_column(Integer, Sequence("member_book_id_seq"), primary_key=True, index=True)
     user_id = mapped_column('user_id', Integer, ForeignKey('users.id'))
-    book_id = mapped_column('book_id', String, ForeignKey('books.isbn_number'))
-    borrow_date = mapped_column(DateTime, default=datetime.datetime.utcnow)
+    book_id = mapped_column('book_id', String, ForeignKey('books.isbn_number'), index=True)
+    copy_id = mapped_column(Integer, ForeignKey('copies.id', ondelete='SET NULL'), nullable=True, index=True)
+    borrow_date = mapped_column(DateTime, primary_key=True, default=datetime.datetime.utcnow)
+    due_date = mapped_column(DateTime, nullable=False)
     return_date = mapped_column(DateTime, nullable=True)
     status = mapped_column(String, default="borrowed")  # "borrowed" or "returned"
+    # Set by the overdue sweep in overdues.py
+    overdue = mapped_column(Boolean, nullable=False, default=False)
+    fine_cents = mapped_column(Integer, nullable=False, default=0)
     user = relationship("User", back_populates="borrowed_books")
     book = relationship("Book", back_populates="borrow_records")
 
+    # Unique indexes on a partitioned table must include borrow_date, so these
+    # two cannot enforce one active borrow per copy and per member and title.
+    # Copies are claimed through copies.status instead, and borrowing.py checks
+    # for a member's active borrow under a per-member lock; the
+    # concurrent_borrow and duplicate_borrow checks in bench/checks.py cover both.
+    __table_args__ = (
+        # The active borrow of a copy
+        Index(
+            "ix_member_book_active_copy_id", "copy_id",
+            postgresql_where=text("status = 'borrowed'"),
+            sqlite_where=text("status = 'borrowed'"),
+        ),
+        # Active borrows by due date, for the overdue sweep and listing
+        Index(
+            "ix_member_book_active_due_date", "due_date", "id",
+            postgresql_where=text("status = 'borrowed'"),
+            sqlite_where=text("status = 'borrowed'"),
+        ),
+        # A member's active borrow of a title, for borrow and return
+        Index(
+            "ix_member_book_active_user_book", "user_id", "book_id",
+            postgresql_where=text("status = 'borrowed'"),
+            sqlite_where=text("status = 'borrowed'"),
+        ),
+        # A member's history in date order
+        Index("ix_member_book_user_borrow_date", "user_id", "borrow_date"),
+        PrimaryKeyConstraint("id", "borrow_date", sqlite_columns=["id"]),
+        {"postgresql_partition_by": "RANGE (borrow_date)"},
+    )
+
+
+class MemberBookArchive(Base):
+    """
+    Returned borrows moved out of member_book by archive.py: one member's
+    borrows from one month, packed as zlib compressed JSON.
+    """
+    __tablename__ = "member_book_archive"
+
+    # BIGSERIAL on Postgres; on SQLite only an INTEGER key is assigned automatically
+    id = mapped_column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    user_id = mapped_column(Integer, nullable=False)
+    period = mapped_column(Date, nullable=False)  # first day of the month
+    borrows = mapped_column(Integer, nullable=False)
+    records = mapped_column(LargeBinary, nullable=False)
+
+    __table_args__ = (
+        Index("ix_member_book_archive_user_period", "user_id", "period"),
+    )
+
 
 class Book(Base):
     __tablename__ = "books"
@@ -26,8 +102,7 @@ class Book(Base):
     isbn_number = mapped_column(String, primary_key=True, index=True)  # ISBN as primary key
     title = mapped_column(String(255), nullable=False)
     author = mapped_column(String(255), nullable=False)
-    category_id = mapped_column(Integer, ForeignKey("categories.id"), nullable=False)
-    availability_status = mapped_column(Boolean, default=True)
+    category_id = mapped_column(Integer, ForeignKey("categories.id"), nullable=False, index=True)
     borrow_records = relationship("MemberBook", back_populates="book")
     category = relationship("Category", back_populates="books")
 
@@ -43,6 +118,62 @@ class User(Base):
     role = mapped_column(String, nullable=False)  # "user" or "librarian")
     borrowed_books = relationship("MemberBook", back_populates="user")
 
+
+class Copy(Base):
+    """One physical copy of a title, identified by the barcode on its label."""
+    __tablename__ = "copies"
+
+    id = mapped_column(Integer, primary_key=True)
+    book_id = mapped_column(String, ForeignKey("books.isbn_number", ondelete="CASCADE"), nullable=False, index=True)
+    barcode = mapped_column(String(64), nullable=False, unique=True)
+    branch = mapped_column(String(100), nullable=True)
+    status = mapped_column(String, nullable=False, default="available")  # "available", "borrowed", "reserved" or "processing"
+
+    __table_args__ = (
+        # Copies on the shelf, for borrow to pick one from
+        Index(
+            "ix_copies_available_book_branch", "book_id", "branch",
+            postgresql_where=text("status = 'available'"),
+            sqlite_where=text("status = 'available'"),
+        ),
+    )
+
+
+class Hold(Base):
+    """A member's place in the queue for a title; "ready" holds reserve a returned copy."""
+    __tablename__ = "holds"
+
+    id = mapped_column(Integer, primary_key=True)
+    user_id = mapped_column(Integer, ForeignKey("users.id"), nullable=False)
+    book_id = mapped_column(String, ForeignKey("books.isbn_number", ondelete="CASCADE"), nullable=False)
+    placed_at = mapped_column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    status = mapped_column(String, nullable=False, default="waiting")  # "waiting", "ready", "fulfilled", "cancelled" or "expired"
+    copy_id = mapped_column(Integer, ForeignKey("copies.id", ondelete="SET NULL"), nullable=True)  # the copy a ready hold reserves
+    ready_at = mapped_column(DateTime, nullable=True)
+    expires_at = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # At most one open hold per member and title
+        Index(
+            "ix_holds_open_user_book", "user_id", "book_id", unique=True,
+            postgresql_where=text("status IN ('waiting', 'ready')"),
+            sqlite_where=text("status IN ('waiting', 'ready')"),
+        ),
+        # The queue for a title, oldest first
+        Index(
+            "ix_holds_waiting_book_id", "book_id", "id",
+            postgresql_where=text("status = 'waiting'"),
+            sqlite_where=text("status = 'waiting'"),
+        ),
+        # Reserved copies by pickup deadline, for expiry
+        Index(
+            "ix_holds_ready_expires_at", "expires_at",
+            postgresql_where=text("status = 'ready'"),
+            sqlite_where=text("status = 'ready'"),
+        ),
+    )
+
+
 class Category(Base):
     __tablename__ = "categories"
 
@@ -50,3 +181,87 @@ class Category(Base):
     name = mapped_column(String, unique=True, nullable=False)
     books = relationship("Book", back_populates="category")
 
+
+# Circulation counters maintained by stats.py. Rows that every borrow would
+# touch are split into shards, which are summed when read.
+
+class CategoryStats(Base):
+    __tablename__ = "category_stats"
+
+    category_id = mapped_column(Integer, ForeignKey("categories.id"), primary_key=True)
+    shard = mapped_column(Integer, primary_key=True)
+    total_books = mapped_column(Integer, nullable=False, default=0)
+    borrowed_books = mapped_column(Integer, nullable=False, default=0)
+
+
+class BookCirculation(Base):
+    __tablename__ = "book_circulation"
+
+    book_id = mapped_column(String, ForeignKey("books.isbn_number", ondelete="CASCADE"), primary_key=True)
+    borrow_count = mapped_column(Integer, nullable=False, default=0, index=True)
+
+
+class BookAvailability(Base):
+    """Copy counts per title. Shards are chosen by copy, so borrows of different copies update different rows."""
+    __tablename__ = "book_availability"
+
+    book_id = mapped_column(String, ForeignKey("books.isbn_number", ondelete="CASCADE"), primary_key=True)
+    shard = mapped_column(Integer, primary_key=True)
+    total_copies = mapped_column(Integer, nullable=False, default=0)
+    available_copies = mapped_column(Integer, nullable=False, default=0)
+
+
+def _availability_sum(column):
+    return column_property(
+        select(func.coalesce(func.sum(column), 0))
+        .where(BookAvailability.book_id == Book.isbn_number)
+        .correlate_except(BookAvailability)
+        .scalar_subquery()
+    )
+
+
+Book.total_copies = _availability_sum(BookAvailability.total_copies)
+Book.available_copies = _availability_sum(BookAvailability.available_copies)
+
+# What BookResponse shows, for read paths that select rows rather than entities
+BOOK_COLUMNS = (Book.isbn_number, Book.title, Book.author, Book.category_id, Book.total_copies, Book.available_copies)
+
+
+class DailyCirculation(Base):
+    __tablename__ = "daily_circulation"
+
+    day = mapped_column(Date, primary_key=True)
+    shard = mapped_column(Integer, primary_key=True)
+    borrows = mapped_column(Integer, nullable=False, default=0)
+    returns = mapped_column(Integer, nullable=False, default=0)
+
+
+class OverdueStats(Base):
+    """
+    The number of active borrows marked overdue: set by each overdue sweep,
+    and lowered as those borrows are returned. One row, id 1.
+    """
+    __tablename__ = "overdue_stats"
+
+    id = mapped_column(Integer, primary_key=True)
+    overdue_books = mapped_column(Integer, nullable=False, default=0)
+
+
+class ResourceVersion(Base):
+    """Change counters for cached API resources; a resource's version is the sum over its shards."""
+    __tablename__ = "resource_versions"
+
+    resource = mapped_column(String, primary_key=True)
+    shard = mapped_column(Integer, primary_key=True)
+    version = mapped_column(BigInteger, nullable=False, default=0)
+
+
+class BookSimilarity(Base):
+    """A title's nearest neighbours by co-borrowing, best first; rebuilt by recommendations.py."""
+    __tablename__ = "book_similarities"
+
+    book_id = mapped_column(String, ForeignKey("books.isbn_number", ondelete="CASCADE"), primary_key=True)
+    rank = mapped_column(Integer, primary_key=True)
+    # Not a foreign key: deleted neighbours are dropped when read, and on the next rebuild
+    similar_book_id = mapped_column(String, nullable=False)
+    score = mapped_column(Float, nullable=False)
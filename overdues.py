@@ -0,0 +1,186 @@
+"""
+Overdue detection and fines, computed by a background sweep.
+
+Every borrow gets a due date. The sweep walks active borrows past their due
+date along ix_member_book_active_due_date, a chunk at a time with a keyset
+cursor, and records on each one that it is overdue and the fine owed so
+far. Only rows whose fine changed are written, and each chunk is its own
+transaction, so memory stays bounded by the chunk size however many rows
+are swept. GET /overdues reads this precomputed state, and the dashboard
+the overdue count the sweep leaves in overdue_stats.
+Returns settle the final fine themselves, with final_fines.
+The same run expires ready holds whose pickup window has passed, passing
+their copies to the next member waiting or back to the shelf.
+
+The sweep runs as an asyncio task in each API worker (a Postgres advisory
+lock lets only one of them sweep at a time), or as a separate worker:
+    python -m overdues --loop
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import sys
+import time
+from typing import Optional
+from decouple import config
+from sqlalchemy import func, select, tuple_, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from database import get_engine
+from holds import release_all_expired_holds
+from models import MemberBook
+from stats import set_overdue_count
+
+LOAN_PERIOD_DAYS = config("loan_period_days", default=14, cast=int)
+FINE_PER_DAY_CENTS = config("fine_per_day_cents", default=25, cast=int)
+# 0 means fines are not capped
+MAX_FINE_CENTS = config("max_fine_cents", default=1000, cast=int)
+# Seconds between sweeps in each API worker; 0 leaves sweeping to `python -m overdues`
+OVERDUE_SWEEP_INTERVAL = config("overdue_sweep_interval", default=3600, cast=float)
+OVERDUE_SWEEP_CHUNK_SIZE = config("overdue_sweep_chunk_size", default=5000, cast=int)
+
+# Key of the advisory lock held by the worker currently sweeping
+SWEEP_LOCK_KEY = 0x6F766572
+
+logger = logging.getLogger("api.overdues")
+
+
+def due_date_for(borrow_date: datetime.datetime) -> datetime.datetime:
+    return borrow_date + datetime.timedelta(days=LOAN_PERIOD_DAYS)
+
+
+def fine_for(due_date: datetime.datetime, now: datetime.datetime) -> int:
+    """Fine in cents for each full day past `due_date`, up to MAX_FINE_CENTS."""
+    fine = max((now - due_date).days, 0) * FINE_PER_DAY_CENTS
+    return min(fine, MAX_FINE_CENTS) if MAX_FINE_CENTS else fine
+
+
+def final_fines(rows, return_date: datetime.datetime) -> list[dict]:
+    """
+    Settle the fines of borrows returned at `return_date`: the changes to
+    write, by primary key, for rows carrying id, borrow_date, due_date,
+    overdue and fine_cents.
+    """
+    changes = []
+    for row in rows:
+        overdue = row.due_date < return_date
+        fine = fine_for(row.due_date, return_date)
+        if row.overdue != overdue or row.fine_cents != fine:
+            changes.append({"id": row.id, "borrow_date": row.borrow_date, "overdue": overdue, "fine_cents": fine})
+    return changes
+
+
+def sweep_overdues(session: Session, now: Optional[datetime.datetime] = None,
+                   chunk_size: int = OVERDUE_SWEEP_CHUNK_SIZE) -> dict:
+    """Mark active borrows past due as overdue and bring their fines up to date."""
+    now = now or datetime.datetime.utcnow()
+    swept = updated = 0
+    last_key = None
+    while True:
+        query = select(
+            MemberBook.id, MemberBook.borrow_date, MemberBook.due_date, MemberBook.overdue, MemberBook.fine_cents
+        ).where(
+            MemberBook.status == "borrowed", MemberBook.due_date < now
+        )
+        if last_key is not None:
+            query = query.where(tuple_(MemberBook.due_date, MemberBook.id) > last_key)
+        rows = session.execute(query.order_by(MemberBook.due_date, MemberBook.id).limit(chunk_size)).all()
+        if not rows:
+            break
+
+        changes = []
+        for row in rows:
+            fine = fine_for(row.due_date, now)
+            if not row.overdue or row.fine_cents != fine:
+                changes.append({"id": row.id, "borrow_date": row.borrow_date, "overdue": True, "fine_cents": fine})
+        if changes:
+            # Bulk UPDATE by primary key (id, borrow_date), one executemany per chunk
+            session.execute(update(MemberBook), changes)
+        session.commit()
+
+        swept += len(rows)
+        updated += len(changes)
+        last_key = (rows[-1].due_date, rows[-1].id)
+    # Every active borrow past due is now marked, so that is the overdue count
+    set_overdue_count(session, swept)
+    session.commit()
+    return {"swept": swept, "updated": updated}
+
+
+def run_overdue_sweep() -> Optional[dict]:
+    """
+    Sweep once, and release expired holds, on a dedicated connection;
+    returns None if another worker is already sweeping.
+    """
+    with get_engine().connect() as connection:
+        postgres = connection.dialect.name == "postgresql"
+        if postgres:
+            if not connection.scalar(select(func.pg_try_advisory_lock(SWEEP_LOCK_KEY))):
+                return None
+            connection.commit()
+        try:
+            with Session(bind=connection) as session:
+                result = sweep_overdues(session)
+                result["holds_expired"] = release_all_expired_holds(session)
+                return result
+        finally:
+            if postgres:
+                connection.scalar(select(func.pg_advisory_unlock(SWEEP_LOCK_KEY)))
+                connection.commit()
+
+
+async def _sweep_periodically(interval: float):
+    while True:
+        try:
+            result = await run_in_threadpool(run_overdue_sweep)
+            if result is not None:
+                logger.info(
+                    "Overdue sweep: %(swept)d active borrows past due, %(updated)d updated, "
+                    "%(holds_expired)d holds expired", result,
+                )
+        except Exception:
+            logger.exception("Overdue sweep failed")
+        await asyncio.sleep(interval)
+
+
+_sweeper: Optional[asyncio.Task] = None
+
+
+def start_overdue_sweeper():
+    """Start sweeping every OVERDUE_SWEEP_INTERVAL seconds in this worker, unless disabled."""
+    global _sweeper
+    if _sweeper is None and OVERDUE_SWEEP_INTERVAL > 0:
+        _sweeper = asyncio.get_running_loop().create_task(_sweep_periodically(OVERDUE_SWEEP_INTERVAL))
+
+
+async def stop_overdue_sweeper():
+    global _sweeper
+    if _sweeper is None:
+        return
+    _sweeper.cancel()
+    try:
+        await _sweeper
+    except asyncio.CancelledError:
+        pass
+    _sweeper = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mark overdue borrows and compute their fines.")
+    parser.add_argument("--loop", action="store_true", help="keep sweeping every --interval seconds")
+    parser.add_argument("--interval", type=float, default=OVERDUE_SWEEP_INTERVAL or 3600)
+    args = parser.parse_args(argv)
+
+    while True:
+        result = run_overdue_sweep()
+        json.dump(result or {"skipped": "another worker is sweeping"}, sys.stdout)
+        print(flush=True)
+        if not args.loop:
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
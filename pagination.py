@@ -0,0 +1,37 @@
+import base64
+import datetime
+import json
+from fastapi import HTTPException
+
+
+def encode_cursor(*values) -> str:
+    """Encode the sort key of the last returned row into an opaque cursor."""
+    raw = json.dumps(list(values), separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _cursor_value(value, kind: type):
+    # Datetimes travel as naive UTC ISO strings; bool is not accepted where an int is expected
+    if kind is datetime.datetime and isinstance(value, str):
+        parsed = datetime.datetime.fromisoformat(value)
+        if parsed.tzinfo is not None:
+            raise ValueError("expected a naive datetime")
+        return parsed
+    if type(value) is not kind:
+        raise ValueError(f"expected {kind.__name__}")
+    return value
+
+
+def decode_cursor(cursor: str, *types: type) -> list:
+    """
+    Decode a cursor produced by encode_cursor into one value of each of
+    `types`, in order, rejecting anything malformed with a 400.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError("wrong number of values")
+        return [_cursor_value(value, kind) for value, kind in zip(values, types)]
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
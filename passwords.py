@@ -0,0 +1,77 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+
+# This module is imported by the pool's worker processes, so it only
+# depends on bcrypt and the standard library.
+
+
+class PasswordPoolSaturated(Exception):
+    """Raised when too many hashing jobs are already queued or running."""
+
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+def hash_cost(hashed_password: str) -> int:
+    """Cost factor (log2 rounds) of a bcrypt hash such as `$2b$12$...`."""
+    return int(hashed_password.split("$")[2])
+
+
+class PasswordHasherPool:
+    """Runs bcrypt in a size-limited process pool, outside the API process's GIL.
+
+    At most `max_pending` jobs may be queued or running at once; further
+    calls fail fast with PasswordPoolSaturated instead of waiting for the
+    pool to catch up. Callers await the result without occupying a thread.
+    """
+
+    def __init__(self, workers: int, max_pending: int, rounds: int):
+        self.workers = workers
+        self.rounds = rounds
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordPoolSaturated()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.wrap_future(self._submit(_hash, password, self.rounds))
+
+    async def verify_async(self, password: str, hashed_password: str) -> bool:
+        return await asyncio.wrap_future(self._submit(_verify, password, hashed_password))
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        return hash_cost(hashed_password) != self.rounds
+
+    def shutdown(self):
+        """Stop the worker processes; the next job starts new ones."""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -0,0 +1,240 @@
+"""
+"Patrons who borrowed this also borrowed" recommendations.
+
+Built offline from member_book: each member's distinct borrowed titles form
+a sparse member x title matrix X, and X^T X counts, for every pair of
+titles, the members who borrowed both. Titles are scored by cosine
+similarity, co-borrowers / sqrt(borrowers of one * borrowers of the other),
+and the best RECOMMENDATION_TOP_K neighbours of each title are written to
+book_similarities, so GET /books/{isbn}/similar is a primary key range read.
+
+X, X^T X and the last member_book id read are saved in
+recommendation_state_path. Later runs read only the borrows since then, add
+the co-occurrences they create, and rewrite the neighbours of just the
+titles whose scores changed. Run it from cron or a scheduler:
+    python -m recommendations            # incremental once a state file exists
+    python -m recommendations --full     # rebuild from all of member_book
+"""
+import argparse
+import datetime
+import json
+import os
+import resource
+import sys
+import time
+from typing import Iterator
+import numpy as np
+from decouple import config
+from scipy import sparse
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+from database import get_engine
+from models import Book, BookSimilarity, MemberBook
+
+RECOMMENDATION_TOP_K = config("recommendation_top_k", default=20, cast=int)
+# Pairs borrowed together by fewer members are too weak a signal to recommend
+RECOMMENDATION_MIN_COBORROWERS = config("recommendation_min_coborrowers", default=2, cast=int)
+RECOMMENDATION_STATE_PATH = config("recommendation_state_path", default="data/recommendations.npz")
+RECOMMENDATION_BATCH_SIZE = config("recommendation_batch_size", default=100000, cast=int)
+# Borrows newer than this many seconds are left for the next run, so rows
+# inserted by transactions still in flight are not skipped past
+RECOMMENDATION_SETTLE_SECONDS = config("recommendation_settle_seconds", default=60, cast=int)
+# Titles whose neighbours are replaced per transaction
+WRITE_CHUNK_SIZE = 1000
+
+
+class BorrowMatrix:
+    """Member x title borrow matrix and its title x title co-occurrence counts."""
+
+    def __init__(self, isbns: list[str], members: sparse.csr_matrix, cooccurrence: sparse.csr_matrix,
+                 last_borrow_id: int):
+        self.isbns = list(isbns)
+        self.columns = {isbn: column for column, isbn in enumerate(self.isbns)}
+        self.members = members
+        self.cooccurrence = cooccurrence
+        self.last_borrow_id = last_borrow_id
+
+    @classmethod
+    def empty(cls) -> "BorrowMatrix":
+        return cls([], sparse.csr_matrix((0, 0), dtype=np.int32), sparse.csr_matrix((0, 0), dtype=np.int32), 0)
+
+    @classmethod
+    def load(cls, path: str) -> "BorrowMatrix":
+        with np.load(path) as state:
+            def matrix(name):
+                return sparse.csr_matrix(
+                    (state[f"{name}_data"], state[f"{name}_indices"], state[f"{name}_indptr"]),
+                    shape=tuple(state[f"{name}_shape"]),
+                )
+            return cls(state["isbns"].tolist(), matrix("members"), matrix("cooccurrence"), int(state["last_borrow_id"]))
+
+    def save(self, path: str):
+        """Write the state atomically, so a crash leaves the previous state in place."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays = {"isbns": np.array(self.isbns, dtype=str), "last_borrow_id": np.array(self.last_borrow_id)}
+        for name, matrix in (("members", self.members), ("cooccurrence", self.cooccurrence)):
+            arrays.update({
+                f"{name}_data": matrix.data, f"{name}_indices": matrix.indices,
+                f"{name}_indptr": matrix.indptr, f"{name}_shape": np.array(matrix.shape),
+            })
+        partial = path + ".partial"
+        with open(partial, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(partial, path)
+
+    def column(self, isbn: str) -> int:
+        column = self.columns.get(isbn)
+        if column is None:
+            column = self.columns[isbn] = len(self.isbns)
+            self.isbns.append(isbn)
+        return column
+
+    def add_borrows(self, users: np.ndarray, columns: np.ndarray) -> np.ndarray:
+        """
+        Add (member, title) borrows and update the co-occurrence counts.
+        Returns the titles whose neighbour scores may have changed.
+        """
+        shape = (max(self.members.shape[0], int(users.max(initial=-1)) + 1), len(self.isbns))
+        self.members.resize(shape)
+        self.cooccurrence.resize((shape[1], shape[1]))
+
+        borrowed = sparse.csr_matrix((np.ones(len(users), dtype=np.int32), (users, columns)), shape=shape)
+        borrowed.data[:] = 1  # repeat borrows of a title count once
+        new = borrowed - borrowed.multiply(self.members)
+        new.eliminate_zeros()
+        if not new.nnz:
+            return np.empty(0, dtype=np.int64)
+
+        # (X + N)^T (X + N) - X^T X, where N holds the newly borrowed pairs
+        cross = (new.T @ self.members).tocsr()
+        delta = (cross + cross.T + new.T @ new).tocsr()
+        self.members = (self.members + new).tocsr()
+        self.cooccurrence = (self.cooccurrence + delta).tocsr()
+
+        # A title's score changes with any pair count it is in, and with the
+        # borrower count of any title it was borrowed with
+        changed = np.unique(delta.nonzero()[0])
+        new_borrowers = np.flatnonzero(delta.diagonal())
+        return np.union1d(changed, self.cooccurrence[new_borrowers].indices)
+
+    def neighbours(self, rows: np.ndarray, k: int, min_coborrowers: int) -> Iterator[tuple[int, np.ndarray, np.ndarray]]:
+        """Yield (title, neighbour titles, cosine scores) for `rows`, best first."""
+        norms = np.sqrt(self.cooccurrence.diagonal().astype(np.float64))
+        counts = self.cooccurrence[rows]
+        for i, row in enumerate(rows):
+            start, end = counts.indptr[i], counts.indptr[i + 1]
+            columns, pairs = counts.indices[start:end], counts.data[start:end]
+            keep = (columns != row) & (pairs >= min_coborrowers)
+            columns = columns[keep]
+            values = pairs[keep] / (norms[row] * norms[columns])
+            if len(values) > k:
+                top = np.argpartition(-values, k)[:k]
+                columns, values = columns[top], values[top]
+            order = np.lexsort((columns, -values))
+            yield int(row), columns[order], values[order]
+
+
+def read_borrows(session: Session, after_id: int, batch_size: int,
+                 until: datetime.datetime) -> Iterator[list]:
+    """Yield batches of (id, user_id, book_id) borrows after `after_id` in id order, up to one made at `until`."""
+    last_id = after_id
+    while True:
+        rows = session.execute(
+            select(MemberBook.id, MemberBook.user_id, MemberBook.book_id, MemberBook.borrow_date)
+            .where(MemberBook.id > last_id)
+            .order_by(MemberBook.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return
+        for i, row in enumerate(rows):
+            if row.borrow_date is not None and row.borrow_date >= until:
+                if i:
+                    yield rows[:i]
+                return
+        yield rows
+        last_id = rows[-1].id
+
+
+def write_neighbours(session: Session, matrix: BorrowMatrix, rows: np.ndarray, k: int, min_coborrowers: int) -> int:
+    """Replace the stored neighbours of titles `rows`, a chunk per transaction; returns rows written."""
+    written = 0
+    for start in range(0, len(rows), WRITE_CHUNK_SIZE):
+        chunk = rows[start:start + WRITE_CHUNK_SIZE]
+        isbns = [matrix.isbns[row] for row in chunk]
+        # Titles deleted since they were borrowed get no neighbours
+        existing = set(session.scalars(select(Book.isbn_number).where(Book.isbn_number.in_(isbns))))
+        values = [
+            {"book_id": matrix.isbns[row], "rank": rank, "similar_book_id": matrix.isbns[column], "score": float(score)}
+            for row, columns, scores in matrix.neighbours(chunk, k, min_coborrowers)
+            if matrix.isbns[row] in existing
+            for rank, (column, score) in enumerate(zip(columns, scores))
+        ]
+        session.execute(delete(BookSimilarity).where(BookSimilarity.book_id.in_(isbns)))
+        if values:
+            session.execute(insert(BookSimilarity), values)
+        session.commit()
+        written += len(values)
+    return written
+
+
+def build_recommendations(session: Session, state_path: str = RECOMMENDATION_STATE_PATH, full: bool = False,
+                          k: int = RECOMMENDATION_TOP_K, min_coborrowers: int = RECOMMENDATION_MIN_COBORROWERS,
+                          batch_size: int = RECOMMENDATION_BATCH_SIZE) -> dict:
+    """Read borrows since the saved state (or all of them) and rewrite the neighbours that changed."""
+    started = time.perf_counter()
+    full = full or not os.path.exists(state_path)
+    matrix = BorrowMatrix.empty() if full else BorrowMatrix.load(state_path)
+
+    until = datetime.datetime.utcnow() - datetime.timedelta(seconds=RECOMMENDATION_SETTLE_SECONDS)
+    users, columns = [], []
+    borrows = 0
+    for rows in read_borrows(session, matrix.last_borrow_id, batch_size, until):
+        rows_with_ids = [row for row in rows if row.user_id is not None and row.book_id is not None]
+        users.append(np.fromiter((row.user_id for row in rows_with_ids), dtype=np.int32, count=len(rows_with_ids)))
+        columns.append(np.fromiter((matrix.column(row.book_id) for row in rows_with_ids), dtype=np.int32,
+                                   count=len(rows_with_ids)))
+        borrows += len(rows)
+        matrix.last_borrow_id = rows[-1].id
+    session.rollback()
+
+    users = np.concatenate(users) if users else np.empty(0, dtype=np.int32)
+    columns = np.concatenate(columns) if columns else np.empty(0, dtype=np.int32)
+    changed = matrix.add_borrows(users, columns)
+    if full:
+        changed = np.arange(len(matrix.isbns))
+    written = write_neighbours(session, matrix, changed, k, min_coborrowers)
+    # Saved last: if writing fails the next run reads the same borrows again
+    matrix.save(state_path)
+
+    return {
+        "full": full,
+        "borrows_read": borrows,
+        "titles": len(matrix.isbns),
+        "members": matrix.members.shape[0],
+        "pairs": int(matrix.cooccurrence.nnz),
+        "titles_updated": len(changed),
+        "neighbours_written": written,
+        "seconds": round(time.perf_counter() - started, 3),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_memory_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build 'also borrowed' recommendations from borrow history.")
+    parser.add_argument("--full", action="store_true", help="rebuild from all borrows instead of the saved state")
+    parser.add_argument("--state", default=RECOMMENDATION_STATE_PATH, help="state file path")
+    parser.add_argument("--top-k", type=int, default=RECOMMENDATION_TOP_K)
+    parser.add_argument("--batch-size", type=int, default=RECOMMENDATION_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    with Session(get_engine()) as session:
+        report = build_recommendations(session, args.state, args.full, args.top_k, batch_size=args.batch_size)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
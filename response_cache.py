@@ -0,0 +1,78 @@
+"""
+Conditional GETs and serialized-body caching for catalog reads.
+
+Each cacheable resource ("books", "categories") has a version counter in
+resource_versions, bumped in the same transaction as any write that changes
+it. Versions live in the database rather than in process memory so every
+worker sees the same ETag after a write. A counter is split into shards,
+summed on read, so frequent writers such as borrow and return do not all
+queue on one row.
+"""
+import hashlib
+import random
+from decouple import config
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+from sqlalchemy import func, select
+from cache import BytesLRUCache
+from database import increment_statement
+from models import ResourceVersion
+
+RESPONSE_CACHE_MAX_BYTES = config("response_cache_max_bytes", default=32 * 1024 * 1024, cast=int)
+VERSION_SHARDS = 8
+
+BOOKS = "books"
+CATEGORIES = "categories"
+
+body_cache = BytesLRUCache(max_bytes=RESPONSE_CACHE_MAX_BYTES)
+
+
+def version_bump_statement(dialect_name: str, resource: str):
+    return increment_statement(
+        dialect_name, ResourceVersion,
+        {"resource": resource, "shard": random.randrange(VERSION_SHARDS)},
+        version=1,
+    )
+
+
+async def bump_version(db, resource: str):
+    """Invalidate cached representations of `resource` once the transaction commits."""
+    await db.execute(version_bump_statement(db.get_bind().dialect.name, resource))
+
+
+async def current_versions(db, resources: tuple[str, ...]) -> tuple[int, ...]:
+    rows = dict((await db.execute(
+        select(ResourceVersion.resource, func.sum(ResourceVersion.version))
+        .where(ResourceVersion.resource.in_(resources))
+        .group_by(ResourceVersion.resource)
+    )).all())
+    return tuple(int(rows.get(resource) or 0) for resource in resources)
+
+
+def _if_none_match(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in (tag.strip() for tag in header.split(","))
+
+
+async def cached_json(request: Request, db, resources: tuple[str, ...], adapter: TypeAdapter, build) -> Response:
+    """
+    Serve a JSON representation that only depends on the URL and the
+    versions of `resources`. `build` is an async callable producing the
+    data, called only when the body is not cached.
+    """
+    versions = await current_versions(db, resources)
+    key = (request.url.path, str(request.query_params), versions)
+    etag = '"' + hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if _if_none_match(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    body = body_cache.get(key)
+    if body is None:
+        data = await build()
+        body = adapter.dump_json(adapter.validate_python(data, from_attributes=True))
+        body_cache.set(key, body)
+    return Response(content=body, media_type="application/json", headers=headers)
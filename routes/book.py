@@ -1,122 +1,306 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from database import get_db
-from schemas import BookCreate, BookResponse, BookUpdate, CategoryResponse, CategoryCreate
-from models import Book, Category
-from auth import get_current_user
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Literal, Optional
+from database import get_async_db, get_read_db, stream_row_batches
+from schemas import (
+    BookCreate, BookMessageResponse, BookResponse, BookSearchResponse, BookUpdate, BookPage, CategoryResponse,
+    CategoryCreate, ImportReport, MessageResponse, SuggestionResponse,
+)
+from models import BOOK_COLUMNS, Book, Category
+from auth import get_current_user, get_current_principal
+from pagination import encode_cursor, decode_cursor
+from search import SearchQuery, get_search_backend
+from suggest import MAX_SUGGESTIONS, get_suggest_index
+from bulk_import import BookImporter, LineBatchParser, DEFAULT_BATCH_SIZE, MAX_BATCH_SIZE
+from stats import adjust_category
+from inventory import add_copies, copy_counts, default_barcode
+from response_cache import BOOKS, CATEGORIES, bump_version, cached_json
+from pydantic import TypeAdapter
+from contextlib import asynccontextmanager
+import codecs
+import json
+
+STREAM_BATCH_SIZE = 1000
+
+book_page_adapter = TypeAdapter(BookPage)
+book_adapter = TypeAdapter(BookResponse)
+category_adapter = TypeAdapter(CategoryResponse)
+category_list_adapter = TypeAdapter(list[CategoryResponse])
+
+# A read session outside dependency injection, for handlers that only sometimes need one
+read_session = asynccontextmanager(get_read_db)
 
 router = APIRouter()
 
 
-@router.post("/books", status_code=status.HTTP_201_CREATED)
-def add_book(book: BookCreate, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+@router.post("/books", response_model=BookMessageResponse, status_code=status.HTTP_201_CREATED)
+async def add_book(book: BookCreate, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_principal)):
     if current_user.role != "librarian":
         raise HTTPException(status_code=403, detail="Only librarians can add books")
 
-    existing_book = db.query(Book).filter(Book.isbn_number == book.isbn_number).first()
+    existing_book = await db.get(Book, book.isbn_number)
     if existing_book:
         raise HTTPException(status_code=400, detail="Book with this ISBN already exists")
     
-    category = db.query(Category).filter(Category.id == book.category_id).first()
+    category = await db.get(Category, book.category_id)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
 
-    new_book = Book(**book.dict())
+    new_book = Book(**book.dict(exclude={"copies"}))
     db.add(new_book)
-    db.commit()
-    db.refresh(new_book)
+    await db.flush()
+    # Nobody can hold a title that did not exist, so the copies go straight on the shelf
+    await add_copies(db, new_book.isbn_number, new_book.category_id, [
+        {"barcode": default_barcode(new_book.isbn_number, number), "branch": None}
+        for number in range(1, book.copies + 1)
+    ], available=True)
+    await bump_version(db, BOOKS)
+    await db.commit()
+    await db.refresh(new_book)
     return {"message": "Book added successfully", "book": new_book}
 
 
-@router.put("/books/{isbn_number}")
-def update_book(isbn_number: str, book_data: BookUpdate, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+async def _request_line_batches(request: Request, batch_size: int):
+    """Split the streamed request body into batches of text lines."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    batch = []
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            batch.append(line + "\n")
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        batch.append(pending)
+    if batch:
+        yield batch
+
+
+@router.post("/books/import", response_model=ImportReport)
+async def import_books(
+    request: Request,
+    format: Literal["csv", "jsonl"] = "csv",
+    on_conflict: Literal["skip", "update"] = "skip",
+    batch_size: int = Query(DEFAULT_BATCH_SIZE, ge=1, le=MAX_BATCH_SIZE),
+    db: AsyncSession = Depends(get_async_db),
+    current_user=Depends(get_current_principal)
+):
+    """
+    Bulk import books from a CSV or JSON Lines request body (one record per
+    line), committing one batch at a time. Only librarians can import books.
+    """
+    if current_user.role != "librarian":
+        raise HTTPException(status_code=403, detail="Only librarians can import books")
+
+    importer = await db.run_sync(lambda session: BookImporter(session, on_conflict=on_conflict))
+    parser = LineBatchParser(format)
+    async for lines in _request_line_batches(request, batch_size):
+        records = parser.parse(lines)
+        if records:
+            await db.run_sync(importer.import_batch, records)
+    return importer.report()
+
+
+@router.put("/books/{isbn_number}", response_model=BookMessageResponse)
+async def update_book(isbn_number: str, book_data: BookUpdate, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_principal)):
     if current_user.role != "librarian":
         raise HTTPException(status_code=403, detail="Only librarians can update books")
 
-    book = db.query(Book).filter(Book.isbn_number == isbn_number).first()
+    book = await db.get(Book, isbn_number)
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
 
+    old_category_id = book.category_id
     for key, value in book_data.dict(exclude_unset=True).items():
         setattr(book, key, value)
 
-    db.commit()
-    db.refresh(book)
+    if book.category_id != old_category_id:
+        # Move the title's copies, and those of them on loan, to the new category
+        counts = (await db.execute(copy_counts([isbn_number]))).first()
+        if counts is not None:
+            _, total, borrowed = counts
+            await adjust_category(db, old_category_id, isbn_number, total=-total, borrowed=-borrowed)
+            await adjust_category(db, book.category_id, isbn_number, total=total, borrowed=borrowed)
+    await bump_version(db, BOOKS)
+    await db.commit()
+    await db.refresh(book)
     return {"message": "Book updated successfully", "book": book}
 
 
-@router.delete("/books/{isbn_number}")
-def delete_book(isbn_number: str, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+@router.delete("/books/{isbn_number}", response_model=MessageResponse)
+async def delete_book(isbn_number: str, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_principal)):
     if current_user.role != "librarian":
         raise HTTPException(status_code=403, detail="Only librarians can delete books")
 
-    book = db.query(Book).filter(Book.isbn_number == isbn_number).first()
+    book = await db.get(Book, isbn_number)
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
 
-    db.delete(book)
-    db.commit()
+    counts = (await db.execute(copy_counts([isbn_number]))).first()
+    if counts is not None:
+        _, total, borrowed = counts
+        await adjust_category(db, book.category_id, isbn_number, total=-total, borrowed=-borrowed)
+    await bump_version(db, BOOKS)
+    await db.delete(book)
+    await db.commit()
     return {"message": "Book deleted successfully"}
 
 
-@router.get("/", response_model=list[BookResponse])
-def list_books(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
-    books = db.query(Book).all()
-    return books
+async def _stream_books_ndjson():
+    """Yield every book as one JSON line, reading through a server-side cursor."""
+    # The request-scoped session is closed before the body is streamed,
+    # so the export reads through its own session for the whole response.
+    query = select(*BOOK_COLUMNS).order_by(Book.isbn_number)
+    async for rows in stream_row_batches(query, STREAM_BATCH_SIZE, read_only=True):
+        yield "".join(
+            json.dumps(dict(row._asdict(), availability_status=row.available_copies > 0)) + "\n" for row in rows
+        )
 
 
-@router.get("/books/{isbn}", response_model=BookResponse)
-def get_book_by_id(isbn: str, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
-    book = db.query(Book).filter(Book.isbn_number == isbn).first()
-    if not book:
-        raise HTTPException(status_code=404, detail="Book not found")
-    return book
-
-
-@router.get("/books/search")
-def search_books(title: str = None, author: str = None, category_id: int = None, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
-    query = db.query(Book)
-    if title:
-        query = query.filter(Book.title.ilike(f"%{title}%"))
-    if author:
-        query = query.filter(Book.author.ilike(f"%{author}%"))
-    if category_id:
-        query = query.filter(Book.category_id == category_id)
-    
-    books = query.all()
+@router.get("/", response_model=BookPage)
+async def list_books(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json",
+    db: AsyncSession = Depends(get_read_db),
+    current_user=Depends(get_current_user)
+):
+    """List books ordered by ISBN, one keyset page at a time or as an NDJSON export."""
+
+    if format == "ndjson":
+        return StreamingResponse(_stream_books_ndjson(), media_type="application/x-ndjson")
+
+    query = select(*BOOK_COLUMNS).order_by(Book.isbn_number)
+    if cursor:
+        last_isbn, = decode_cursor(cursor, str)
+        query = query.where(Book.isbn_number > last_isbn)
+
+    async def build():
+        # Fetch one extra row to learn whether another page exists
+        books = (await db.execute(query.limit(limit + 1))).all()
+        next_cursor = None
+        if len(books) > limit:
+            books = books[:limit]
+            next_cursor = encode_cursor(books[-1].isbn_number)
+        return {"books": books, "next_cursor": next_cursor}
+
+    return await cached_json(request, db, (BOOKS,), book_page_adapter, build)
+
+
+@router.get("/books/search", response_model=BookSearchResponse)
+async def search_books(
+    q: str = None,
+    title: str = None,
+    author: str = None,
+    category_id: int = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_read_db),
+    current_user=Depends(get_current_user)
+):
+    """
+    Ranked prefix search over titles and authors, optionally within one
+    category; with only a category, its most borrowed books first.
+    """
+
+    query = SearchQuery(q=q, title=title, author=author, category_id=category_id)
+    if query.is_empty():
+        raise HTTPException(status_code=400, detail="Provide a search term in q, title or author, or a category_id")
+
+    books = await db.run_sync(
+        lambda session: get_search_backend(session).search(session, query, limit=limit, offset=offset)
+    )
     return {"books": books}
 
 
+@router.get("/books/suggest", response_model=list[SuggestionResponse])
+async def suggest_books(
+    request: Request,
+    prefix: str = Query(min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=MAX_SUGGESTIONS),
+    current_user=Depends(get_current_user)
+):
+    """Books whose title or author starts with `prefix`, most borrowed first, for search box typeahead."""
+
+    index = get_suggest_index()
+    if index is not None:
+        return index.suggest(prefix, limit)
+
+    # Until this worker has built its index (or with it disabled), search the database
+    query = SearchQuery(q=prefix)
+    if query.is_empty():
+        return []
+    async with read_session(request) as db:
+        return await db.run_sync(
+            lambda session: get_search_backend(session).search(session, query, limit=limit, offset=0)
+        )
+
+
+@router.get("/books/suggest/stats", response_model=dict[str, int])
+async def suggest_index_stats(current_user=Depends(get_current_principal)):
+    """Size and memory footprint of this worker's suggestion index (librarians only)."""
+    if current_user.role != "librarian":
+        raise HTTPException(status_code=403, detail="Only librarians can view suggestion index stats")
+    index = get_suggest_index()
+    if index is None:
+        raise HTTPException(status_code=503, detail="Suggestion index is not built yet")
+    return index.stats()
+
+
+@router.get("/books/{isbn}", response_model=BookResponse)
+async def get_book_by_id(isbn: str, request: Request, db: AsyncSession = Depends(get_read_db), current_user=Depends(get_current_user)):
+    async def build():
+        book = (await db.execute(select(*BOOK_COLUMNS).where(Book.isbn_number == isbn))).first()
+        if not book:
+            raise HTTPException(status_code=404, detail="Book not found")
+        return book
+
+    return await cached_json(request, db, (BOOKS,), book_adapter, build)
+
+
 @router.post("/categories", response_model=CategoryResponse)
-def add_category(category_data: CategoryCreate, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+async def add_category(category_data: CategoryCreate, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_principal)):
     """Only librarians can add book categories."""
 
     if current_user.role != "librarian":
         raise HTTPException(status_code=403, detail="Only librarians can add categories")
 
-    existing_category = db.query(Category).filter(Category.name == category_data.name).first()
+    existing_category = await db.scalar(select(Category).where(Category.name == category_data.name))
     if existing_category:
         raise HTTPException(status_code=400, detail="Category already exists")
 
     new_category = Category(**category_data.dict())
     db.add(new_category)
-    db.commit()
+    await bump_version(db, CATEGORIES)
+    await db.commit()
     return new_category
 
 
 @router.get("/categories", response_model=list[CategoryResponse])
-def list_categories(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+async def list_categories(request: Request, db: AsyncSession = Depends(get_read_db), current_user=Depends(get_current_user)):
     """Fetch all available book categories."""
-    
-    return db.query(Category).all()
+
+    async def build():
+        return (await db.execute(select(Category.id, Category.name))).all()
+
+    return await cached_json(request, db, (CATEGORIES,), category_list_adapter, build)
 
 
 @router.get("/categories/{category_id}", response_model=CategoryResponse)
-def get_category(category_id: int, db: Session = Depends(get_db)):
+async def get_category(category_id: int, request: Request, db: AsyncSession = Depends(get_read_db)):
     """Fetch category details by ID."""
-    
-    category = db.query(Category).filter(Category.id == category_id).first()
-    if not category:
-        raise HTTPException(status_code=404, detail="Category not found")
 
-    return category
+    async def build():
+        category = (await db.execute(select(Category.id, Category.name).where(Category.id == category_id))).first()
+        if not category:
+            raise HTTPException(status_code=404, detail="Category not found")
+        return category
+
+    return await cached_json(request, db, (CATEGORIES,), category_adapter, build)
@@ -1,66 +1,336 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import func, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db, get_read_db, mark_recent_write
 from models import MemberBook, Book, User
-from schemas import BorrowBookRequest, BorrowingHistoryResponse
-from auth import get_current_user
+from schemas import (
+    BatchBorrowRequest, BatchResult, BatchReturnRequest, BorrowBookRequest, BorrowingHistoryPage, MessageResponse,
+)
+from auth import Principal, get_current_user
+from stats import record_borrow, record_borrows, record_overdue_returns, record_return, record_returns
+from holds import allocate_copy, claim_ready_hold, claim_ready_holds
+from inventory import claim_copy, claim_copies, lend_reserved_copies
+from overdues import due_date_for, final_fines
+from response_cache import BOOKS, bump_version
+from pagination import encode_cursor, decode_cursor
+from archive import read_archived_history
+from operator import itemgetter
+from typing import Literal, Optional
 import datetime
 
 router = APIRouter()
 
+# Advisory lock namespace for serializing each member's borrows
+MEMBER_BORROW_LOCK = 0x626F72
 
-@router.post("/borrow")
-def borrow_book(request: BorrowBookRequest, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
-    book = db.query(Book).filter(Book.isbn_number == request.book_id, Book.availability_status == True).first()
-    if not book:
-        raise HTTPException(status_code=400, detail="Book is not available for borrowing")
 
-    existing_borrow = db.query(MemberBook).filter(
-        MemberBook.user_id == current_user.id, 
-        MemberBook.book_id == request.book_id, 
-        MemberBook.status == "borrowed"
-    ).first()
+async def _lock_member_borrows(db: AsyncSession, user_id: int):
+    """
+    Hold a lock on the member's borrows until the transaction ends. With
+    member_book partitioned no unique index can stop a member borrowing a
+    title twice, so borrows check for an active one while holding this.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        await db.execute(select(func.pg_advisory_xact_lock(MEMBER_BORROW_LOCK, user_id)))
+    else:
+        # SQLite has no such locks; writing first takes its database-wide
+        # write lock, and the check then runs in that transaction
+        await db.execute(update(User).where(User.id == user_id).values(id=User.id))
+
 
+@router.post("/borrow", response_model=MessageResponse)
+async def borrow_book(request: BorrowBookRequest, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
+    await _lock_member_borrows(db, current_user.id)
+    existing_borrow = await db.scalar(select(MemberBook.id).where(
+        MemberBook.user_id == current_user.id,
+        MemberBook.book_id == request.book_id,
+        MemberBook.status == "borrowed"
+    ))
     if existing_borrow:
         raise HTTPException(status_code=400, detail="You already borrowed this book")
-    
-    borrow_record  = MemberBook(book_id=request.book_id, user_id=current_user.id, borrow_date=datetime.datetime.utcnow(), status="borrowed")
-    book.availability_status = False
+
+    # A copy reserved for this member by a ready hold is lent first
+    copy_id = await claim_ready_hold(db, current_user.id, request.book_id)
+    if copy_id is not None:
+        await lend_reserved_copies(db, [copy_id])
+    else:
+        # Claim a copy with one conditional UPDATE. Concurrent borrowers skip
+        # copies another transaction has locked instead of queueing on them.
+        copy_id = await claim_copy(db, request.book_id, branch=request.branch, barcode=request.barcode)
+    if copy_id is None:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Book is not available for borrowing")
+
+    now = datetime.datetime.utcnow()
+    borrow_record  = MemberBook(book_id=request.book_id, copy_id=copy_id, user_id=current_user.id, borrow_date=now, due_date=due_date_for(now), status="borrowed")
     db.add(borrow_record)
-    db.commit()
+    await record_borrow(db, request.book_id)
+    await bump_version(db, BOOKS)
+    await db.commit()
+    mark_recent_write(current_user.id)
     return {"message": "Book borrowed successfully"}
 
 
-@router.post("/return/{book_id}")
-def return_book(book_id: str, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
-    borrow_record = db.query(MemberBook).filter(
-        MemberBook.book_id == book_id, 
-        MemberBook.status == "borrowed",
-        MemberBook.user_id == current_user.id
-        ).first()
-    if not borrow_record:
+class BatchReport:
+    """Per-item outcomes of a batch request, reported in request order."""
+
+    def __init__(self, book_ids: list[str]):
+        self.book_ids = book_ids
+        self.outcomes: dict[str, tuple[bool, str]] = {}
+        # Each ISBN is processed once; repeats are reported as failures
+        self.unique = sorted(set(book_ids))
+
+    def fail(self, book_id: str, detail: str):
+        self.outcomes[book_id] = (False, detail)
+
+    def succeed(self, book_id: str, detail: str):
+        self.outcomes[book_id] = (True, detail)
+
+    def pending(self) -> list[str]:
+        return [book_id for book_id in self.unique if book_id not in self.outcomes]
+
+    def result(self) -> dict:
+        results = []
+        seen = set()
+        for book_id in self.book_ids:
+            ok, detail = (False, "Duplicate ISBN in request") if book_id in seen else self.outcomes[book_id]
+            seen.add(book_id)
+            results.append({"book_id": book_id, "ok": ok, "detail": detail})
+        succeeded = sum(result["ok"] for result in results)
+        return {"succeeded": succeeded, "failed": len(results) - succeeded, "results": results}
+
+
+# Registered before /return/{book_id}, which would otherwise match "batch".
+
+@router.post("/borrow/batch", response_model=BatchResult)
+async def borrow_books(request: BatchBorrowRequest, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
+    """
+    Borrow several books in one transaction, e.g. from a self-checkout kiosk.
+    Items that cannot be borrowed are reported without failing the rest.
+    """
+    report = BatchReport(request.book_ids)
+    await _lock_member_borrows(db, current_user.id)
+    categories = dict((await db.execute(
+        select(Book.isbn_number, Book.category_id).where(Book.isbn_number.in_(report.unique))
+    )).all())
+    borrowed = set((await db.scalars(select(MemberBook.book_id).where(
+        MemberBook.user_id == current_user.id,
+        MemberBook.book_id.in_(report.unique),
+        MemberBook.status == "borrowed"
+    ))).all())
+    for book_id in report.unique:
+        if book_id not in categories:
+            report.fail(book_id, "Book not found")
+        elif book_id in borrowed:
+            report.fail(book_id, "You already borrowed this book")
+
+    # Copies reserved for this member by ready holds first, then copies on the shelf
+    copies = await claim_ready_holds(db, current_user.id, report.pending())
+    if copies:
+        await lend_reserved_copies(db, list(copies.values()))
+    copies.update(await claim_copies(
+        db, [book_id for book_id in report.pending() if book_id not in copies], branch=request.branch
+    ))
+    for book_id in report.pending():
+        if book_id in copies:
+            report.succeed(book_id, "Book borrowed successfully")
+        else:
+            report.fail(book_id, "Book is not available for borrowing")
+
+    if copies:
+        now = datetime.datetime.utcnow()
+        db.add_all([
+            MemberBook(
+                book_id=book_id, copy_id=copy_id, user_id=current_user.id,
+                borrow_date=now, due_date=due_date_for(now), status="borrowed",
+            )
+            for book_id, copy_id in copies.items()
+        ])
+        await record_borrows(db, {book_id: categories[book_id] for book_id in copies})
+        await bump_version(db, BOOKS)
+    await db.commit()
+    mark_recent_write(current_user.id)
+    return report.result()
+
+
+# What a return needs of each borrow it closes: the copy to pass on and
+# what final_fines settles
+RETURNED_COLUMNS = (
+    MemberBook.id, MemberBook.borrow_date, MemberBook.book_id, MemberBook.copy_id,
+    MemberBook.due_date, MemberBook.overdue, MemberBook.fine_cents,
+)
+
+
+async def _settle_fines(db, rows, return_date: datetime.datetime):
+    """Record the final fine of the borrows just returned, rather than leaving the last sweep's."""
+    changes = final_fines(rows, return_date)
+    if changes:
+        await db.execute(update(MemberBook), changes)
+
+
+@router.post("/return/batch", response_model=BatchResult)
+async def return_books(request: BatchReturnRequest, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
+    """Return several books in one transaction, reporting the ones with no active borrow."""
+    report = BatchReport(request.book_ids)
+    now = datetime.datetime.utcnow()
+    rows = (await db.execute(
+        update(MemberBook)
+        .where(
+            MemberBook.user_id == current_user.id,
+            MemberBook.book_id.in_(report.unique),
+            MemberBook.status == "borrowed"
+        )
+        .values(return_date=now, status="returned")
+        .returning(*RETURNED_COLUMNS)
+    )).all()
+    returned = {row.book_id: row.copy_id for row in rows}
+    for book_id in report.unique:
+        if book_id in returned:
+            report.succeed(book_id, "Book returned successfully")
+        else:
+            report.fail(book_id, "No active borrow record found")
+
+    if returned:
+        await _settle_fines(db, rows, now)
+        categories = dict((await db.execute(
+            select(Book.isbn_number, Book.category_id).where(Book.isbn_number.in_(list(returned)))
+        )).all())
+        # In ISBN order, so batches returning the same titles lock them alike
+        for book_id in sorted(returned):
+            if returned[book_id] is not None:
+                await allocate_copy(db, book_id, returned[book_id])
+        await record_returns(db, categories)
+        await record_overdue_returns(db, sum(row.overdue for row in rows))
+        await bump_version(db, BOOKS)
+    await db.commit()
+    mark_recent_write(current_user.id)
+    return report.result()
+
+
+@router.post("/return/{book_id}", response_model=MessageResponse)
+async def return_book(book_id: str, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
+    now = datetime.datetime.utcnow()
+    returned = (await db.execute(
+        update(MemberBook)
+        .where(
+            MemberBook.book_id == book_id, 
+            MemberBook.status == "borrowed",
+            MemberBook.user_id == current_user.id
+        )
+        .values(return_date=now, status="returned")
+        .returning(*RETURNED_COLUMNS)
+    )).first()
+    if returned is None:
+        await db.rollback()
         raise HTTPException(status_code=400, detail="No active borrow record found")
-    
-    borrow_record.return_date = datetime.datetime.utcnow()
-    borrow_record.status = "returned"
-    
-    book = db.query(Book).filter(Book.isbn_number == book_id).first()
-    book.availability_status = True
-    db.commit()
+    await _settle_fines(db, [returned], now)
+
+    # The copy goes to the next hold in line, or back on the shelf
+    if returned.copy_id is not None:
+        await allocate_copy(db, book_id, returned.copy_id)
+    await record_return(db, book_id)
+    await record_overdue_returns(db, int(returned.overdue))
+    await bump_version(db, BOOKS)
+    await db.commit()
+    mark_recent_write(current_user.id)
     return {"message": "Book returned successfully"}
 
 
-@router.get("/borrow-history")
-def get_borrowing_history(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
-    history = db.query(MemberBook).filter(MemberBook.user_id == current_user.id).all()
-    return {"borrowing_history": history}
+class HistoryParams:
+    """Pagination and filters shared by the borrowing history endpoints."""
+
+    def __init__(
+        self,
+        cursor: Optional[str] = None,
+        limit: int = Query(50, ge=1, le=500),
+        from_date: Optional[datetime.datetime] = Query(None, alias="from"),
+        to_date: Optional[datetime.datetime] = Query(None, alias="to"),
+        status_filter: Optional[Literal["borrowed", "returned"]] = Query(None, alias="status"),
+        include_book: bool = Query(False, description="Embed each book's title and author"),
+    ):
+        self.cursor = cursor
+        self.limit = limit
+        self.from_date = from_date
+        self.to_date = to_date
+        self.status = status_filter
+        self.include_book = include_book
+
+    def is_filtered(self) -> bool:
+        return bool(self.cursor or self.from_date or self.to_date or self.status)
+
+
+async def _history_page(db: AsyncSession, user_id: int, params: HistoryParams) -> dict:
+    """
+    One page of a member's history, newest first, from member_book and then
+    the archive. Book details come from a join rather than per-row
+    relationship loads.
+    """
+    columns = [
+        MemberBook.id, MemberBook.book_id, MemberBook.borrow_date, MemberBook.due_date, MemberBook.return_date,
+        MemberBook.status, MemberBook.overdue, MemberBook.fine_cents,
+    ]
+    if params.include_book:
+        columns += [Book.title, Book.author]
+    query = select(*columns).where(MemberBook.user_id == user_id)
+    if params.include_book:
+        query = query.outerjoin(Book, Book.isbn_number == MemberBook.book_id)
+
+    if params.from_date:
+        query = query.where(MemberBook.borrow_date >= params.from_date)
+    if params.to_date:
+        query = query.where(MemberBook.borrow_date < params.to_date)
+    if params.status:
+        query = query.where(MemberBook.status == params.status)
+    before = None
+    if params.cursor:
+        before = tuple(decode_cursor(params.cursor, datetime.datetime, int))
+        query = query.where(tuple_(MemberBook.borrow_date, MemberBook.id) < tuple_(*before))
+
+    # Fetch one extra row to learn whether another page exists
+    query = query.order_by(MemberBook.borrow_date.desc(), MemberBook.id.desc()).limit(params.limit + 1)
+    rows = [row._asdict() for row in (await db.execute(query)).all()]
+
+    # Old returned borrows are archived; merge in any that belong on this page
+    if params.status != "borrowed":
+        after = (rows[-1]["borrow_date"], rows[-1]["id"]) if len(rows) > params.limit else None
+        archived = await read_archived_history(
+            db, user_id, params.limit + 1, before=before, after=after,
+            from_date=params.from_date, to_date=params.to_date,
+        )
+        if archived:
+            if params.include_book:
+                books = {row.isbn_number: row for row in (await db.execute(
+                    select(Book.isbn_number, Book.title, Book.author)
+                    .where(Book.isbn_number.in_({record["book_id"] for record in archived}))
+                )).all()}
+                for record in archived:
+                    book = books.get(record["book_id"])
+                    record.update(title=book and book.title, author=book and book.author)
+            rows = sorted(rows + archived, key=itemgetter("borrow_date", "id"), reverse=True)[:params.limit + 1]
+
+    next_cursor = None
+    if len(rows) > params.limit:
+        rows = rows[:params.limit]
+        next_cursor = encode_cursor(rows[-1]["borrow_date"].isoformat(), rows[-1]["id"])
+
+    return {"borrowing_history": rows, "next_cursor": next_cursor}
+
+
+@router.get("/borrow-history", response_model=BorrowingHistoryPage)
+async def get_own_borrowing_history(
+    params: HistoryParams = Depends(),
+    db: AsyncSession = Depends(get_read_db),
+    current_user=Depends(get_current_user)
+):
+    return await _history_page(db, current_user.id, params)
 
 
-@router.get("/borrow-history/{user_id}", response_model=list[BorrowingHistoryResponse])
-def get_borrowing_history(
+@router.get("/borrow-history/{user_id}", response_model=BorrowingHistoryPage)
+async def get_borrowing_history(
     user_id: int, 
-    db: Session = Depends(get_db), 
-    current_user: User = Depends(get_current_user)
+    params: HistoryParams = Depends(),
+    db: AsyncSession = Depends(get_read_db), 
+    current_user: Principal = Depends(get_current_user)
 ):
     # Ensure users can only view their own history unless they are a librarian
     if current_user.role != "librarian" and current_user.id != user_id:
@@ -69,12 +339,12 @@ def get_borrowing_history(
             detail="You do not have permission to view this user's borrowing history."
         )
 
-    borrow_records = db.query(MemberBook).filter(MemberBook.user_id == user_id).all()
+    page = await _history_page(db, user_id, params)
 
-    if not borrow_records:
+    if not page["borrowing_history"] and not params.is_filtered():
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, 
             detail="No borrowing history found for this user."
         )
 
-    return borrow_records
\ No newline at end of file
+    return page
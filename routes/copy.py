@@ -0,0 +1,79 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from database import get_async_db, get_read_db
+from models import Book, Copy
+from schemas import CopyCreate, CopyResponse
+from auth import get_current_user, get_current_principal
+from holds import allocate_copy
+from inventory import add_copies, adjust_availability
+from stats import adjust_category
+from response_cache import BOOKS, bump_version
+
+router = APIRouter()
+
+
+@router.get("/books/{isbn_number}/copies", response_model=list[CopyResponse])
+async def list_copies(
+    isbn_number: str,
+    branch: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user=Depends(get_current_user)
+):
+    """Every copy of a title with its branch and status, optionally at one branch."""
+    query = select(Copy).where(Copy.book_id == isbn_number).order_by(Copy.id)
+    if branch is not None:
+        query = query.where(Copy.branch == branch)
+    return (await db.scalars(query)).all()
+
+
+@router.post("/books/{isbn_number}/copies", response_model=list[CopyResponse], status_code=status.HTTP_201_CREATED)
+async def add_book_copies(
+    isbn_number: str,
+    copies: list[CopyCreate],
+    db: AsyncSession = Depends(get_async_db),
+    current_user=Depends(get_current_principal)
+):
+    """Add copies of a title. Each one goes to the next waiting hold, or on the shelf."""
+    if current_user.role != "librarian":
+        raise HTTPException(status_code=403, detail="Only librarians can add copies")
+
+    category_id = await db.scalar(select(Book.category_id).where(Book.isbn_number == isbn_number))
+    if category_id is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+
+    try:
+        copy_ids = await add_copies(db, isbn_number, category_id, [copy.dict() for copy in copies], available=False)
+    except IntegrityError:
+        # copies.barcode is unique
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="A copy with one of these barcodes already exists")
+    for copy_id in copy_ids:
+        await allocate_copy(db, isbn_number, copy_id)
+    await bump_version(db, BOOKS)
+    await db.commit()
+    return (await db.scalars(select(Copy).where(Copy.id.in_(copy_ids)).order_by(Copy.id))).all()
+
+
+@router.delete("/copies/{copy_id}")
+async def withdraw_copy(copy_id: int, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_principal)):
+    """Remove a copy from the catalogue; only copies on the shelf can be withdrawn."""
+    if current_user.role != "librarian":
+        raise HTTPException(status_code=403, detail="Only librarians can withdraw copies")
+
+    book_id = await db.scalar(
+        delete(Copy).where(Copy.id == copy_id, Copy.status == "available").returning(Copy.book_id)
+    )
+    if book_id is None:
+        await db.rollback()
+        if await db.get(Copy, copy_id) is None:
+            raise HTTPException(status_code=404, detail="Copy not found")
+        raise HTTPException(status_code=400, detail="Copy is borrowed or reserved")
+
+    await adjust_availability(db, book_id, copy_id, total=-1, available=-1)
+    await adjust_category(db, select(Book.category_id).where(Book.isbn_number == book_id).scalar_subquery(), book_id, total=-1)
+    await bump_version(db, BOOKS)
+    await db.commit()
+    return {"message": "Copy withdrawn successfully"}
@@ -0,0 +1,35 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import SQLAlchemyError
+from decouple import config
+import asyncio
+import time
+import database
+
+READY_TIMEOUT = config("ready_timeout", default=2, cast=float)
+
+router = APIRouter(prefix="/health", include_in_schema=False)
+
+
+@router.get("/live")
+def liveness():
+    """The process is up and serving; never touches the database."""
+    return {"status": "alive"}
+
+
+@router.get("/ready")
+async def readiness():
+    """Whether this worker can serve traffic: started, and the primary database answers."""
+    if database.engine is None:
+        return JSONResponse({"status": "starting"}, status_code=503)
+    try:
+        await asyncio.wait_for(database.ping_primary(), READY_TIMEOUT)
+    except (SQLAlchemyError, asyncio.TimeoutError):
+        return JSONResponse({"status": "unavailable", "primary": "unreachable"}, status_code=503)
+    now = time.monotonic()
+    replicas = database.replica_set.replicas
+    return {
+        "status": "ready",
+        "replicas_up": sum(replica.is_up(now) for replica in replicas),
+        "replicas": len(replicas),
+    }
@@ -0,0 +1,101 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
+from models import Book, Hold, MemberBook
+from schemas import HoldRequest, HoldResponse
+from auth import get_current_user
+from holds import (
+    HOLD_RECHECK_SECONDS, HOLD_WAIT_MAX_SECONDS, OPEN_STATUSES, allocate_copy, hold_notifier, queue_position,
+)
+from response_cache import BOOKS, bump_version
+import asyncio
+
+router = APIRouter(prefix="/holds")
+
+
+def _hold_rows(user_id: int):
+    return select(
+        Hold.id, Hold.book_id, Hold.placed_at, Hold.status, Hold.copy_id, Hold.ready_at, Hold.expires_at, queue_position()
+    ).where(Hold.user_id == user_id).order_by(Hold.id)
+
+
+@router.post("", response_model=HoldResponse)
+async def place_hold(request: HoldRequest, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
+    # Lock the book so a concurrent return either sees this hold or is seen to have freed the copy
+    book = (await db.execute(
+        select(Book.available_copies).where(Book.isbn_number == request.book_id).with_for_update()
+    )).first()
+    if book is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    if book.available_copies > 0:
+        raise HTTPException(status_code=400, detail="Book is available for borrowing")
+
+    existing_borrow = await db.scalar(select(MemberBook.id).where(
+        MemberBook.user_id == current_user.id,
+        MemberBook.book_id == request.book_id,
+        MemberBook.status == "borrowed"
+    ))
+    if existing_borrow:
+        raise HTTPException(status_code=400, detail="You already borrowed this book")
+
+    hold = Hold(user_id=current_user.id, book_id=request.book_id)
+    db.add(hold)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # ix_holds_open_user_book
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="You already have a hold on this book")
+
+    row = (await db.execute(_hold_rows(current_user.id).where(Hold.id == hold.id))).one()
+    return row._asdict()
+
+
+@router.get("", response_model=list[HoldResponse])
+async def list_holds(db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
+    """The current member's open holds, with their place in each queue."""
+    rows = (await db.execute(_hold_rows(current_user.id).where(Hold.status.in_(OPEN_STATUSES)))).all()
+    return [row._asdict() for row in rows]
+
+
+@router.get("/wait", response_model=list[HoldResponse])
+async def wait_for_holds(
+    timeout: float = Query(HOLD_WAIT_MAX_SECONDS, gt=0, le=HOLD_WAIT_MAX_SECONDS),
+    db: AsyncSession = Depends(get_async_db),
+    current_user=Depends(get_current_user)
+):
+    """
+    Long poll: respond as soon as one of the member's holds is ready to be
+    borrowed, or with an empty list after `timeout` seconds.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        rows = (await db.execute(_hold_rows(current_user.id).where(Hold.status == "ready"))).all()
+        # Give the connection back to the pool while waiting
+        await db.rollback()
+        remaining = deadline - loop.time()
+        if rows or remaining <= 0:
+            return [row._asdict() for row in rows]
+        await hold_notifier.wait(current_user.id, min(remaining, HOLD_RECHECK_SECONDS))
+
+
+@router.delete("/{hold_id}")
+async def cancel_hold(hold_id: int, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
+    hold = (await db.execute(
+        select(Hold.book_id, Hold.status, Hold.copy_id)
+        .where(Hold.id == hold_id, Hold.user_id == current_user.id, Hold.status.in_(OPEN_STATUSES))
+        .with_for_update()
+    )).first()
+    if hold is None:
+        raise HTTPException(status_code=404, detail="No open hold found")
+
+    await db.execute(update(Hold).where(Hold.id == hold_id).values(status="cancelled"))
+    if hold.status == "ready" and hold.copy_id is not None:
+        # The reserved copy goes to the next member in line
+        if await allocate_copy(db, hold.book_id, hold.copy_id) is None:
+            await bump_version(db, BOOKS)
+    await db.commit()
+    return {"message": "Hold cancelled"}
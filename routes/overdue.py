@@ -0,0 +1,53 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from database import get_async_db
+from models import MemberBook
+from schemas import OverduePage
+from auth import Principal, get_current_user
+from pagination import encode_cursor, decode_cursor
+import datetime
+
+router = APIRouter()
+
+
+@router.get("/overdues", response_model=OverduePage)
+async def list_overdues(
+    user_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    Active borrows the overdue sweep has marked overdue, longest overdue
+    first, with their fines. Members see their own; librarians see everyone's
+    or one member's.
+    """
+    if current_user.role != "librarian":
+        if user_id is not None and user_id != current_user.id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="You do not have permission to view this user's overdues."
+            )
+        user_id = current_user.id
+
+    # Walks the partial ix_member_book_active_due_date index in order
+    query = select(
+        MemberBook.id, MemberBook.user_id, MemberBook.book_id, MemberBook.copy_id,
+        MemberBook.borrow_date, MemberBook.due_date, MemberBook.fine_cents,
+    ).where(MemberBook.status == "borrowed", MemberBook.overdue == True)
+    if user_id is not None:
+        query = query.where(MemberBook.user_id == user_id)
+    if cursor:
+        last_due, last_id = decode_cursor(cursor, datetime.datetime, int)
+        query = query.where(tuple_(MemberBook.due_date, MemberBook.id) > tuple_(last_due, last_id))
+
+    # Fetch one extra row to learn whether another page exists
+    rows = (await db.execute(query.order_by(MemberBook.due_date, MemberBook.id).limit(limit + 1))).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].due_date.isoformat(), rows[-1].id)
+    return {"overdues": [row._asdict() for row in rows], "next_cursor": next_cursor}
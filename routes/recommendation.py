@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_read_db
+from models import Book, BookSimilarity
+from schemas import SimilarBookResponse
+from auth import get_current_user
+
+router = APIRouter()
+
+
+@router.get("/books/{isbn_number}/similar", response_model=list[SimilarBookResponse])
+async def similar_books(
+    isbn_number: str,
+    limit: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_read_db),
+    current_user=Depends(get_current_user)
+):
+    """
+    Titles most often borrowed by members who borrowed this one, best match
+    first, as of the last recommendations build.
+    """
+    rows = (await db.execute(
+        select(Book.isbn_number, Book.title, Book.author, BookSimilarity.score)
+        .join(Book, Book.isbn_number == BookSimilarity.similar_book_id)
+        .where(BookSimilarity.book_id == isbn_number)
+        .order_by(BookSimilarity.rank)
+        .limit(limit)
+    )).all()
+    if not rows and await db.scalar(select(Book.isbn_number).where(Book.isbn_number == isbn_number)) is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return [row._asdict() for row in rows]
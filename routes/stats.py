@@ -0,0 +1,102 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from database import get_async_db
+from models import Book, BookCirculation, Category, CategoryStats, DailyCirculation, OverdueStats
+from stats import OVERDUE_STATS_ID
+from schemas import CategoryStatsResponse, DailyCirculationResponse, OverdueCount, StatsSummary, TopBookResponse
+from auth import get_current_principal
+import datetime
+
+router = APIRouter(prefix="/stats")
+
+
+async def require_librarian(current_user=Depends(get_current_principal)):
+    if current_user.role != "librarian":
+        raise HTTPException(status_code=403, detail="Only librarians can view statistics")
+    return current_user
+
+
+async def _count_overdue(db: AsyncSession) -> int:
+    """Active borrows the overdue sweep has marked overdue, the same ones GET /overdues lists."""
+    overdue_books = await db.scalar(select(OverdueStats.overdue_books).where(OverdueStats.id == OVERDUE_STATS_ID))
+    return max(overdue_books or 0, 0)
+
+
+@router.get("", response_model=StatsSummary)
+async def get_stats_summary(db: AsyncSession = Depends(get_async_db), current_user=Depends(require_librarian)):
+    """Library-wide totals for the staff dashboard."""
+
+    total_books, borrowed_books = (await db.execute(
+        select(func.coalesce(func.sum(CategoryStats.total_books), 0), func.coalesce(func.sum(CategoryStats.borrowed_books), 0))
+    )).one()
+    borrows_today, returns_today = (await db.execute(
+        select(func.coalesce(func.sum(DailyCirculation.borrows), 0), func.coalesce(func.sum(DailyCirculation.returns), 0))
+        .where(DailyCirculation.day == datetime.datetime.utcnow().date())
+    )).one()
+    return {
+        "total_books": total_books,
+        "borrowed_books": borrowed_books,
+        "available_books": total_books - borrowed_books,
+        "overdue_books": await _count_overdue(db),
+        "borrows_today": borrows_today,
+        "returns_today": returns_today,
+    }
+
+
+@router.get("/categories", response_model=list[CategoryStatsResponse])
+async def get_category_stats(db: AsyncSession = Depends(get_async_db), current_user=Depends(require_librarian)):
+    """Available and borrowed book counts per category."""
+
+    total = func.coalesce(func.sum(CategoryStats.total_books), 0)
+    borrowed = func.coalesce(func.sum(CategoryStats.borrowed_books), 0)
+    rows = await db.execute(
+        select(Category.id, Category.name, total, borrowed)
+        .outerjoin(CategoryStats, CategoryStats.category_id == Category.id)
+        .group_by(Category.id, Category.name)
+        .order_by(Category.name)
+    )
+    return [
+        {"category_id": id, "name": name, "total_books": total, "borrowed_books": borrowed, "available_books": total - borrowed}
+        for id, name, total, borrowed in rows
+    ]
+
+
+@router.get("/top-books", response_model=list[TopBookResponse])
+async def get_top_books(limit: int = Query(10, ge=1, le=100), db: AsyncSession = Depends(get_async_db), current_user=Depends(require_librarian)):
+    """Most borrowed titles of all time."""
+
+    rows = await db.execute(
+        select(Book.isbn_number, Book.title, Book.author, BookCirculation.borrow_count)
+        .join(Book, Book.isbn_number == BookCirculation.book_id)
+        .order_by(BookCirculation.borrow_count.desc(), Book.isbn_number)
+        .limit(limit)
+    )
+    return [row._asdict() for row in rows]
+
+
+@router.get("/overdue", response_model=OverdueCount)
+async def get_overdue_count(db: AsyncSession = Depends(get_async_db), current_user=Depends(require_librarian)):
+    """Number of active borrows marked overdue by the last sweep."""
+    return {"overdue_books": await _count_overdue(db)}
+
+
+@router.get("/daily", response_model=list[DailyCirculationResponse])
+async def get_daily_circulation(
+    from_date: Optional[datetime.date] = Query(None, alias="from"),
+    to_date: Optional[datetime.date] = Query(None, alias="to"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user=Depends(require_librarian)
+):
+    """Borrows and returns per day, for the last 30 days unless a range is given."""
+
+    to_date = to_date or datetime.datetime.utcnow().date()
+    from_date = from_date or to_date - datetime.timedelta(days=29)
+    rows = await db.execute(
+        select(DailyCirculation.day, func.sum(DailyCirculation.borrows), func.sum(DailyCirculation.returns))
+        .where(DailyCirculation.day.between(from_date, to_date))
+        .group_by(DailyCirculation.day)
+        .order_by(DailyCirculation.day)
+    )
+    return [{"day": day, "borrows": borrows, "returns": returns} for day, borrows, returns in rows]
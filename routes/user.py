@@ -1,22 +1,24 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from models import Book, MemberBook, User
-from schemas import UserCreate, UserResponse
-from database import get_db
-from auth import hash_password, create_jwt_token, verify_password, get_current_user
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+from models import User
+from schemas import MessageResponse, TokenResponse, UserCreate, UserResponse
+from database import get_async_db
+from auth import hash_password_async, create_jwt_token, verify_password_async, password_needs_rehash, get_current_user, get_current_principal, principal_cache
 import datetime
 
 router = APIRouter()
 
 
-@router.post("/register")
-def  register_user(user_data: UserCreate, db: Session = Depends(get_db)):
+@router.post("/register", response_model=MessageResponse)
+async def register_user(user_data: UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Registers a new user with validation and role."""
     
-    if db.query(User).filter(User.email == user_data.email).first():
+    if await db.scalar(select(User).where(User.email == user_data.email)):
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await hash_password_async(user_data.password)
     # api_key = str(uuid.uuid4())
 
     new_user = User(
@@ -29,26 +31,38 @@ def  register_user(user_data: UserCreate, db: Session = Depends(get_db)):
     )
 
     db.add(new_user)
-    db.commit()
+    await db.commit()
     return {"message": "User registered successfully"}
 
 
-@router.post("/login")
-def login_user(email: str, password: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == email).first()
-    if not user or not verify_password(password, user.password):
+@router.post("/login", response_model=TokenResponse)
+async def login_user(email: str, password: str, db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(User).options(undefer(User.password)).where(User.email == email))
+    if not user or not await verify_password_async(password, user.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
+    # Upgrade hashes made with an older cost factor while we have the plaintext
+    if password_needs_rehash(user.password):
+        try:
+            user.password = await hash_password_async(password)
+            await db.commit()
+        except HTTPException:
+            # The pool is saturated; the upgrade can wait for the next login
+            await db.rollback()
+
     token = create_jwt_token(user.id, user.role)
     return {"token": token}
 
 
-@router.get("/profile")
-def get_user_profile(current_user=Depends(get_current_user)):
+@router.get("/profile", response_model=UserResponse)
+async def get_user_profile(current_user=Depends(get_current_user)):
     """Fetch the profile of the currently logged-in user."""
-    return {
-        "id": current_user.id,
-        "name": current_user.name,
-        "email": current_user.email,
-        "role": current_user.role
-    }
+    return current_user
+
+
+@router.get("/principal-cache/stats", response_model=dict[str, int])
+async def get_principal_cache_stats(current_user=Depends(get_current_principal)):
+    """Hit/miss counters of the authenticated principal cache (librarians only)."""
+    if current_user.role != "librarian":
+        raise HTTPException(status_code=403, detail="Only librarians can view cache statistics")
+    return principal_cache.stats()
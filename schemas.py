@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, computed_field
 from typing import Optional, Literal
 import datetime
 
@@ -18,6 +18,14 @@ class UserResponse(BaseModel):
     role: str
 
 
+class TokenResponse(BaseModel):
+    token: str
+
+
+class MessageResponse(BaseModel):
+    message: str
+
+
 class CategoryCreate(BaseModel):
     name: str = Field(min_length=2, max_length=50, description="Category name")
 
@@ -32,6 +40,7 @@ class BookCreate(BaseModel):
     title: str = Field(min_length=3, max_length=255, description="Book title")
     author: str = Field(min_length=3, max_length=255, description="Author's full name")
     category_id: int = Field(gt=0, description="Valid category ID")
+    copies: int = Field(1, ge=0, le=1000, description="Copies to add, labelled <isbn>-1, <isbn>-2, ...")
 
 
 class BookUpdate(BaseModel):
@@ -45,13 +54,165 @@ class BookResponse(BaseModel):
     title: str
     author: str
     category_id: int
-    availability_status: bool
+    total_copies: int
+    available_copies: int
+
+    @computed_field
+    @property
+    def availability_status(self) -> bool:
+        return self.available_copies > 0
+
+
+class BookPage(BaseModel):
+    books: list[BookResponse]
+    next_cursor: Optional[str] = None
+
+
+class BookSearchResponse(BaseModel):
+    books: list[BookResponse]
+
+
+class BookMessageResponse(BaseModel):
+    message: str
+    book: BookResponse
+
+class CopyCreate(BaseModel):
+    barcode: str = Field(min_length=1, max_length=64, description="Barcode on the copy's label")
+    branch: Optional[str] = Field(None, max_length=100, description="Branch holding the copy")
+
+
+class CopyResponse(BaseModel):
+    id: int
+    book_id: str
+    barcode: str
+    branch: Optional[str]
+    status: Literal["available", "borrowed", "reserved", "processing"]
+
+
+class SuggestionResponse(BaseModel):
+    isbn_number: str
+    title: str
+    author: str
+
+
+class SimilarBookResponse(BaseModel):
+    isbn_number: str
+    title: str
+    author: str
+    score: float = Field(description="Cosine similarity of the two titles' borrowers, from 0 to 1")
+
+
+class ImportRowError(BaseModel):
+    row: int
+    isbn_number: Optional[str]
+    error: str
+
+
+class ImportReport(BaseModel):
+    rows: int
+    written: int
+    skipped: int
+    failed: int
+    errors: list[ImportRowError]
 
 class BorrowBookRequest(BaseModel):
     book_id: str = Field(min_length=10, max_length=13, description="ISBN of the book to borrow")
+    branch: Optional[str] = Field(None, description="Only lend a copy held at this branch")
+    barcode: Optional[str] = Field(None, description="Lend this copy, e.g. one scanned at the desk")
+
+class BatchBorrowRequest(BaseModel):
+    book_ids: list[str] = Field(min_length=1, max_length=100, description="ISBNs of the books to borrow")
+    branch: Optional[str] = Field(None, description="Only lend copies held at this branch")
+
+class BatchReturnRequest(BaseModel):
+    book_ids: list[str] = Field(min_length=1, max_length=100, description="ISBNs of the books to return")
+
+class BatchItemResult(BaseModel):
+    book_id: str
+    ok: bool
+    detail: str
+
+class BatchResult(BaseModel):
+    succeeded: int
+    failed: int
+    results: list[BatchItemResult]
 
 class BorrowingHistoryResponse(BaseModel):
     book_id: str
     borrow_date: datetime.datetime
+    due_date: datetime.datetime
     return_date: Optional[datetime.datetime]
     status: Literal["borrowed", "returned"]
+    overdue: bool = False
+    fine_cents: int = 0
+    title: Optional[str] = None
+    author: Optional[str] = None
+
+
+class BorrowingHistoryPage(BaseModel):
+    borrowing_history: list[BorrowingHistoryResponse]
+    next_cursor: Optional[str] = None
+
+
+class OverdueResponse(BaseModel):
+    id: int
+    user_id: int
+    book_id: Optional[str]
+    copy_id: Optional[int]
+    borrow_date: datetime.datetime
+    due_date: datetime.datetime
+    fine_cents: int = Field(description="Fine owed as of the last overdue sweep")
+
+
+class OverduePage(BaseModel):
+    overdues: list[OverdueResponse]
+    next_cursor: Optional[str] = None
+
+
+class HoldRequest(BaseModel):
+    book_id: str = Field(min_length=10, max_length=13, description="ISBN of the book to reserve")
+
+
+class HoldResponse(BaseModel):
+    id: int
+    book_id: str
+    placed_at: datetime.datetime
+    status: Literal["waiting", "ready", "fulfilled", "cancelled", "expired"]
+    copy_id: Optional[int] = Field(None, description="The copy reserved for a ready hold")
+    ready_at: Optional[datetime.datetime] = None
+    expires_at: Optional[datetime.datetime] = None
+    position: Optional[int] = Field(None, description="1 for the next member in line; only set while waiting")
+
+
+class CategoryStatsResponse(BaseModel):
+    category_id: int
+    name: str
+    total_books: int
+    borrowed_books: int
+    available_books: int
+
+
+class TopBookResponse(BaseModel):
+    isbn_number: str
+    title: str
+    author: str
+    borrow_count: int
+
+
+class DailyCirculationResponse(BaseModel):
+    day: datetime.date
+    borrows: int
+    returns: int
+
+
+class StatsSummary(BaseModel):
+    total_books: int
+    borrowed_books: int
+    available_books: int
+    overdue_books: int
+    borrows_today: int
+    returns_today: int
+
+
+class OverdueCount(BaseModel):
+    overdue_books: int = Field(description="Active borrows marked overdue by the last sweep and not returned since")
@@ -0,0 +1,284 @@
+import bisect
+import re
+import threading
+from typing import Optional
+from sqlalchemy import Row, event, func, inspect, literal_column, select
+from sqlalchemy.orm import Session
+from models import BOOK_COLUMNS, Book, BookCirculation
+
+TOKEN_RE = re.compile(r"\w+")
+INDEX_BUILD_BATCH_SIZE = 5000
+
+
+def tokenize(text: Optional[str]) -> list[str]:
+    """Lower-case word tokens, matching PostgreSQL's 'simple' text search config."""
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+class SearchQuery:
+    """Terms to match: `terms` against title and author, the others against one field each."""
+
+    def __init__(self, q: str = None, title: str = None, author: str = None, category_id: int = None):
+        self.terms = tokenize(q)
+        self.title_terms = tokenize(title)
+        self.author_terms = tokenize(author)
+        self.category_id = category_id
+
+    def has_terms(self) -> bool:
+        return bool(self.terms or self.title_terms or self.author_terms)
+
+    def is_empty(self) -> bool:
+        return not (self.has_terms() or self.category_id)
+
+
+def category_books(db: Session, category_id: int, limit: int, offset: int) -> list[Row]:
+    """A category's books with no terms to rank by: most borrowed first, then by title."""
+    return (
+        db.query(*BOOK_COLUMNS)
+        .outerjoin(BookCirculation, BookCirculation.book_id == Book.isbn_number)
+        .filter(Book.category_id == category_id)
+        .order_by(func.coalesce(BookCirculation.borrow_count, 0).desc(), Book.title, Book.isbn_number)
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+
+
+class SearchBackend:
+    """Interface every search backend implements."""
+
+    def search(self, db: Session, query: SearchQuery, limit: int, offset: int) -> list[Row]:
+        """Rows of BOOK_COLUMNS for the matching books, best match first."""
+        raise NotImplementedError
+
+    def index_book(self, isbn_number: str, title: str, author: str, category_id: int):
+        """Called after a commit that inserted or updated a book."""
+
+    def remove_book(self, isbn_number: str):
+        """Called after a commit that deleted a book."""
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Ranked prefix search over the generated `books.search_vector` tsvector column.
+
+    The column and its GIN index are maintained by the database, so the
+    index hooks are no-ops.
+    """
+
+    vector = literal_column("books.search_vector")
+
+    @staticmethod
+    def _tsquery(query: SearchQuery) -> str:
+        # Title words carry weight A and author words weight B in the vector,
+        # so a weight suffix restricts a prefix match to one field.
+        parts = [f"{term}:*" for term in query.terms]
+        parts += [f"{term}:*A" for term in query.title_terms]
+        parts += [f"{term}:*B" for term in query.author_terms]
+        return " & ".join(parts)
+
+    def search(self, db, query, limit, offset):
+        if not query.has_terms():
+            return category_books(db, query.category_id, limit, offset)
+        tsquery = func.to_tsquery("simple", self._tsquery(query))
+        books = db.query(*BOOK_COLUMNS).filter(self.vector.op("@@")(tsquery))
+        if query.category_id:
+            books = books.filter(Book.category_id == query.category_id)
+        return (
+            books.order_by(func.ts_rank(self.vector, tsquery).desc(), Book.isbn_number)
+            .offset(offset)
+            .limit(limit)
+            .all()
+        )
+
+
+class _PrefixIndex:
+    """Inverted index from token to ISBNs, with a sorted token list for prefix lookups."""
+
+    def __init__(self):
+        self.postings: dict[str, set[str]] = {}
+        self.tokens: list[str] = []
+
+    def add(self, token: str, isbn_number: str):
+        if token not in self.postings:
+            self.postings[token] = set()
+            bisect.insort(self.tokens, token)
+        self.postings[token].add(isbn_number)
+
+    def discard(self, token: str, isbn_number: str):
+        isbns = self.postings.get(token)
+        if isbns is None:
+            return
+        isbns.discard(isbn_number)
+        if not isbns:
+            del self.postings[token]
+            del self.tokens[bisect.bisect_left(self.tokens, token)]
+
+    def match_prefix(self, prefix: str) -> set[str]:
+        matches = set()
+        i = bisect.bisect_left(self.tokens, prefix)
+        while i < len(self.tokens) and self.tokens[i].startswith(prefix):
+            matches |= self.postings[self.tokens[i]]
+            i += 1
+        return matches
+
+
+class InMemorySearchBackend(SearchBackend):
+    """In-process inverted index used where the database has no full-text search (SQLite).
+
+    Built from a streamed scan of `books` on first use and kept current from
+    committed session changes afterwards.
+    """
+
+    TITLE_WEIGHT = 2
+    AUTHOR_WEIGHT = 1
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = False
+        self._title = _PrefixIndex()
+        self._author = _PrefixIndex()
+        self._docs: dict[str, tuple[list[str], list[str], int]] = {}
+
+    def _build(self, db: Session):
+        rows = db.execute(
+            select(Book.isbn_number, Book.title, Book.author, Book.category_id)
+            .execution_options(yield_per=INDEX_BUILD_BATCH_SIZE)
+        )
+        for row in rows:
+            self._add(*row)
+        self._built = True
+
+    def _add(self, isbn_number, title, author, category_id):
+        title_tokens, author_tokens = tokenize(title), tokenize(author)
+        for token in title_tokens:
+            self._title.add(token, isbn_number)
+        for token in author_tokens:
+            self._author.add(token, isbn_number)
+        self._docs[isbn_number] = (title_tokens, author_tokens, category_id)
+
+    def _remove(self, isbn_number):
+        doc = self._docs.pop(isbn_number, None)
+        if doc is None:
+            return
+        for token in doc[0]:
+            self._title.discard(token, isbn_number)
+        for token in doc[1]:
+            self._author.discard(token, isbn_number)
+
+    def index_book(self, isbn_number, title, author, category_id):
+        with self._lock:
+            if self._built:
+                self._remove(isbn_number)
+                self._add(isbn_number, title, author, category_id)
+
+    def remove_book(self, isbn_number):
+        with self._lock:
+            if self._built:
+                self._remove(isbn_number)
+
+    def _rank(self, query: SearchQuery) -> list[str]:
+        scores: Optional[dict[str, int]] = None
+
+        def require(matches: dict[str, int]):
+            nonlocal scores
+            if scores is None:
+                scores = matches
+            else:
+                scores = {isbn: score + matches[isbn] for isbn, score in scores.items() if isbn in matches}
+
+        for term in query.terms:
+            title_hits = self._title.match_prefix(term)
+            author_hits = self._author.match_prefix(term)
+            require({
+                isbn: self.TITLE_WEIGHT * (isbn in title_hits) + self.AUTHOR_WEIGHT * (isbn in author_hits)
+                for isbn in title_hits | author_hits
+            })
+        for term in query.title_terms:
+            require(dict.fromkeys(self._title.match_prefix(term), self.TITLE_WEIGHT))
+        for term in query.author_terms:
+            require(dict.fromkeys(self._author.match_prefix(term), self.AUTHOR_WEIGHT))
+
+        if query.category_id:
+            scores = {isbn: score for isbn, score in scores.items() if self._docs[isbn][2] == query.category_id}
+        return sorted(scores, key=lambda isbn: (-scores[isbn], isbn))
+
+    def search(self, db, query, limit, offset):
+        if not query.has_terms():
+            return category_books(db, query.category_id, limit, offset)
+        with self._lock:
+            if not self._built:
+                self._build(db)
+            page = self._rank(query)[offset:offset + limit]
+        if not page:
+            return []
+        books = {book.isbn_number: book for book in db.query(*BOOK_COLUMNS).filter(Book.isbn_number.in_(page))}
+        return [books[isbn] for isbn in page if isbn in books]
+
+
+_backend: Optional[SearchBackend] = None
+# Other in-process indexes of books, kept current alongside the backend
+_book_listeners: list = []
+
+
+def set_search_backend(backend: Optional[SearchBackend]):
+    """Install a search backend, or reset to auto-detection with None."""
+    global _backend
+    _backend = backend
+
+
+def add_book_listener(listener):
+    """Also call `listener.index_book` and `listener.remove_book` for every committed book change."""
+    _book_listeners.append(listener)
+
+
+def get_search_backend(db: Session) -> SearchBackend:
+    """Return the active backend, choosing one from the session's dialect on first use."""
+    global _backend
+    if _backend is None:
+        if db.get_bind().dialect.name == "postgresql":
+            _backend = PostgresSearchBackend()
+        else:
+            _backend = InMemorySearchBackend()
+    return _backend
+
+
+# Keep the active backend in sync with committed book changes. Changes are
+# collected per flush and only applied once the transaction commits.
+
+def queue_book_index(session: Session, isbn_number: str, title: str, author: str, category_id: int):
+    """Index a book once `session` commits; for writes that bypass the ORM unit of work."""
+    session.info.setdefault("search_changes", []).append(("index", (isbn_number, title, author, category_id)))
+
+
+def _indexed_fields_changed(book: Book) -> bool:
+    attrs = inspect(book).attrs
+    return any(attrs[name].history.has_changes() for name in ("isbn_number", "title", "author", "category_id"))
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_book_changes(session, flush_context):
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Book) and _indexed_fields_changed(obj):
+            queue_book_index(session, obj.isbn_number, obj.title, obj.author, obj.category_id)
+    for obj in session.deleted:
+        if isinstance(obj, Book):
+            session.info.setdefault("search_changes", []).append(("remove", (obj.isbn_number,)))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_book_changes(session):
+    changes = session.info.pop("search_changes", None)
+    indexes = [_backend, *_book_listeners] if _backend is not None else _book_listeners
+    if not changes or not indexes:
+        return
+    for index in indexes:
+        for action, args in changes:
+            if action == "index":
+                index.index_book(*args)
+            else:
+                index.remove_book(*args)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_book_changes(session):
+    session.info.pop("search_changes", None)
@@ -0,0 +1,137 @@
+"""
+Incrementally maintained circulation counters behind the /stats router.
+
+The counters are updated in the same transaction as the change they count,
+so dashboards read a handful of pre-aggregated rows instead of scanning
+member_book. Counters that every borrow would update (per category, per
+day) are sharded by ISBN so concurrent borrows rarely wait on the same row.
+"""
+import datetime
+import zlib
+from decouple import config
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from database import dialect_insert, increment_statement
+from models import Book, BookCirculation, CategoryStats, DailyCirculation, OverdueStats
+
+STATS_SHARDS = config("stats_shards", default=8, cast=int)
+OVERDUE_STATS_ID = 1
+
+
+def stats_shard(isbn_number: str) -> int:
+    return zlib.crc32(isbn_number.encode("utf-8")) % STATS_SHARDS
+
+
+def _category_of(isbn_number: str):
+    return select(Book.category_id).where(Book.isbn_number == isbn_number).scalar_subquery()
+
+
+async def adjust_category(db, category_id, isbn_number: str, total: int = 0, borrowed: int = 0):
+    """Add to a category's book and borrowed counts; `category_id` may be a subquery."""
+    await db.execute(increment_statement(
+        db.get_bind().dialect.name, CategoryStats,
+        {"category_id": category_id, "shard": stats_shard(isbn_number)},
+        total_books=total, borrowed_books=borrowed,
+    ))
+
+
+async def _count_day(db, isbn_number: str, borrows: int = 0, returns: int = 0):
+    await db.execute(increment_statement(
+        db.get_bind().dialect.name, DailyCirculation,
+        {"day": datetime.datetime.utcnow().date(), "shard": stats_shard(isbn_number)},
+        borrows=borrows, returns=returns,
+    ))
+
+
+async def record_borrow(db, isbn_number: str):
+    await adjust_category(db, _category_of(isbn_number), isbn_number, borrowed=1)
+    await db.execute(increment_statement(
+        db.get_bind().dialect.name, BookCirculation, {"book_id": isbn_number}, borrow_count=1,
+    ))
+    await _count_day(db, isbn_number, borrows=1)
+
+
+async def record_return(db, isbn_number: str):
+    await adjust_category(db, _category_of(isbn_number), isbn_number, borrowed=-1)
+    await _count_day(db, isbn_number, returns=1)
+
+
+async def _record_many(db, categories: dict[str, int], borrowed: int, day_counter: str):
+    dialect_name = db.get_bind().dialect.name
+    category_deltas = CategoryDeltas()
+    day_deltas: dict[int, int] = {}
+    for isbn_number, category_id in categories.items():
+        category_deltas.add(category_id, isbn_number, borrowed=borrowed)
+        shard = stats_shard(isbn_number)
+        day_deltas[shard] = day_deltas.get(shard, 0) + 1
+    for stmt in category_deltas.statements(dialect_name):
+        await db.execute(stmt)
+    today = datetime.datetime.utcnow().date()
+    for shard in sorted(day_deltas):
+        await db.execute(increment_statement(
+            dialect_name, DailyCirculation, {"day": today, "shard": shard},
+            **{"borrows": 0, "returns": 0, day_counter: day_deltas[shard]},
+        ))
+
+
+async def record_borrows(db, categories: dict[str, int]):
+    """record_borrow for several titles, given as ISBN to category id, in a few statements."""
+    if not categories:
+        return
+    await _record_many(db, categories, borrowed=1, day_counter="borrows")
+    table = BookCirculation.__table__
+    stmt = dialect_insert(db.get_bind().dialect.name, table).values([
+        {"book_id": isbn_number, "borrow_count": 1} for isbn_number in sorted(categories)
+    ])
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=["book_id"], set_={"borrow_count": table.c.borrow_count + stmt.excluded.borrow_count},
+    ))
+
+
+async def record_returns(db, categories: dict[str, int]):
+    """record_return for several titles, given as ISBN to category id."""
+    if categories:
+        await _record_many(db, categories, borrowed=-1, day_counter="returns")
+
+
+def set_overdue_count(session: Session, overdue_books: int):
+    """Record how many active borrows the overdue sweep that just finished marked overdue."""
+    table = OverdueStats.__table__
+    stmt = dialect_insert(session.get_bind().dialect.name, table).values(id=OVERDUE_STATS_ID, overdue_books=overdue_books)
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=["id"], set_={"overdue_books": stmt.excluded.overdue_books},
+    ))
+
+
+async def record_overdue_returns(db, count: int):
+    """Take returned borrows that the sweep had marked overdue off the overdue count."""
+    if count:
+        await db.execute(increment_statement(
+            db.get_bind().dialect.name, OverdueStats, {"id": OVERDUE_STATS_ID}, overdue_books=-count,
+        ))
+
+
+class CategoryDeltas:
+    """Accumulates category count changes so a batch write applies them in few statements."""
+
+    def __init__(self):
+        self.deltas: dict[tuple[int, int], list[int]] = {}
+
+    def add(self, category_id: int, isbn_number: str, total: int = 0, borrowed: int = 0):
+        delta = self.deltas.setdefault((category_id, stats_shard(isbn_number)), [0, 0])
+        delta[0] += total
+        delta[1] += borrowed
+
+    def statements(self, dialect_name: str):
+        """Yield one upsert per changed counter row, in key order so concurrent batches lock rows alike."""
+        for (category_id, shard), (total, borrowed) in sorted(self.deltas.items()):
+            if total or borrowed:
+                yield increment_statement(
+                    dialect_name, CategoryStats, {"category_id": category_id, "shard": shard},
+                    total_books=total, borrowed_books=borrowed,
+                )
+        self.deltas.clear()
+
+    def apply(self, session: Session):
+        for stmt in self.statements(session.get_bind().dialect.name):
+            session.execute(stmt)
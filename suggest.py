@@ -0,0 +1,372 @@
+"""
+Typeahead suggestions for the catalogue search box.
+
+SuggestIndex keeps every book's normalized title and author as sorted UTF-8
+keys packed into one bytes blob, so the keys starting with a prefix are two
+binary searches away. Prefixes matching more than HOT_RANGE keys get their
+CANDIDATES most borrowed books precomputed when the index is built; shorter
+ranges are ranked on the spot. A lookup touches at most a few hundred
+entries and never the database.
+
+Each worker builds its own index in the background at startup, from a
+streamed scan of books and their borrow counts, and rebuilds it every
+suggest_refresh_interval seconds so rankings follow borrowing. Books added,
+updated or deleted in between are applied as their sessions commit, the
+same way the search index is kept current.
+"""
+import asyncio
+import heapq
+import logging
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from typing import Iterable, Optional
+from decouple import config
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from database import get_engine
+from models import Book, BookCirculation
+from search import add_book_listener, tokenize
+
+SUGGEST_INDEX_ENABLED = config("suggest_index_enabled", default=True, cast=bool)
+# Seconds between rebuilds, which pick up new borrow counts; 0 builds once
+SUGGEST_REFRESH_INTERVAL = config("suggest_refresh_interval", default=3600, cast=float)
+SUGGEST_BUILD_BATCH_SIZE = config("suggest_build_batch_size", default=10000, cast=int)
+RETRY_SECONDS = 30
+
+MAX_SUGGESTIONS = 20
+# Prefixes matching more keys than this have their best CANDIDATES books
+# precomputed; the extra candidates cover books changed since the build
+HOT_RANGE = 256
+CANDIDATES = 32
+# Keys are cut to this many characters, which also bounds the build's recursion
+MAX_KEY_CHARS = 64
+ARTICLES = ("the ", "a ", "an ")
+
+logger = logging.getLogger("api.suggest")
+
+
+def normalize(text: Optional[str]) -> str:
+    """Lower-case words without accents, separated by single spaces."""
+    if not text:
+        return ""
+    if not text.isascii():
+        decomposed = unicodedata.normalize("NFKD", text)
+        text = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(tokenize(text))
+
+
+def suggestion_keys(title: Optional[str], author: Optional[str]) -> set[str]:
+    """
+    The strings a book is suggested for: its title, also without a leading
+    article, and its author, also surname first.
+    """
+    keys = set()
+    title, author = normalize(title), normalize(author)
+    if title:
+        keys.add(title)
+        for article in ARTICLES:
+            if title.startswith(article):
+                keys.add(title[len(article):])
+    if author:
+        keys.add(author)
+        forenames, _, surname = author.rpartition(" ")
+        if forenames:
+            keys.add(f"{surname} {forenames}")
+    return {key[:MAX_KEY_CHARS] for key in keys}
+
+
+def _entry(key: str, ordinal: int) -> bytes:
+    # A NUL never appears in a normalized key, so entries sort by key first
+    return key.encode("utf-8") + b"\x00" + ordinal.to_bytes(4, "big")
+
+
+def _entry_ordinal(entry: bytes) -> int:
+    return int.from_bytes(entry[-4:], "big")
+
+
+class _PackedStrings:
+    """Byte strings stored end to end in one buffer, found by an offsets array."""
+
+    def __init__(self):
+        self.blob = bytearray()
+        # 4 byte offsets, so at most 4 GiB of strings
+        self.offsets = array("I", [0])
+
+    def append(self, value: bytes):
+        self.blob += value
+        self.offsets.append(len(self.blob))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> bytes:
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.blob) + self.offsets.itemsize * len(self.offsets)
+
+
+class SuggestIndex:
+    """Prefix index over titles and authors, ranked by borrow count."""
+
+    def __init__(self, rows: Iterable[tuple[str, str, str, int]]):
+        """`rows` are (isbn_number, title, author, borrow_count), in byte order of isbn_number."""
+        started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.isbns, self.titles, self.authors = _PackedStrings(), _PackedStrings(), _PackedStrings()
+        self.popularity = array("q")
+        entries = []
+        for ordinal, (isbn_number, title, author, borrow_count) in enumerate(rows):
+            self.isbns.append(isbn_number.encode("utf-8"))
+            self.titles.append((title or "").encode("utf-8"))
+            self.authors.append((author or "").encode("utf-8"))
+            self.popularity.append(borrow_count or 0)
+            entries.extend(_entry(key, ordinal) for key in suggestion_keys(title, author))
+        self.size = len(self.popularity)
+
+        entries.sort()
+        self.keys = _PackedStrings()
+        self.ordinals = array("i")
+        for entry in entries:
+            self.keys.append(entry[:-5])
+            self.ordinals.append(_entry_ordinal(entry))
+        del entries
+
+        self.hot: dict[bytes, array] = {}
+        if len(self.keys):
+            self._candidates(b"", 0, len(self.keys))
+
+        # Changes since the build: books whose built keys no longer apply, and
+        # the current keys and fields of books added or updated
+        self.stale: set[int] = set()
+        self.added: list[bytes] = []
+        self.added_entries: dict[int, list[bytes]] = {}
+        self.changed: dict[int, tuple[str, str, str]] = {}
+        self.new_isbns: dict[str, int] = {}
+        self.build_seconds = time.perf_counter() - started
+
+    def _rank(self, ordinal: int) -> tuple[int, int]:
+        return -(self.popularity[ordinal] if ordinal < self.size else 0), ordinal
+
+    def _candidates(self, prefix: bytes, lo: int, hi: int) -> list[int]:
+        """
+        The best CANDIDATES books among keys[lo:hi], which all start with
+        `prefix`; stores them in `hot` if there are more than HOT_RANGE keys.
+        """
+        if hi - lo <= HOT_RANGE:
+            return heapq.nsmallest(CANDIDATES, set(self.ordinals[lo:hi]), key=self._rank)
+
+        # Keys equal to the prefix sort first, then one run per next byte
+        i = bisect_right(self.keys, prefix, lo, hi)
+        found = set(self.ordinals[lo:i])
+        while i < hi:
+            child = self.keys[i][:len(prefix) + 1]
+            end = bisect_left(self.keys, child + b"\xff", i, hi)
+            found.update(self._candidates(child, i, end))
+            i = end
+        best = heapq.nsmallest(CANDIDATES, found, key=self._rank)
+        self.hot[prefix] = array("i", best)
+        return best
+
+    def _ordinal(self, isbn_number: str) -> Optional[int]:
+        ordinal = self.new_isbns.get(isbn_number)
+        if ordinal is None:
+            encoded = isbn_number.encode("utf-8")
+            i = bisect_left(self.isbns, encoded)
+            if i < self.size and self.isbns[i] == encoded:
+                ordinal = i
+        return ordinal
+
+    def _unindex(self, ordinal: int):
+        self.stale.add(ordinal)
+        self.changed.pop(ordinal, None)
+        for entry in self.added_entries.pop(ordinal, ()):
+            del self.added[bisect_left(self.added, entry)]
+
+    def index_book(self, isbn_number: str, title: str, author: str, category_id: int = None):
+        with self._lock:
+            ordinal = self._ordinal(isbn_number)
+            if ordinal is None:
+                ordinal = self.new_isbns[isbn_number] = self.size + len(self.new_isbns)
+            self._unindex(ordinal)
+            self.changed[ordinal] = (isbn_number, title, author)
+            entries = self.added_entries[ordinal] = [_entry(key, ordinal) for key in suggestion_keys(title, author)]
+            for entry in entries:
+                insort(self.added, entry)
+
+    def remove_book(self, isbn_number: str):
+        with self._lock:
+            ordinal = self._ordinal(isbn_number)
+            if ordinal is not None:
+                self._unindex(ordinal)
+
+    def _book(self, ordinal: int) -> dict:
+        if ordinal in self.changed:
+            isbn_number, title, author = self.changed[ordinal]
+        else:
+            isbn_number, title, author = (
+                self.isbns[ordinal].decode("utf-8"), self.titles[ordinal].decode("utf-8"),
+                self.authors[ordinal].decode("utf-8"),
+            )
+        return {"isbn_number": isbn_number, "title": title, "author": author}
+
+    def suggest(self, prefix: str, limit: int = 10) -> list[dict]:
+        """Books with a title or author starting with `prefix`, most borrowed first."""
+        key = normalize(prefix)[:MAX_KEY_CHARS]
+        if not key:
+            return []
+        # "harry " should not match "harryhausen"
+        if prefix[-1:].isspace() and len(key) < MAX_KEY_CHARS:
+            key += " "
+        start = key.encode("utf-8")
+        # No UTF-8 byte is 0xff, so this sorts after every key starting with `start`
+        end = start + b"\xff"
+
+        with self._lock:
+            lo = bisect_left(self.keys, start)
+            hi = bisect_left(self.keys, end, lo)
+            best = None
+            if hi - lo > HOT_RANGE:
+                # Books past the precomputed candidates rank below all of them,
+                # so these are the best unless too many have changed since
+                current = [ordinal for ordinal in self.hot.get(start, ()) if ordinal not in self.stale]
+                if len(current) >= limit:
+                    best = current[:limit]
+            if best is None:
+                best = heapq.nsmallest(
+                    limit, {ordinal for ordinal in self.ordinals[lo:hi] if ordinal not in self.stale}, key=self._rank,
+                )
+            if self.added:
+                added = self.added[bisect_left(self.added, start):bisect_left(self.added, end)]
+                best = heapq.nsmallest(limit, set(best).union(map(_entry_ordinal, added)), key=self._rank)
+            return [self._book(ordinal) for ordinal in best]
+
+    def stats(self) -> dict:
+        """Sizes, and the approximate memory held by the index."""
+        hot = sys.getsizeof(self.hot) + sum(
+            sys.getsizeof(prefix) + sys.getsizeof(candidates) for prefix, candidates in self.hot.items()
+        )
+        packed = sum(strings.nbytes for strings in (self.isbns, self.titles, self.authors, self.keys))
+        return {
+            "books": self.size + len(self.new_isbns),
+            "keys": len(self.keys) + len(self.added),
+            "hot_prefixes": len(self.hot),
+            "changed_books": len(self.stale),
+            "memory_bytes": packed + self.ordinals.itemsize * len(self.ordinals)
+            + self.popularity.itemsize * len(self.popularity) + hot,
+            "build_ms": round(self.build_seconds * 1000),
+        }
+
+
+def load_suggest_index(session: Session) -> SuggestIndex:
+    """Build an index from a streamed scan of books and their borrow counts."""
+    # Byte order, whatever the database's collation, so ISBNs can be bisected
+    isbn_order = Book.isbn_number.collate("C") if session.get_bind().dialect.name == "postgresql" else Book.isbn_number
+    rows = session.execute(
+        select(Book.isbn_number, Book.title, Book.author, func.coalesce(BookCirculation.borrow_count, 0))
+        .outerjoin(BookCirculation, BookCirculation.book_id == Book.isbn_number)
+        .order_by(isbn_order)
+        .execution_options(yield_per=SUGGEST_BUILD_BATCH_SIZE)
+    )
+    return SuggestIndex(rows)
+
+
+_index: Optional[SuggestIndex] = None
+# Book changes committed while a rebuild runs, replayed onto the new index
+_pending: Optional[list] = None
+_swap_lock = threading.Lock()
+
+
+def get_suggest_index() -> Optional[SuggestIndex]:
+    """This worker's index, or None until it has been built."""
+    return _index
+
+
+def set_suggest_index(index: Optional[SuggestIndex]):
+    global _index
+    with _swap_lock:
+        _index = index
+
+
+def rebuild_suggest_index() -> dict:
+    """Build a new index from the database and swap it in."""
+    global _index, _pending
+    with _swap_lock:
+        _pending = []
+    try:
+        with Session(get_engine()) as session:
+            index = load_suggest_index(session)
+        with _swap_lock:
+            for method, args in _pending:
+                getattr(index, method)(*args)
+            _index = index
+    finally:
+        with _swap_lock:
+            _pending = None
+    return index.stats()
+
+
+class _BookChanges:
+    """Applies committed book changes to the current index (see search.add_book_listener)."""
+
+    def _apply(self, method: str, args: tuple):
+        with _swap_lock:
+            if _pending is not None:
+                _pending.append((method, args))
+            index = _index
+        if index is not None:
+            getattr(index, method)(*args)
+
+    def index_book(self, *args):
+        self._apply("index_book", args)
+
+    def remove_book(self, *args):
+        self._apply("remove_book", args)
+
+
+add_book_listener(_BookChanges())
+
+
+async def _refresh_periodically(interval: float):
+    while True:
+        try:
+            result = await run_in_threadpool(rebuild_suggest_index)
+            logger.info(
+                "Suggestion index built: %(books)d books, %(keys)d keys, %(memory_bytes)d bytes in %(build_ms)d ms",
+                result,
+            )
+        except Exception:
+            logger.exception("Suggestion index build failed")
+            await asyncio.sleep(RETRY_SECONDS)
+            continue
+        if interval <= 0:
+            return
+        await asyncio.sleep(interval)
+
+
+_refresher: Optional[asyncio.Task] = None
+
+
+def start_suggest_index():
+    """Build this worker's index in the background and keep refreshing it, unless disabled."""
+    global _refresher
+    if _refresher is None and SUGGEST_INDEX_ENABLED:
+        _refresher = asyncio.get_running_loop().create_task(_refresh_periodically(SUGGEST_REFRESH_INTERVAL))
+
+
+async def stop_suggest_index():
+    global _refresher
+    if _refresher is None:
+        return
+    _refresher.cancel()
+    try:
+        await _refresher
+    except asyncio.CancelledError:
+        pass
+    _refresher = None